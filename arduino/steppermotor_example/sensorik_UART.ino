@@ -4,14 +4,40 @@
 #include "A4988.h"
 
 // ----- Makro zur bedingten Nutzung von Serial1 -----
-#ifdef Serial1
-  #define WRITE_SERIAL1(val) Serial1.println("ACK:" val)
-#else
-  #define WRITE_SERIAL1(val) Serial.println("ACK:" val)
-#endif
+// writeAck sendet im Binärmodus einen Frame statt der Textzeile
+#define WRITE_SERIAL1(val) writeAck(atoi(val))
+
+// ----- Binäres Protokoll -----
+// Frame: SYNC, Opcode, Sequenznummer, Länge, Nutzdaten, CRC-8 (Polynom 0x07)
+#define FRAME_SYNC 0xA5
+#define MAX_PAYLOAD 16
+#define OP_PING    0x00
+#define OP_TOGGLE  0x01
+#define OP_SETUP   0x02
+#define OP_CLEANUP 0x03
+#define OP_MOVE    0x04
+#define OP_LIGHT   0x05
+#define OP_COLOR   0x06
+#define OP_STEP    0x07
+#define OP_ACK     0x80
+
+// ----- Nothalt -----
+// Ein einzelnes ABORT-Byte (ASCII CAN) bricht das laufende Kommando zwischen zwei
+// Motorschritten ab, im Leerlauf wird es ignoriert
+#define ABORT_BYTE 0x18
+
+bool binaryMode = false;   // wird durch "PROTO BIN <baudrate>" aktiviert
+uint8_t currentSeq = 0;    // Sequenznummer des aktuellen binären Kommandos
+
+// Debug-Ausgaben entfallen im Binärmodus
+#define LOG_PRINT(x) do { if (!binaryMode) Serial.print(x); } while (0)
+#define LOG_PRINTLN(x) do { if (!binaryMode) Serial.println(x); } while (0)
 
 
 #define NUM_CYCLES 20
+// Anzahl der Tastendrücke, bevor STEP das Schreiben einer Farbe aufgibt, falls der Host
+// keine Anzahl (TOGGLE_IO_BAND_RETRYS) mitsendet
+#define TOGGLE_RETRIES 10
 const int lichtThreshold = 512;  // Beispiel-Schwellwert, ggf. anpassen
 
 // ----- Pin-Zuweisungen für den Haupt-Schrittmotor -----
@@ -58,6 +84,9 @@ void cleanupHandler(char* args);
 void moveHandler(char* args);
 void lightHandler(char* args);
 void colorHandler(char* args);
+void stepHandler(char* args);
+void protoHandler(char* args);
+void writeAck(int value);
 
 // Funktionszeiger-Typ für Kommandohandler
 typedef void (*CommandHandler)(char* args);
@@ -75,7 +104,9 @@ Command commands[] = {
   {"CLEANUP", cleanupHandler},
   {"MOVE",    moveHandler},
   {"LIGHT",    lightHandler},
-  {"COLOR",   colorHandler}
+  {"COLOR",   colorHandler},
+  {"STEP",    stepHandler},
+  {"PROTO",   protoHandler}
 };
 
 const int numCommands = sizeof(commands) / sizeof(Command);
@@ -85,6 +116,14 @@ const int numCommands = sizeof(commands) / sizeof(Command);
 //
 void processSerialInput() {
   digitalWrite(Sleep, LOW);
+  if (Serial.available() > 0 && Serial.peek() == ABORT_BYTE) {
+    Serial.read();  // kein laufendes Kommando, nichts abzubrechen
+    return;
+  }
+  if (binaryMode) {
+    processBinaryInput();
+    return;
+  }
   if (Serial.available() > 0) {
     // Lese den eingehenden Befehl bis zum Newline-Zeichen
     String commandStr = Serial.readStringUntil('\n');
@@ -124,6 +163,69 @@ void processSerialInput() {
   }
 }
 
+uint8_t crc8(const uint8_t* data, uint8_t length, uint8_t crc) {
+  for (uint8_t i = 0; i < length; i++) {
+    crc ^= data[i];
+    for (uint8_t bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (uint8_t)((crc << 1) ^ 0x07) : (uint8_t)(crc << 1);
+    }
+  }
+  return crc;
+}
+
+const char* directionName(uint8_t direction) {
+  // Werte wie ROBOT_DIRECTIONS in assets.py
+  switch (direction) {
+    case 1: return "LEFT";
+    case 2: return "RIGHT";
+    default: return "HOLD";
+  }
+}
+
+//
+// --- Binäre Frames lesen und auf die Text-Handler abbilden ---
+//
+void processBinaryInput() {
+  if (Serial.available() == 0) return;
+  if (Serial.read() != FRAME_SYNC) return;
+
+  uint8_t header[3];  // Opcode, Sequenznummer, Länge
+  if (Serial.readBytes(header, 3) != 3) return;
+  uint8_t length = header[2];
+  if (length > MAX_PAYLOAD) return;
+  uint8_t payload[MAX_PAYLOAD];
+  if (Serial.readBytes(payload, length) != length) return;
+  uint8_t crc;
+  if (Serial.readBytes(&crc, 1) != 1) return;
+  if (crc8(payload, length, crc8(header, 3, 0)) != crc) return;  // fehlerhafter Frame
+
+  currentSeq = header[1];
+  char args[32] = "";
+  switch (header[0]) {
+    case OP_PING:    writeAck(1); break;
+    case OP_TOGGLE:  toggleHandler(args); break;
+    case OP_SETUP:   setupHandler(args); break;
+    case OP_CLEANUP: cleanupHandler(args); break;
+    case OP_LIGHT:   lightHandler(args); break;
+    case OP_COLOR:   colorHandler(args); break;
+    case OP_MOVE:
+      // Nutzdaten: Richtung, Delay, Schritte (2 Byte, little endian)
+      snprintf(args, sizeof(args), "%s %u %u", directionName(payload[0]), payload[1],
+               (unsigned int)(payload[2] | (payload[3] << 8)));
+      moveHandler(args);
+      break;
+    case OP_STEP:
+      // Nutzdaten: Farbe, Richtung, Delay, Schritte (2 Byte, little endian), Tastendrücke
+      snprintf(args, sizeof(args), "%u %s %u %u %u", payload[0], directionName(payload[1]),
+               payload[2], (unsigned int)(payload[3] | (payload[4] << 8)),
+               length > 5 ? payload[5] : TOGGLE_RETRIES);
+      stepHandler(args);
+      break;
+    default:
+      writeAck(-1);  // unbekanntes Kommando
+  }
+}
+
 //
 // --- Handler-Funktionen ---
 //
@@ -151,31 +253,31 @@ void moveHandler(char* args) {
   // Erwartetes Format: <direction> <delay_ms> <steps>
   char* token = strtok(args, " ");
   if (token == NULL) { 
-    Serial.println("MOVE: missing direction"); 
+    LOG_PRINTLN("MOVE: missing direction"); 
     return; 
   }
   const char* direction = token;
 
   token = strtok(NULL, " ");
   if (token == NULL) { 
-    Serial.println("MOVE: missing delay"); 
+    LOG_PRINTLN("MOVE: missing delay"); 
     return; 
   }
   int delay_ms = atoi(token);
 
   token = strtok(NULL, " ");
   if (token == NULL) { 
-    Serial.println("MOVE: missing steps"); 
+    LOG_PRINTLN("MOVE: missing steps"); 
     return; 
   }
   int steps = atoi(token);
 
-  Serial.print("MOVE: direction: ");
-  Serial.print(direction);
-  Serial.print(", delay_ms: ");
-  Serial.print(delay_ms);
-  Serial.print(", steps: ");
-  Serial.println(steps);
+  LOG_PRINT("MOVE: direction: ");
+  LOG_PRINT(direction);
+  LOG_PRINT(", delay_ms: ");
+  LOG_PRINT(delay_ms);
+  LOG_PRINT(", steps: ");
+  LOG_PRINTLN(steps);
   handleMove(direction, delay_ms, steps);
 }
 
@@ -183,9 +285,58 @@ void lightHandler(char* args) {
   light_barrier();
 }
 
+void stepHandler(char* args) {
+  // Erwartetes Format: <write_color> <direction> <delay_ms> <steps> [<toggle_retries>]
+  // Schreibt die Farbe, prüft sie, fährt und meldet die neue Farbe unter dem Kopf.
+  // ACK: 0 = Fehler, 1 = ROT, 2 = BLAU, 3 = LEER (Farbe + 1)
+  char* token = strtok(args, " ");
+  if (token == NULL) {
+    LOG_PRINTLN("STEP: missing write_color");
+    return;
+  }
+  int write_color = atoi(token);
+
+  token = strtok(NULL, " ");
+  if (token == NULL) {
+    LOG_PRINTLN("STEP: missing direction");
+    return;
+  }
+  const char* direction = token;
+
+  token = strtok(NULL, " ");
+  if (token == NULL) {
+    LOG_PRINTLN("STEP: missing delay");
+    return;
+  }
+  int delay_ms = atoi(token);
+
+  token = strtok(NULL, " ");
+  if (token == NULL) {
+    LOG_PRINTLN("STEP: missing steps");
+    return;
+  }
+  int steps = atoi(token);
+
+  // optional, ältere Hosts senden die Anzahl der Tastendrücke nicht mit
+  token = strtok(NULL, " ");
+  int toggle_retries = (token == NULL) ? TOGGLE_RETRIES : atoi(token);
+
+  LOG_PRINT("STEP: write_color: ");
+  LOG_PRINT(write_color);
+  LOG_PRINT(", direction: ");
+  LOG_PRINT(direction);
+  LOG_PRINT(", delay_ms: ");
+  LOG_PRINT(delay_ms);
+  LOG_PRINT(", steps: ");
+  LOG_PRINT(steps);
+  LOG_PRINT(", toggle_retries: ");
+  LOG_PRINTLN(toggle_retries);
+  handleStep(write_color, direction, delay_ms, steps, toggle_retries);
+}
+
 void light_barrier() {
   int sensorWert = analogRead(lichtschrankePin);  // Auslesen des Sensors
-  Serial.println(sensorWert);  // Ausgabe des binären Wertes zur Überwachung
+  LOG_PRINTLN(sensorWert);  // Ausgabe des binären Wertes zur Überwachung
   delay(100);                   // Kurze Pause
   (sensorWert >= lichtThreshold) ? WRITE_SERIAL1("1") : WRITE_SERIAL1("0");
 }
@@ -193,19 +344,80 @@ void light_barrier() {
 //
 // --- Funktionen zur Ausführung der Befehle ---
 //
-void handleToggle() {
-  Serial.println("TOGGLE command received: Simuliere Tastendruck.");
+void writeAck(int value) {
+  if (binaryMode) {
+    uint8_t frame[7] = {FRAME_SYNC, OP_ACK, currentSeq, 2,
+                        (uint8_t)(value & 0xFF), (uint8_t)((value >> 8) & 0xFF), 0};
+    frame[6] = crc8(frame + 1, 5, 0);
+    Serial.write(frame, sizeof(frame));
+    return;
+  }
+  #ifdef Serial1
+    Serial1.print("ACK:");
+    Serial1.println(value);
+  #else
+    Serial.print("ACK:");
+    Serial.println(value);
+  #endif
+}
+
+void protoHandler(char* args) {
+  // Erwartetes Format: BIN <baudrate>
+  char* token = strtok(args, " ");
+  if (token == NULL || strcmp(token, "BIN") != 0) {
+    WRITE_SERIAL1("0");
+    return;
+  }
+  token = strtok(NULL, " ");
+  if (token == NULL) {
+    WRITE_SERIAL1("0");
+    return;
+  }
+  long baudrate = atol(token);
+  WRITE_SERIAL1("1");
+  Serial.flush();  // ACK noch mit der alten Baudrate senden
+  Serial.begin(baudrate);
+  binaryMode = true;
+}
+
+void pressButton() {
   digitalWrite(Sleep_Arm, HIGH);
   stepper2.rotate(-15);
   delay(100);
   stepper2.rotate(15);
-  Serial.println("Tastendruck simuliert.");
   digitalWrite(Sleep_Arm, LOW);
+}
+
+void handleToggle() {
+  LOG_PRINTLN("TOGGLE command received: Simuliere Tastendruck.");
+  pressButton();
+  LOG_PRINTLN("Tastendruck simuliert.");
   WRITE_SERIAL1("1");
 }
 
+void handleStep(int write_color, const char* direction, int delay_ms, int steps,
+                int toggle_retries) {
+  // Farbe schreiben und prüfen, höchstens toggle_retries Tastendrücke
+  int retries = 0;
+  while (read_color() != write_color) {
+    if (retries >= toggle_retries || abortRequested()) {
+      LOG_PRINTLN("STEP: Farbe konnte nicht geschrieben werden.");
+      writeAck(0);
+      return;
+    }
+    pressButton();
+    retries++;
+  }
+  // Fahren, HOLD bleibt stehen
+  if (strcmp(direction, "HOLD") != 0 && !moveSteps(direction, delay_ms, steps)) {
+    writeAck(0);
+    return;
+  }
+  writeAck(read_color() + 1);
+}
+
 void handleSetup() {
-  Serial.println("SETUP command received: Hardware wird neu initialisiert.");
+  LOG_PRINTLN("SETUP command received: Hardware wird neu initialisiert.");
   
   // Konfiguriere die Pins als Outputs
   pinMode(Step, OUTPUT);
@@ -239,33 +451,53 @@ void handleSetup() {
   digitalWrite(S0_PIN, HIGH);
   digitalWrite(S1_PIN, HIGH);
   
-  Serial.println("Setup abgeschlossen.");
+  LOG_PRINTLN("Setup abgeschlossen.");
   WRITE_SERIAL1("1");
 }
 
 void handleCleanup() {
-  Serial.println("CLEANUP command received: Motoren werden in den Schlafmodus versetzt.");
+  LOG_PRINTLN("CLEANUP command received: Motoren werden in den Schlafmodus versetzt.");
   digitalWrite(Sleep, LOW);
   digitalWrite(Sleep_Arm, LOW);
-  Serial.println("Motoren im Schlafmodus.");
+  LOG_PRINTLN("Motoren im Schlafmodus.");
   WRITE_SERIAL1("1");
 }
 
-void handleMove(const char* direction, int delay_ms, int steps) {
-  digitalWrite(Sleep, HIGH);
+bool abortRequested() {
+  if (Serial.available() > 0 && Serial.peek() == ABORT_BYTE) {
+    Serial.read();
+    LOG_PRINTLN("ABORT: Kommando abgebrochen.");
+    return true;
+  }
+  return false;
+}
+
+bool moveSteps(const char* direction, int delay_ms, int steps) {
+  int rotation;
   if (strcmp(direction, "LEFT") == 0) {
-    for (int i = 0; i < abs(steps); i++) {
-      stepper.rotate(1);
-      delay(delay_ms);
-    }
+    rotation = 1;
   }
   else if (strcmp(direction, "RIGHT") == 0) {
-    for (int i = 0; i < abs(steps); i++) {
-      stepper.rotate(-1);
-      delay(delay_ms);
+    rotation = -1;
+  } else { return false; }
+  digitalWrite(Sleep, HIGH);
+  for (int i = 0; i < abs(steps); i++) {
+    if (abortRequested()) {
+      digitalWrite(Sleep, LOW);
+      return false;
     }
-  } else { WRITE_SERIAL1("0");}
+    stepper.rotate(rotation);
+    delay(delay_ms);
+  }
   digitalWrite(Sleep, LOW);
+  return true;
+}
+
+void handleMove(const char* direction, int delay_ms, int steps) {
+  if (!moveSteps(direction, delay_ms, steps)) {
+    WRITE_SERIAL1("0");
+    return;
+  }
   WRITE_SERIAL1("1");
 }
 
@@ -289,25 +521,28 @@ double measure_color(int s2_state, int s3_state) {
   return NUM_CYCLES / duration;  // Frequenz in Hz
 }
 
-void determine_color() {
+// Liefert 0 = Rot, 1 = Blau, 2 = Leer
+int read_color() {
   const double RED_THRESHOLD = 500000;   // anpassen, wenn nötig
   const double BLUE_THRESHOLD = 500000;  // anpassen, wenn nötig
   
   double redFreq = measure_color(LOW, LOW);
   double blueFreq = measure_color(LOW, HIGH);
 
-  Serial.println(redFreq);
-  Serial.println(blueFreq);
+  LOG_PRINTLN(redFreq);
+  LOG_PRINTLN(blueFreq);
   
   if (redFreq > RED_THRESHOLD & redFreq > blueFreq) {
-    WRITE_SERIAL1("0"); //Red
+    return 0; //Red
   } 
   else if (blueFreq > BLUE_THRESHOLD & blueFreq > redFreq) {
-    WRITE_SERIAL1("1"); //Blue
+    return 1; //Blue
   } 
-  else {
-    WRITE_SERIAL1("2");//Blank
-  }
+  return 2; //Blank
+}
+
+void determine_color() {
+  writeAck(read_color());
 }
 
 //
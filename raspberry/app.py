@@ -5,22 +5,28 @@ It defines the routes and its associated functions.
 
 import os
 import json
-import ctypes
-from pprint import pprint
-from threading import Thread
-from flask import (Flask, request, redirect, url_for, render_template, flash, send_from_directory)
-from flask_socketio import SocketIO, emit
+import hashlib
+import logging
+from threading import Lock
+from flask import (Flask, request, redirect, url_for, render_template, flash, send_from_directory,
+                   abort, Response, jsonify)
+from flask_socketio import SocketIO, emit, join_room
 
 import assets
+import batch_simulation
+import program_artifact
 import turingmachine_interpreter as tm_interp
-import dannweisstobiesnicht as sm
+from program_cache import PROGRAM_CACHE
+from dispatcher import Dispatcher, parse_robots
+import metrics
+from logging_setup import LOG_BUFFER, set_level, setup_logging
 
-# pylint: disable=global-statement
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*")
 
-MACHINE: sm.StateMachine | None = None
-CURRENT_MACHINE_THREAD: Thread | None = None
+APP_LOGGER = logging.getLogger("app")
+# robot choice of a run which starts on the next idle robot
+ANY_ROBOT = "beliebig"
 
 # INIT--------------------------------------------------------------------------------------
 # Set the secret key to some random bytes. Keep this really secret!
@@ -30,16 +36,28 @@ app.secret_key = 'this is a very secure secret key which we will definitely repl
 
 def load_config():
     """Loads and returns the config from the config.json file. Fallback to default values."""
-    if os.path.exists(assets.CONFIG_PATH):
-        with open(assets.CONFIG_PATH, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {  # Fallback
+    config = {  # Fallback
         "LED_AMOUNT": assets.LED_AMOUNT,
         "STEPS_BETWEEN_LEDS": assets.STEPS_BETWEEN_LEDS,
         "STEPS_BETWEEN_HOME_TO_FIRST_LED": assets.STEPS_BETWEEN_HOME_TO_FIRST_LED,
         "TOGGLE_IO_BAND_RETRYS": assets.TOGGLE_IO_BAND_RETRYS,
-        "UPLOAD_FOLDER": assets.UPLOAD_FOLDER
+        "MAX_COALESCED_LEDS": assets.MAX_COALESCED_LEDS,
+        "PLAN_STEP_BUDGET": assets.PLAN_STEP_BUDGET,
+        "MAX_BROADCAST_RATE": assets.MAX_BROADCAST_RATE,
+        "UPLOAD_FOLDER": assets.UPLOAD_FOLDER,
+        "HARDWARE_BACKEND": assets.HARDWARE_BACKEND,
+        "SIMULATION_INPUT": assets.SIMULATION_INPUT,
+        "SERIAL_PORT": assets.SERIAL_PORT,
+        "SERIAL_PROTOCOL": assets.SERIAL_PROTOCOL,
+        "BINARY_BAUDRATE": assets.BINARY_BAUDRATE,
+        "LOG_LEVEL": assets.LOG_LEVEL,
+        "EXECUTION_MODE": assets.EXECUTION_MODE,
+        "ROBOTS": assets.ROBOTS
     }
+    if os.path.exists(assets.CONFIG_PATH):
+        with open(assets.CONFIG_PATH, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    return config
 
 
 app.config.update(load_config())  # Set the config values
@@ -47,14 +65,24 @@ app.config.update(load_config())  # Set the config values
 # CONFIG------------------------------------------------------------------------------------
 
 CONFIG_FIELDS = ["LED_AMOUNT", "STEPS_BETWEEN_LEDS", "STEPS_BETWEEN_HOME_TO_FIRST_LED",
-                 "TOGGLE_IO_BAND_RETRYS", "UPLOAD_FOLDER"]
+                 "TOGGLE_IO_BAND_RETRYS", "MAX_COALESCED_LEDS", "PLAN_STEP_BUDGET",
+                 "MAX_BROADCAST_RATE", "UPLOAD_FOLDER", "HARDWARE_BACKEND", "SIMULATION_INPUT",
+                 "SERIAL_PORT", "SERIAL_PROTOCOL", "BINARY_BAUDRATE", "LOG_LEVEL",
+                 "EXECUTION_MODE", "ROBOTS"]
 
 @app.route('/settings', methods=['GET', 'POST'])
 def settings():
     """Renders the settings page and updates config on POST request."""
     if request.method == 'GET':
         config = {key: app.config[key] for key in CONFIG_FIELDS}
-        return render_template('settings.html', config=config), 200
+        backends = [backend.value for backend in assets.HARDWARE_BACKENDS]
+        protocols = [protocol.value for protocol in assets.SERIAL_PROTOCOLS]
+        log_levels = [level.value for level in assets.LOG_LEVELS]
+        execution_modes = [mode.value for mode in assets.EXECUTION_MODES]
+        return render_template('settings.html', config=config, backends=backends,
+                               protocols=protocols, log_levels=log_levels,
+                               execution_modes=execution_modes,
+                               log_records=LOG_BUFFER.latest()), 200
     for key in CONFIG_FIELDS:
         if key in request.form:
             try:
@@ -62,6 +90,28 @@ def settings():
             except ValueError:
                 flash(f'Ungültiger Wert für {key}', 'error')
                 return redirect(url_for('settings'))
+    for key, choices, default in [("HARDWARE_BACKEND", assets.HARDWARE_BACKENDS,
+                                   assets.HARDWARE_BACKEND),
+                                  ("SERIAL_PROTOCOL", assets.SERIAL_PROTOCOLS,
+                                   assets.SERIAL_PROTOCOL),
+                                  ("LOG_LEVEL", assets.LOG_LEVELS, assets.LOG_LEVEL),
+                                  ("EXECUTION_MODE", assets.EXECUTION_MODES,
+                                   assets.EXECUTION_MODE)]:
+        if app.config[key] not in [choice.value for choice in choices]:
+            flash(f'Ungültiger Wert für {key}', 'error')
+            app.config[key] = default
+            return redirect(url_for('settings'))
+    if app.config['MAX_BROADCAST_RATE'] <= 0:
+        flash('Ungültiger Wert für MAX_BROADCAST_RATE', 'error')
+        app.config['MAX_BROADCAST_RATE'] = assets.MAX_BROADCAST_RATE
+        return redirect(url_for('settings'))
+    try:
+        parse_robots(app.config['ROBOTS'])  # the robots are created at the next start
+    except ValueError as e:
+        flash(str(e), 'error')
+        app.config['ROBOTS'] = assets.ROBOTS
+        return redirect(url_for('settings'))
+    set_level(app.config['LOG_LEVEL'])  # the log level is active immediately
 
     # save new config in config.json persistently
     with open(assets.CONFIG_PATH, "w", encoding="utf-8") as f:
@@ -72,66 +122,103 @@ def settings():
 
 # WEB-SOCKET--------------------------------------------------------------------------------
 
+# every robot has its own websocket room, the clients of a robot page join it
+DISPATCHER = Dispatcher(socketio, app)
+_SERVER_STARTED = False
+_SERVER_LOCK = Lock()
+
+
+@app.before_request
+def start_server():
+    """
+    Starts the logging listener and the worker threads of the robots, once. The import of
+    the app starts no threads, so the process pools can use the default start method.
+    Called at the start of the server and before a request, e.g. with "flask run".
+    """
+    global _SERVER_STARTED  # pylint: disable=global-statement
+    with _SERVER_LOCK:
+        if _SERVER_STARTED:
+            return
+        setup_logging(app.config['LOG_LEVEL'])
+        DISPATCHER.start()
+        _SERVER_STARTED = True
+
+
+def robot_of(name: str | None):
+    """
+    Returns the robot of a websocket message, the first robot if there is no name and None
+    for an unknown or invalid name.
+    """
+    if name is not None and not isinstance(name, str):
+        return None
+    return DISPATCHER.robot(name or None)
+
+
 @socketio.on('connect')
 def handle_connect():
-    """Handles the websocket connection of a new client."""
-    print('Client connected')
-    broadcast_machine_state()
-
-
-def broadcast_machine_state():
-    """Broadcasts the machine state to all connected clients every second."""
-    if MACHINE:
-        socketio.emit('state_update', {
-            'program_name': MACHINE.program_name,
-            'state': MACHINE.current_state,
-            'step': MACHINE.steps,
-            'position': MACHINE.position,
-            'run': MACHINE.running,
-            'pause': MACHINE.pause,
-            'speed': MACHINE.speed,
-            'errors': MACHINE.errors,
-            'should_stop': MACHINE.should_stop
-        })
+    """Handles the websocket connection of a new client, it joins the room of its robot."""
+    robot = robot_of(request.args.get('robot'))
+    if robot is None:
+        return False  # rejects the connection
+    APP_LOGGER.info("Client connected: %s (robot %s)", request.sid, robot.name)
+    join_room(robot.room)
+    robot.broadcaster.send_snapshot(request.sid)
+    return True
+
+
+@socketio.on('resume_events')
+def handle_resume_events(data):
+    """Sends the machine events after the last sequence number the client has seen."""
+    if not isinstance(data, dict):
+        data = {}
+    try:
+        last_seq = max(0, int(data.get('last_seq', 0)))
+    except (TypeError, ValueError, OverflowError):
+        last_seq = 0  # invalid client data, all events are sent again
+    robot = robot_of(data.get('robot'))
+    if robot is not None:
+        robot.broadcaster.send_events(request.sid, last_seq)
 
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handles the websocket disconnection of a client."""
-    print('Client disconnected', request.sid)
+    APP_LOGGER.info("Client disconnected: %s", request.sid)
 
 
 @socketio.on('command')
 def handle_command(data):
-    """Handles incoming commands from the client."""
-    if not MACHINE and not MACHINE.running:
+    """Handles incoming commands from the client for the machine of its robot."""
+    robot = robot_of(data.get('robot'))
+    machine = robot.machine if robot is not None else None
+    if machine is None:
         emit('error', {'message': 'No machine is running'})
         return
 
     command = data.get('command')
     if command == 'resume':
-        if MACHINE.pause:
-            MACHINE.resume_program()
-        elif not MACHINE.running or MACHINE.should_stop:
+        if machine.pause:
+            machine.resume_program()
+        elif not machine.running or machine.should_stop:
             emit('error', {'message': 'Maschine ist nicht am Laufen'})
         else:
             emit('error', {'message': 'Maschine ist nicht pausiert'})
     elif command == 'pause':
-        if MACHINE.pause:
+        if machine.pause:
             emit('error', {'message': 'Maschine ist bereits pausiert'})
             return
-        if not MACHINE.running or MACHINE.should_stop:
+        if not machine.running or machine.should_stop:
             emit('error', {'message': 'Maschine ist nicht am Laufen'})
             return
-        MACHINE.pause_program()
+        machine.pause_program()
     elif command == 'stop':
-        if not MACHINE.running or MACHINE.should_stop:
+        if not machine.running or machine.should_stop:
             emit('error', {'message': 'Maschine ist nicht am Laufen'})
             return
-        MACHINE.stop_program()
+        machine.stop_program()
     elif command == 'speed':
         speed = int(data.get('value'))
-        MACHINE.change_speed(speed)
+        machine.change_speed(speed)
     emit('confirmation', {'message': f'Command {command} executed'})
 
 
@@ -140,10 +227,15 @@ def handle_command(data):
 @app.route('/', methods=['GET'])
 def index():
     """Renders the index page."""
-    programms = os.listdir(app.config['UPLOAD_FOLDER'])
+    # the folder also contains the compiled artifacts
+    programms = [filename for filename in os.listdir(app.config['UPLOAD_FOLDER'])
+                 if allowed_file(filename)]
     languages = [lang.value for lang in assets.PROGRAM_LANGUAGES]
-    return render_template('index.html', languages=languages,
-                           programms=programms), 200
+    robot_names = [ANY_ROBOT] + list(DISPATCHER.robots)
+    priorities = [priority.value for priority in assets.RUN_PRIORITIES]
+    return render_template('index.html', languages=languages, programms=programms,
+                           robots=robot_names, priorities=priorities,
+                           default_priority=assets.RUN_PRIORITIES.NORMAL.value), 200
 
 
 def allowed_file(filename):
@@ -159,12 +251,11 @@ def upload_file():
     if not language:
         flash('Keine oder unbekannte Sprache ausgewählt', 'error')
         return redirect(url_for('index'))
-    print(language)
     if 'file' not in request.files:
         flash('Keine Datei ausgewählt', 'error')
         return redirect(url_for('index'))
     file = request.files['file']
-    print(file)
+    APP_LOGGER.debug("Upload of %s with language %s", file, language)
     if not file:
         flash('Upload fehlgeschlagen', 'error')
         return redirect(url_for('index'))
@@ -181,11 +272,16 @@ def upload_file():
     # Check if file already exists
     if os.path.exists(filepath):
         flash(f"Das Programm {file.filename} existiert bereits und wird überschrieben.", 'error')
+    # analyze the uploaded stream before it is saved
+    digest = hashlib.sha256()
+    tm_code = tm_interp.parse_turing_machine_stream(file.stream, language, file.filename, digest)
+    PROGRAM_CACHE.invalidate(filepath)
+    file.stream.seek(0)
     file.save(filepath)
+    program_artifact.write_artifact(filepath, tm_code, language, digest.digest())
+    PROGRAM_CACHE.put(filepath, language, tm_code)
     flash(f"Datei {file.filename} erfolgreich hochgeladen!", 'success')
-    # analyze file
-    tm_code = tm_interp.parse_turing_machine(filepath, language)
-    pprint(tm_code)
+    APP_LOGGER.debug("Machine code: %s", tm_code)
     if tm_code["errors"] or tm_code["warnings"]:
         return render_template('parser_error.html', errors=tm_code["errors"],
                                warnings=tm_code["warnings"], tm_code=tm_code), 200
@@ -197,6 +293,8 @@ def delete_file(programm):
     """Deletes the provided programm."""
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], programm)
     if os.path.exists(filepath):
+        PROGRAM_CACHE.invalidate(filepath)
+        program_artifact.remove_artifacts(filepath)
         os.remove(filepath)
         flash(f"Programm {programm} erfolgreich gelöscht!", 'success')
     else:
@@ -206,18 +304,7 @@ def delete_file(programm):
 
 @app.route('/run', methods=['POST'])
 def run_program():
-    """Runs the provided program. Stops current program if running."""
-    global MACHINE, CURRENT_MACHINE_THREAD
-
-    # Check if a machine is already running
-    if MACHINE and MACHINE.running:
-        MACHINE.stop_program()
-        if CURRENT_MACHINE_THREAD:
-            CURRENT_MACHINE_THREAD.join()  # Wait for the machine to come to a finish point
-        else:
-            assert False, "MACHINE is running but there is no CURRENT_MACHINE_THREAD"
-
-    # Load the new program
+    """Queues the provided program for the selected robot or for the next idle robot."""
     program = request.form['program']
     if not program:
         flash('Kein Programm ausgewählt', 'error')
@@ -226,71 +313,105 @@ def run_program():
     if not language:
         flash('Keine oder unbekannte Sprache ausgewählt', 'error')
         return redirect(url_for('index'))
-    print(language)
+    robot_name = request.form.get('robot', ANY_ROBOT)
+    robot = None if robot_name == ANY_ROBOT else DISPATCHER.robot(robot_name)
+    if robot_name != ANY_ROBOT and robot is None:
+        flash(f'Unbekannter Roboter {robot_name}', 'error')
+        return redirect(url_for('index'))
+    try:
+        priority = assets.RUN_PRIORITIES(
+            request.form.get('priority', assets.RUN_PRIORITIES.NORMAL.value))
+    except ValueError:
+        flash('Unbekannte Priorität ausgewählt', 'error')
+        return redirect(url_for('index'))
     filepath = os.path.join(app.config['UPLOAD_FOLDER'], program)
-    tm_code = tm_interp.parse_turing_machine(filepath, language)
-    print(f"Program {program} loaded with language {language}. Machine code:")
-    pprint(tm_code)
+    tm_code = PROGRAM_CACHE.get(filepath, language)
+    APP_LOGGER.debug("Program %s loaded with language %s. Machine code: %s", program, language,
+                     tm_code)
     if tm_code["errors"]:
         return render_template('parser_error.html', errors=tm_code["errors"],
                                warnings=tm_code["warnings"], tm_code=tm_code), 200
 
-    # Create and start a new machine
-    MACHINE = sm.StateMachine(tm_code, app)
-    MACHINE.add_listener(broadcast_machine_state)
-
-    def background_task():
-        """Runs the machine in a separate thread."""
-        MACHINE.run()
-
-    CURRENT_MACHINE_THREAD = Thread(target=background_task, daemon=True, name=f"TMZA-{program}")
-    CURRENT_MACHINE_THREAD.start()
-
-    return redirect(url_for('running_program'))
+    # the worker thread of the robot starts the machine when the run is next
+    run = DISPATCHER.submit(tm_code, program, priority, robot)
+    if run.robot is None:
+        flash(f'Programm {program} wartet auf den nächsten freien Roboter.', 'success')
+        return redirect(url_for('robot_overview'))
+    return redirect(url_for('robot_page', name=run.robot))
+
+
+@app.route('/robots', methods=['GET'])
+def robot_overview():
+    """Renders the overview of the robots and their queues."""
+    overview = [(robot, robot.state(), DISPATCHER.queued(robot))
+                for robot in DISPATCHER.robots.values()]
+    return render_template('robots.html', robots=overview,
+                           shared_queue=DISPATCHER.queued()), 200
+
+
+@app.route('/robot/<name>', methods=['GET'])
+def robot_page(name):
+    """Renders the status page of the robot, it is updated by the websocket room."""
+    robot = DISPATCHER.robot(name)
+    if robot is None:
+        abort(404)
+    infos = dict(robot.state(), errors=robot.errors())
+    return render_template('running_program.html', infos=infos), 200
 
 
 @app.route('/running_program', methods=['GET'])
 def running_program():
-    """Renders the running program page."""
-    # global MACHINE
-    if not MACHINE:
-        flash('Was soll ich denn anzeigen, wenn sich noch nichts bewegt?', 'error')
-        return redirect(url_for('index'))
-    infos = {
-        'program_name': MACHINE.program_name,
-        'state': MACHINE.current_state,
-        'step': MACHINE.steps,
-        'run': MACHINE.running,
-        'pause': MACHINE.pause,
-        'speed': MACHINE.speed,
-        'errors': MACHINE.errors,
-        'should_stop': MACHINE.should_stop,
-        'position': MACHINE.position
-    }
-    return render_template('running_program.html', infos=infos), 200
+    """Renders the status page of the first robot."""
+    return redirect(url_for('robot_page', name=DISPATCHER.robot().name))
+
+
+@app.route('/cancel/<int:run_id>', methods=['GET'])
+def cancel_run(run_id):
+    """Removes a queued run."""
+    run = DISPATCHER.cancel(run_id)
+    if run is None:
+        flash('Der Lauf ist nicht (mehr) in der Warteschlange.', 'error')
+    else:
+        flash(f'Programm {run.program} aus der Warteschlange entfernt.', 'success')
+    return redirect(url_for('robot_overview'))
+
+
+@app.route('/robot/<name>/release', methods=['GET'])
+def release_robot(name):
+    """Releases a robot after an emergency stop, it starts its next queued run."""
+    robot = DISPATCHER.robot(name)
+    if robot is None:
+        abort(404)
+    robot.release()
+    flash(f'Roboter {name} freigegeben.', 'success')
+    return redirect(url_for('robot_overview'))
+
+
+@app.route('/robot/<name>/emergency_stop', methods=['GET'])
+def robot_emergency_stop(name):
+    """emergency stops the running maschine of the robot immediately."""
+    robot = DISPATCHER.robot(name)
+    if robot is None:
+        abort(404)
+    # the machine thread ends cooperatively, the serial link stays consistent
+    if not robot.emergency_stop():
+        flash(f'Keine laufende Maschine auf Roboter {name} für den Nothalt gefunden.', 'error')
+        return redirect(url_for('robot_overview'))
+    flash(f'Emergency-Stop ausgeführt. Roboter {name} gestoppt, '
+          'die Warteschlange wartet auf die Freigabe.', 'success')
+    return redirect(url_for('robot_overview'))
 
 
 @app.route('/emergency_stop', methods=['GET'])
 def emergency_stop():
-    """emergency stops a running maschine immediately."""
-    global MACHINE, CURRENT_MACHINE_THREAD
-
-    if not MACHINE or not MACHINE.running:
+    """emergency stops the running maschines of all robots immediately."""
+    stopped = [robot.name for robot in DISPATCHER.robots.values() if robot.emergency_stop()]
+    if not stopped:
         flash('Keine laufende Maschine für den Nothalt gefunden.', 'error')
         return redirect(url_for('index'))
-
-    if not CURRENT_MACHINE_THREAD or not CURRENT_MACHINE_THREAD.is_alive():
-        flash('Keinen laufenden Maschinen-Thread für den Nothalt gefunden.', 'error')
-        return redirect(url_for('index'))
-    ctypes.pythonapi.PyThreadState_SetAsyncExc(
-        ctypes.c_long(CURRENT_MACHINE_THREAD.ident),
-        ctypes.py_object(SystemExit)
-    )
-    # reset the machine
-    MACHINE = None
-    CURRENT_MACHINE_THREAD = None
-    flash('Emergency-Stop ausgeführt. Maschine gestoppt.', 'success')
-    return redirect(url_for('index'))
+    flash(f'Emergency-Stop ausgeführt. Roboter {", ".join(stopped)} gestoppt, '
+          'die Warteschlangen warten auf die Freigabe.', 'success')
+    return redirect(url_for('robot_overview'))
 
 
 @app.route('/download/<filename>')
@@ -299,12 +420,50 @@ def download_file(filename):
     return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 
+@app.route('/simulate/<program>', methods=['POST'])
+def simulate_program(program):
+    """
+    Simulates the program on a batch of inputs, the JSON body contains "inputs" (list of band
+    inputs like "0110"), optionally "language", "max_steps" and "max_seconds" per input.
+    The limits are reduced to BATCH_MAX_STEPS and BATCH_MAX_SECONDS of the server.
+    The results are streamed as NDJSON, one line per input as soon as it is finished.
+    """
+    data = request.get_json(silent=True) or {}
+    inputs = data.get('inputs')
+    if not isinstance(inputs, list) or not all(isinstance(item, str) for item in inputs):
+        return jsonify(error='inputs muss eine Liste von Bandeingaben sein'), 400
+    try:
+        language = assets.PROGRAM_LANGUAGES(
+            data.get('language', assets.PROGRAM_LANGUAGES.COM.value))
+        max_steps = int(data.get('max_steps', assets.BATCH_MAX_STEPS))
+        max_seconds = float(data.get('max_seconds', assets.BATCH_MAX_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify(error='Ungültige Sprache oder ungültiges Limit'), 400
+    if not (max_steps > 0 and max_seconds > 0):  # also rejects NaN
+        return jsonify(error='Die Limits müssen positiv sein'), 400
+    try:
+        results = batch_simulation.simulate_program(
+            program, inputs, language, min(max_steps, assets.BATCH_MAX_STEPS),
+            min(max_seconds, assets.BATCH_MAX_SECONDS), upload_folder=app.config['UPLOAD_FOLDER'])
+    except batch_simulation.ProgramNotFoundError as e:
+        return jsonify(error=str(e)), 404
+    except batch_simulation.BatchError as e:  # the program has errors
+        return jsonify(error=str(e)), 422
+    return Response((json.dumps(result) + "\n" for result in results),
+                    mimetype='application/x-ndjson')
+
+
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Serves the step, homing and serial metrics in the Prometheus text format."""
+    return metrics.render_metrics(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
 # ERROR-----------------------------------------------------------------
 @app.errorhandler(404)
 def page_not_found(e):
     """Renders the 404 error page."""
-    # logger().warning("404 error: %s - %s", request.url, e)
-    print("404 error: %s - %s", request.url, e)
+    APP_LOGGER.warning("404 error: %s - %s", request.url, e)
     return render_template('errorHandling/404.html'), 404
 
 
@@ -316,4 +475,5 @@ def robots():
 
 # MAIN------------------------------------------------------------------
 if __name__ == '__main__':
+    start_server()
     socketio.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,197 @@
+"""
+This module contains a timing-accurate Arduino emulator on a pseudo-terminal.
+The emulator speaks the protocol of arduino/steppermotor_example/sensorik_UART.ino like
+fake_serial.FakeSerial, but behind a real serial device path. The StepperMotorController
+connects to it by SERIAL_PORT, so run latency and homing time can be measured without
+the robot. UART byte time, motor moves, button presses and sensor readings take as long as
+on the real hardware (scaled by the speed factor).
+
+Usage (from the raspberry folder):
+    python arduino_emulator.py [--input 0110] [--speed 1.0]
+"""
+import argparse
+import os
+import queue
+import select
+import time
+import tty
+from threading import Event, Lock, Thread
+
+import assets
+import serial_protocol
+from fake_serial import FakeArduino, FakeSerial
+from simulator import VirtualBand
+
+# firmware timings in seconds, see sensorik_UART.ino
+RPM = 20
+DEGREES_PER_SECOND = RPM * 360 / 60
+BUTTON_PRESS_SECONDS = 2 * 15 / DEGREES_PER_SECOND + 0.1  # rotate(-15), delay(100), rotate(15)
+COLOR_SECONDS = 2 * 0.2  # two color filters, each waits 200 ms for stabilization
+LIGHT_SECONDS = 0.1
+# one start bit, 8 data bits, one stop bit
+UART_BITS_PER_BYTE = 10
+
+
+def uart_seconds(byte_amount: int, baudrate: int) -> float:
+    """Time to transfer the bytes over the UART at the baudrate."""
+    return byte_amount * UART_BITS_PER_BYTE / baudrate
+
+
+def move_seconds(delay_ms: int, steps: int) -> float:
+    """Duration of moveSteps, every step rotates the motor by one degree and waits delay_ms."""
+    return abs(steps) * (1 / DEGREES_PER_SECOND + delay_ms / 1000)
+
+
+class TimedArduino(FakeArduino):
+    """
+    FakeArduino which takes as long as the firmware for every command.
+    speed scales all durations, 0 executes commands without waiting.
+    Like the firmware, MOVE and STEP stop when the abort event is set and answer ACK 0.
+    """
+
+    def __init__(self, band: VirtualBand, speed: float = 1.0, baudrate: int = assets.BAUDRATE):
+        super().__init__(band)
+        self.speed = speed
+        self.baudrate = baudrate
+        self.abort = Event()
+
+    def wait(self, seconds: float) -> bool:
+        """Sleeps for the scaled duration. Returns False if the command was aborted."""
+        if self.speed > 0:
+            return not self.abort.wait(seconds * self.speed)
+        return not self.abort.is_set()
+
+    def handle_proto(self, args) -> list[str]:
+        """The firmware switches its baudrate after the ACK."""
+        result = super().handle_proto(args)
+        if self.binary_mode:
+            self.baudrate = int(args[1])
+        return result
+
+    def handle_toggle(self, args) -> list[str]:
+        self.wait(BUTTON_PRESS_SECONDS)
+        return super().handle_toggle(args)
+
+    def handle_move(self, args) -> list[str]:
+        if len(args) == 3 and not self.wait(move_seconds(int(args[1]), int(args[2]))):
+            return ["ABORT: Kommando abgebrochen.", "ACK:0"]
+        return super().handle_move(args)
+
+    def handle_light(self, args) -> list[str]:
+        self.wait(LIGHT_SECONDS)
+        return super().handle_light(args)
+
+    def handle_color(self, args) -> list[str]:
+        self.wait(COLOR_SECONDS)
+        return super().handle_color(args)
+
+    def handle_step(self, args) -> list[str]:
+        if len(args) not in (4, 5):
+            return super().handle_step(args)
+        # read_color before every button press and after the move
+        write_color = int(args[0])
+        presses = (write_color - self.band.color().value) % len(assets.IO_BAND_COLORS)
+        presses = min(presses, self.step_toggle_retries(args))
+        seconds = (presses + 2) * COLOR_SECONDS + presses * BUTTON_PRESS_SECONDS
+        if args[1] != assets.ROBOT_DIRECTIONS.HOLD.name:
+            seconds += move_seconds(int(args[2]), int(args[3]))
+        if not self.wait(seconds):
+            return ["ABORT: Kommando abgebrochen.", "ACK:0"]
+        return super().handle_step(args)
+
+
+class ArduinoEmulator:
+    """
+    Serves a TimedArduino on a pseudo-terminal, port is the path to connect to.
+    Every received chunk takes its UART time, is executed by the FakeSerial protocol
+    handling, and the answer is sent back after its own UART time. Commands run on a worker
+    thread, so an ABORT byte interrupts the running command like on the firmware.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, band: VirtualBand, speed: float = 1.0, baudrate: int = assets.BAUDRATE):
+        self.arduino = TimedArduino(band, speed, baudrate)
+        self.serial = FakeSerial(self.arduino, timeout=0)
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+        self._running = False
+        self._received = queue.Queue()  # chunks waiting for the worker, None stops it
+        self._busy = 0  # chunks received but not answered yet
+        self._busy_lock = Lock()
+        self._threads = [Thread(target=self._serve, daemon=True, name="TMZA-arduino-emulator"),
+                         Thread(target=self._work, daemon=True, name="TMZA-arduino-worker")]
+
+    def start(self):
+        """Starts answering on the pseudo-terminal."""
+        self._running = True
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Stops the emulator and closes the pseudo-terminal."""
+        self._running = False
+        self.arduino.abort.set()
+        self._received.put(None)
+        for thread in self._threads:
+            thread.join(1)
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _serve(self):
+        """Reads the pseudo-terminal, an ABORT byte is handled at once like an interrupt."""
+        while self._running:
+            readable, _, _ = select.select([self._master], [], [], 0.1)
+            if not readable:
+                continue
+            try:
+                data = os.read(self._master, 1024)
+            except OSError:
+                return  # pseudo-terminal closed
+            with self._busy_lock:
+                if data == serial_protocol.ABORT:
+                    if self._busy:
+                        self.arduino.abort.set()
+                    continue  # ignored while idle
+                self._busy += 1
+            self._received.put(data)
+
+    def _work(self):
+        """Executes the received chunks one after the other."""
+        while (data := self._received.get()) is not None:
+            self.arduino.wait(uart_seconds(len(data), self.arduino.baudrate))
+            baudrate = self.arduino.baudrate  # the ACK of PROTO uses the old baudrate
+            self.serial.write(data)
+            answer = self.serial.read(self.serial.in_waiting) if self.serial.in_waiting else b""
+            if answer:
+                self.arduino.wait(uart_seconds(len(answer), baudrate))
+                os.write(self._master, answer)
+            with self._busy_lock:
+                self._busy -= 1
+                if not self._busy:
+                    self.arduino.abort.clear()
+
+
+def main():
+    """Starts an emulator and prints the port for the SERIAL_PORT config."""
+    parser = argparse.ArgumentParser(description="Timing-accurate Arduino emulator.")
+    parser.add_argument("--input", default="", help="band input, e.g. 0110")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="factor for all durations, 0 answers immediately")
+    parser.add_argument("--led-amount", type=int, default=assets.LED_AMOUNT)
+    args = parser.parse_args()
+
+    band = VirtualBand(args.led_amount, assets.STEPS_BETWEEN_LEDS,
+                       assets.STEPS_BETWEEN_HOME_TO_FIRST_LED, args.input)
+    emulator = ArduinoEmulator(band, args.speed)
+    emulator.start()
+    print(f"Arduino emulator on {emulator.port}, set SERIAL_PORT to this path.")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
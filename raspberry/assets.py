@@ -14,8 +14,9 @@ PROGRAM_LANGUAGES = Enum('Language',
                              ('IO', 'turingmachine.io')
                          ])
 
-# colors of the io band
-IO_BAND_COLORS = Enum('Color', [('RED', 0), ('BLUE', 1), ('BLANK', 2)])
+# colors of the io band, the qualname lets the worker processes unpickle parsed programs
+IO_BAND_COLORS = Enum('Color', [('RED', 0), ('BLUE', 1), ('BLANK', 2)],
+                      qualname='IO_BAND_COLORS')
 
 # LEDs
 LED_AMOUNT = 60
@@ -25,11 +26,41 @@ STEPS_BETWEEN_HOME_TO_FIRST_LED = 20
 # the amount of retries for the robot to toggle the io band before giving up
 TOGGLE_IO_BAND_RETRYS = 10
 
+# the maximum amount of LEDs the robot passes with a single move when a scan is predicted,
+# 1 disables the coalescing of moves
+MAX_COALESCED_LEDS = 60
+
+# the maximum amount of steps the program is simulated before the robot starts,
+# the run is rejected if it does not reach an accept state within the budget. 0 disables planning
+PLAN_STEP_BUDGET = 0
+
+# the maximum amount of state updates per second sent to the websocket clients
+MAX_BROADCAST_RATE = 10
+
+# the amount of machine events (errors, program starts) kept for reconnecting clients
+EVENT_JOURNAL_SIZE = 1000
+
+# the amount of parsed programs kept in memory
+PROGRAM_CACHE_SIZE = 32
+
+# default and maximum limits of an input of the batch simulation, larger limits of a request
+# are reduced to them, and the amount of processes (0 = all cores)
+BATCH_MAX_STEPS = 1_000_000
+BATCH_MAX_SECONDS = 10
+BATCH_WORKERS = 0
+# default step budget per input of the equivalence check and amount of reported counterexamples
+EQUIVALENCE_MAX_STEPS = 10_000
+EQUIVALENCE_COUNTEREXAMPLES = 10
+
+# parsing of a program stops after this amount of syntax errors
+MAX_PARSE_ERRORS = 20
+
 # Path to the configuration file for dynamically changing the configuration
 CONFIG_PATH = 'static/config.json'
 
-# directions the robot can move
-ROBOT_DIRECTIONS = Enum('Direction', [('LEFT', 1), ('RIGHT', 2), ('HOLD', 3)])
+# directions the robot can move, the qualname lets the worker processes unpickle parsed programs
+ROBOT_DIRECTIONS = Enum('Direction', [('LEFT', 1), ('RIGHT', 2), ('HOLD', 3)],
+                        qualname='ROBOT_DIRECTIONS')
 
 # Light barrier configuration
 SENSOR_PIN = 18 # gpiod pin for the light barrier
@@ -39,3 +70,35 @@ CHIP = "/dev/gpiochip0"  # Standard GPIO-Chip auf dem Raspberry Pi 5
 SERIAL_PORT = "/dev/ttyACM0"
 BAUDRATE = 9600
 TIMEOUT = 30
+# seconds the emergency stop waits for the machine thread to end
+EMERGENCY_STOP_TIMEOUT = 2
+# robots of the dispatcher as "name=port,name=port", empty = a single robot on SERIAL_PORT
+ROBOTS = ''
+# priorities of queued runs, the first starts first
+RUN_PRIORITIES = Enum('RunPriority', [('HIGH', 'hoch'), ('NORMAL', 'normal'),
+                                      ('LOW', 'niedrig')])
+
+# serial protocols, binary frames are negotiated at connect time, text is the fallback
+SERIAL_PROTOCOLS = Enum('Protocol', [('TEXT', 'text'), ('BINARY', 'binary')])
+SERIAL_PROTOCOL = SERIAL_PROTOCOLS.BINARY.value
+BINARY_BAUDRATE = 115200
+
+# hardware backends the StepperMotorController can run on
+HARDWARE_BACKENDS = Enum('Backend', [('SERIAL', 'serial'), ('SIMULATION', 'simulation')])
+HARDWARE_BACKEND = HARDWARE_BACKENDS.SERIAL.value
+
+# execution modes of a run: a machine thread with blocking serial calls, or an event loop in
+# the machine thread which awaits the serial port, the pauses and the state updates
+EXECUTION_MODES = Enum('ExecutionMode', [('THREAD', 'thread'), ('ASYNCIO', 'asyncio')])
+EXECUTION_MODE = EXECUTION_MODES.THREAD.value
+
+# band input of the simulated IO band, "0" = red, "1" = blue, "_" = blank
+SIMULATION_INPUT = ''
+
+# log levels selectable in the settings, records below the level are not formatted
+LOG_LEVELS = Enum('LogLevel', [('DEBUG', 'DEBUG'), ('INFO', 'INFO'), ('WARNING', 'WARNING'),
+                               ('ERROR', 'ERROR')])
+LOG_LEVEL = LOG_LEVELS.INFO.value
+
+# the amount of log records kept for the settings page
+LOG_BUFFER_SIZE = 500
@@ -0,0 +1,246 @@
+"""
+This module contains the asyncio variant of the StepperMotorController.
+The serial port is non-blocking and registered at the event loop, received bytes are
+dispatched by the AckDispatcher of hardware_control and the ACKs are awaited as asyncio
+Futures. Motion, sensing and the UI updates of a machine then run on a single event loop.
+The event loop needs add_reader, i.e. a selector event loop on Linux like the serial backend.
+"""
+import asyncio
+import platform
+
+import assets
+import serial_protocol
+from fake_serial import FakeArduino
+from hardware_control import (ACK_UNKNOWN_COMMAND, HARDWARE_LOGGER, AckDispatcher,
+                              StepperMotorController, ack_timed_out, create_virtual_band,
+                              move_command, move_delay, move_failed)
+from metrics import SERIAL_COMMAND_SECONDS
+
+if platform.system() == "Linux":
+    import serial
+
+
+class AsyncStepperMotorController(StepperMotorController):
+    """
+    StepperMotorController whose commands are coroutines, they have to be awaited on the
+    event loop which called open. The protocol handling (binary frames, STEP fallback,
+    cancel_token) is the one of the StepperMotorController.
+    """
+    # pylint: disable=invalid-overridden-method, too-many-instance-attributes
+
+    def connect(self, serial_port, baudrate, timeout):
+        """The port is opened by open on the event loop."""
+        self._port_settings = (serial_port, baudrate, timeout)
+        self._loop = None
+        self._write_buffer = b""
+        self.opened = False
+
+    async def open(self):
+        """Opens the non-blocking serial port and negotiates the protocol, once."""
+        if self.opened:
+            return
+        serial_port, baudrate, _ = self._port_settings
+        self._loop = asyncio.get_running_loop()
+        try:
+            if platform.system() != "Linux":  # pyserial is only installed on Linux
+                raise OSError(f"The serial port {serial_port} is only supported on Linux")
+            # pylint: disable-next=possibly-used-before-assignment
+            self.ser = serial.Serial(serial_port, baudrate, timeout=0, write_timeout=0)
+        except Exception as e:
+            HARDWARE_LOGGER.error("Error opening serial port: %s", e)
+            raise e
+        await asyncio.sleep(2)  # the Arduino resets when the port is opened
+        self.ser.reset_input_buffer()
+        self.reader = AckDispatcher(self._loop.create_future)
+        self._loop.add_reader(self.ser.fileno(), self._read)
+        if (assets.SERIAL_PROTOCOLS(self.app.config['SERIAL_PROTOCOL'])
+                is assets.SERIAL_PROTOCOLS.BINARY):
+            await self.negotiate_binary_protocol(self.app.config['BINARY_BAUDRATE'])
+        self.opened = True
+
+    def detach(self):
+        """Unregisters the serial port from the event loop, call it on the loop."""
+        if self._loop is not None and self.ser is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self.ser.fileno())
+            self._loop.remove_writer(self.ser.fileno())
+        self._loop = None
+
+    def close(self):
+        """Closes the serial port, detach has to be called on the event loop before."""
+        if self.ser is not None:
+            self.ser.close()
+
+    def _read(self):
+        """Called by the event loop when the serial port is readable."""
+        try:
+            data = self.ser.read(self.ser.in_waiting or 1)
+        except (OSError, TypeError) as e:  # port closed or unplugged, also SerialException
+            HARDWARE_LOGGER.error("Serial port can not be read: %s", e)
+            self.detach()
+            return
+        if data:
+            self.reader.feed(data)
+
+    def _write(self, data: bytes):
+        """Writes as much as the port takes, the rest is written when it becomes writable."""
+        if self._write_buffer:
+            self._write_buffer += data
+            return
+        written = self.ser.write(data) or 0
+        if written < len(data):
+            self._write_buffer = data[written:]
+            self._loop.add_writer(self.ser.fileno(), self._flush_write_buffer)
+
+    def _flush_write_buffer(self):
+        written = self.ser.write(self._write_buffer) or 0
+        self._write_buffer = self._write_buffer[written:]
+        if not self._write_buffer:
+            self._loop.remove_writer(self.ser.fileno())
+
+    async def negotiate_binary_protocol(self, baudrate: int) -> bool:
+        """See StepperMotorController.negotiate_binary_protocol."""
+        ack = await self.send_command(
+            serial_protocol.NEGOTIATE_COMMAND.format(baudrate=baudrate))
+        if ack != 1:
+            HARDWARE_LOGGER.warning(
+                "Firmware does not support the binary protocol, using the text protocol.")
+            return False
+        await asyncio.sleep(0.05)  # the firmware switches its baudrate after the ACK
+        old_baudrate = self._use_binary_protocol(baudrate)
+        if await self.send_command("PING") != 1:
+            error = self.binary_protocol_failed(baudrate, old_baudrate)
+            self.detach()
+            self.close()
+            raise error
+        HARDWARE_LOGGER.info("Binary protocol at %s baud.", baudrate)
+        return True
+
+    async def wait_for_ack(self, ack: asyncio.Future, timeout=assets.TIMEOUT):
+        """
+        Awaits the ACK of a command. A cancel of the cancel_token is called from another
+        thread, it cancels the Future on the event loop and the wait ends with 0.
+        """
+        loop = self._loop
+        handle = self.cancel_token.add_callback(lambda: loop.call_soon_threadsafe(ack.cancel))
+        try:
+            return await asyncio.wait_for(ack, timeout)
+        except asyncio.CancelledError:
+            if not self.cancel_token.cancelled:
+                raise  # the task itself was cancelled
+            HARDWARE_LOGGER.info("Waiting for the ACK was cancelled.")
+            return 0
+        except asyncio.TimeoutError:
+            return ack_timed_out()
+        finally:
+            self.cancel_token.remove_callback(handle)
+
+    async def send_command(self, command: str) -> int:
+        """Writes the command without blocking and awaits its ACK, see send_command."""
+        with SERIAL_COMMAND_SECONDS.time(command.split(" ", 1)[0]):
+            if self.cancel_token.cancelled:
+                return 0
+            return await self._send_command(command)
+
+    async def _send_command(self, command: str) -> int:
+        ack, data = self.prepare_command(command)
+        try:
+            self._write(data)
+        except OSError as e:  # serial.SerialException is an OSError
+            self.reader.discard(ack)  # the ACK of the next command must not go to it
+            HARDWARE_LOGGER.error("Serial error: Command could not be sent: %s", e)
+            return 0
+        return int(await self.wait_for_ack(ack))
+
+    async def toggle_io_band(self):
+        """Toggles the IO band state."""
+        return await self.send_command("TOGGLE")
+
+    async def move_robot_led_step(self, direction: assets.ROBOT_DIRECTIONS, speed=1,
+                                  steps=1) -> int:
+        """See StepperMotorController.move_robot_led_step."""
+        if not self.count_position(direction, steps):
+            return -2
+        if not await self.move_robot(direction, speed,
+                                     self.app.config['STEPS_BETWEEN_LEDS'] * steps):
+            return move_failed(direction, speed, steps)
+        return self.current_position
+
+    async def move_robot(self, direction: assets.ROBOT_DIRECTIONS, speed: int = 5,
+                         steps: int = 1) -> bool:
+        """See StepperMotorController.move_robot."""
+        if direction is assets.ROBOT_DIRECTIONS.HOLD:
+            return True
+        delay_in_ms = move_delay(direction, speed, steps)
+        return await self.send_command(move_command(direction, delay_in_ms, steps)) != 0
+
+    async def get_lb_state(self) -> bool:
+        """Get the state of the light barrier (True if blocked)."""
+        state = await self.send_command("LIGHT") == 1
+        HARDWARE_LOGGER.debug("Light barrier: get_lb_state will return %s.", state)
+        return state
+
+    async def get_color(self):
+        """Retrieves the detected color from the color sensor."""
+        color = assets.IO_BAND_COLORS(int(await self.send_command("COLOR")))
+        HARDWARE_LOGGER.debug("get color: %s", color)
+        return color
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    async def execute_step(self, write_color: assets.IO_BAND_COLORS,
+                           direction: assets.ROBOT_DIRECTIONS, speed=1, steps=1,
+                           current_color: assets.IO_BAND_COLORS | None = None):
+        """See StepperMotorController.execute_step."""
+        new_position, out_of_band, command = self.step_command(write_color, direction, speed,
+                                                               steps)
+        if self.fused_step_supported:
+            result = self.step_result(int(await self.send_command(command)), new_position,
+                                      out_of_band)
+            if result is not None:
+                return result
+        # Fallback: single commands
+        toggle_retry = 0
+        color = current_color if current_color is not None else await self.get_color()
+        while color != write_color:
+            toggle_retry += 1
+            if not self.may_toggle(toggle_retry):
+                return -3, None
+            await self.toggle_io_band()
+            color = await self.get_color()
+        if out_of_band:
+            return -2, None
+        return await self.move_robot_led_step(direction, speed, steps), None
+
+
+class AsyncSimulatedStepperMotorController(AsyncStepperMotorController):
+    """
+    Asyncio variant of the simulation backend. The commands are executed by a FakeArduino
+    on the VirtualBand of the SIMULATION_INPUT, it answers immediately.
+    """
+    # pylint: disable=attribute-defined-outside-init
+
+    async def open(self):
+        """Creates the virtual band instead of opening a serial connection."""
+        if not self.opened:
+            self.arduino = FakeArduino(create_virtual_band(self.app.config))
+            self.opened = True
+
+    async def send_command(self, command: str) -> int:
+        """Executes the command on the FakeArduino and returns its ACK."""
+        if self.cancel_token.cancelled:
+            return 0
+        answer = self.arduino.execute(command)[-1]
+        if answer == "Unknown command.":
+            return ACK_UNKNOWN_COMMAND
+        return int(answer.split("ACK:")[1]) if answer.startswith("ACK:") else 0
+
+
+def create_async_stepper_controller(app, cancel_token=None) -> AsyncStepperMotorController:
+    """
+    Creates the AsyncStepperMotorController for the HARDWARE_BACKEND selected in the config,
+    it has to be opened on the event loop.
+    """
+    backend = assets.HARDWARE_BACKENDS(app.config['HARDWARE_BACKEND'])
+    if backend is assets.HARDWARE_BACKENDS.SIMULATION:
+        return AsyncSimulatedStepperMotorController(app, cancel_token=cancel_token)
+    return AsyncStepperMotorController(app, serial_port=app.config['SERIAL_PORT'],
+                                       cancel_token=cancel_token)
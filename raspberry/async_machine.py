@@ -0,0 +1,201 @@
+"""
+This module contains the asyncio execution mode of the StateMachine.
+The AsyncStateMachine awaits its AsyncStepperMotorController, so the serial port, the waits
+for ACKs, pauses and the state updates to the websocket clients share one event loop in
+the machine thread. The decisions of a run (transitions, errors, planning) are the ones
+of the StateMachine.
+"""
+import asyncio
+
+import assets
+import async_hardware
+from dannweisstobiesnicht import MACHINE_LOGGER, StateMachine
+from metrics import HOME_SECONDS, STEP_PHASE_SECONDS
+
+
+class AsyncStateMachine(StateMachine):
+    """
+    StateMachine whose run, single_step and home_robot are coroutines.
+    pause_program, resume_program, stop_program and emergency_stop are called by other
+    threads like on the StateMachine, the CancellationToken wakes the event loop.
+    """
+    # pylint: disable=invalid-overridden-method
+
+    def create_stepper(self, app):
+        """Creates the AsyncStepperMotorController, it is opened by run."""
+        return async_hardware.create_async_stepper_controller(app, self.cancel_token)
+
+    async def home_robot(self) -> bool:
+        """Homing the robot"""
+        with HOME_SECONDS.time("fast_approach"):
+            if not await self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 10, 30):
+                return False
+        with HOME_SECONDS.time("back_off"):
+            if not await self.single_home_step(True, assets.ROBOT_DIRECTIONS.RIGHT, 5, 20):
+                return False
+        with HOME_SECONDS.time("slow_approach"):
+            if not await self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 1, 10):
+                return False
+        with HOME_SECONDS.time("first_led"):
+            if not await self.stepper.move_robot(
+                    assets.ROBOT_DIRECTIONS.RIGHT, 5,
+                    self.app.config['STEPS_BETWEEN_HOME_TO_FIRST_LED']):
+                return False
+        self.homed()
+        return True
+
+    async def single_home_step(self, lb_state: bool, direction: assets.ROBOT_DIRECTIONS,
+                               speed: int, steps: int) -> bool:
+        """Single step for homing the robot. Drive until the light barrier toggles."""
+        while await self.stepper.get_lb_state() == lb_state:
+            if not await self.stepper.move_robot(direction, speed, steps):
+                return False
+            await self.pause_machine()
+            if self.user_stopped("homing"):
+                return False
+        return True
+
+    async def go_to_first_color(self):
+        """Moving the robot to the first color, see StateMachine.go_to_first_color."""
+        MACHINE_LOGGER.info("Robot moving to first color")
+        while await self.read_color() == assets.IO_BAND_COLORS.BLANK:
+            await self.pause_machine()
+            if self.user_stopped("go_to_first_color"):
+                return False
+            new_position = await self.stepper.move_robot_led_step(
+                assets.ROBOT_DIRECTIONS.RIGHT, self.speed)
+            if not self.moved_to(new_position):
+                return False
+        return True
+
+    async def read_color(self) -> assets.IO_BAND_COLORS:
+        """Returns the color under the robot, the shadow band saves the sensor reading."""
+        if not self._on_band():
+            return await self.stepper.get_color()
+        color = self.shadow_band[self.position]
+        if color is None:
+            color = await self.stepper.get_color()
+            self.set_shadow_color(self.position, color)
+        return color
+
+    async def scan_band(self) -> bool:
+        """Reads the unknown LEDs in a single sweep, see StateMachine.scan_band."""
+        for led in self.unknown_leds():
+            await self.pause_machine()
+            if self.user_stopped("scan_band"):
+                return False
+            if led != self.position:
+                new_position = await self.stepper.move_robot_led_step(
+                    self.direction_to(led), self.speed, abs(led - self.position))
+                if not self.moved_to(new_position):
+                    return False
+            await self.read_color()
+        return True
+
+    async def plan_run(self) -> bool:
+        """Reads the whole band and simulates the program, see StateMachine.plan_run."""
+        if not await self.scan_band():
+            self.scan_failed()
+            return False
+        return self.evaluate_plan()
+
+    async def single_step(self):
+        """Executes a single step of the Turing machine, see StateMachine.single_step."""
+        with STEP_PHASE_SECONDS.time("step"):
+            return await self._single_step()
+
+    async def _single_step(self):
+        with STEP_PHASE_SECONDS.time("read_color"):
+            color = await self.read_color()
+        transition = self.begin_step(color)
+        if transition is None:
+            return False
+        write_color = assets.IO_BAND_COLORS(transition.write_symbol)
+        if color == write_color:  # nothing to write, just move
+            with STEP_PHASE_SECONDS.time("move"):
+                new_position = await self.stepper.move_robot_led_step(transition.move,
+                                                                      self.speed)
+            return self.finish_step(new_position, None)
+        with STEP_PHASE_SECONDS.time("write_move"):
+            new_position, new_color = await self.stepper.execute_step(
+                write_color, transition.move, self.speed, current_color=color)
+        if not self.written(new_position, write_color):
+            return False
+        return self.finish_step(new_position, new_color)
+
+    async def coalesced_step(self) -> bool | None:
+        """Executes a predicted scan with a single move, see StateMachine.coalesced_step."""
+        steps, state, direction = self.predict_scan()
+        if steps < 2:
+            return None
+        start_position = self.stepper.current_position
+        new_position = await self.stepper.move_robot_led_step(direction, self.speed, steps)
+        if new_position < 0:
+            return self.scan_move_failed(start_position, new_position)
+        predicted_color = self.shadow_band[new_position]
+        if predicted_color is not None and await self.stepper.get_color() != predicted_color:
+            return self.prediction_failed(new_position)
+        self.scanned(steps, state, new_position)
+        return True
+
+    # pylint: disable=too-many-return-statements
+    async def run(self):
+        """
+        Run the state machine on the running event loop, the stepper is opened first.
+        :returns:
+            bool: True if the tm reached an accept state,
+                  False if there accept wasn't reached, reason is saved in self.errors.
+        """
+        self.start_run()
+        try:
+            await self.stepper.open()
+        except OSError:  # logged by open
+            return self.end_run("Die Verbindung zum Arduino konnte nicht geöffnet werden.")
+        if not await self.home_robot():
+            return self.homing_failed()
+        await self.pause_machine()
+        if self.stopped_by_flag():
+            return False
+        if not await self.go_to_first_color():
+            MACHINE_LOGGER.warning("Blank io_band, Robot would move out of the LED strip")
+            new_position = await self.stepper.move_robot_led_step(
+                assets.ROBOT_DIRECTIONS.LEFT, self.speed, int(self.app.config['LED_AMOUNT'] / 2))
+            if not self.returned_from_blank_band(new_position):
+                return False
+        MACHINE_LOGGER.info("Robot reached the start of input")
+        if self.app.config['PLAN_STEP_BUDGET'] > 0 and not await self.plan_run():
+            return self.end_run()
+        while not self.program.accepting[self.state_id]:
+            await self.pause_machine()
+            if self.stopped_by_flag():
+                return False
+            MACHINE_LOGGER.debug("Current state: %s", self.current_state)
+            step = await self.coalesced_step()  # None if no scan was predicted
+            if not (step if step is not None else await self.single_step()):
+                return self.step_failed()
+            if self.run_doomed():
+                return self.end_run()
+        return self.accepted()
+
+    async def pause_machine(self):
+        """Awaits the resume or stop while the state machine is paused."""
+        await self.cancel_token.wait_while_paused_async()
+
+
+async def _run(machine: AsyncStateMachine, broadcaster) -> bool:
+    if broadcaster is not None:
+        broadcaster.attach_loop(asyncio.get_running_loop())
+    try:
+        return await machine.run()
+    finally:
+        machine.stepper.detach()
+        if broadcaster is not None:
+            broadcaster.detach_loop()
+
+
+def run_in_event_loop(machine: AsyncStateMachine, broadcaster=None) -> bool:
+    """
+    Runs the machine on a new event loop in the calling thread and returns the result of
+    the run. The delayed state updates of the StateBroadcaster are scheduled on the loop.
+    """
+    return asyncio.run(_run(machine, broadcaster))
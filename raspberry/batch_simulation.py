@@ -0,0 +1,128 @@
+"""
+This module contains the batch simulation of a program on many band inputs, e.g. for grading.
+The inputs are simulated by the software interpreter of the simulator in a process pool on
+all cores, every input has its own step and time limit. The results are yielded as soon as
+an input is finished, so they can be streamed to the client.
+
+Usage:
+    for result in simulate_program("add1.txt", ["0110", "1"], max_steps=10_000):
+        print(result)
+"""
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import assets
+from program_cache import PROGRAM_CACHE
+from simulator import encode_band_input, simulate
+
+BATCH_LOGGER = logging.getLogger("batch")
+
+# program of the worker processes, set by the initializer of the pool
+_PROGRAM = None
+
+
+class BatchError(Exception):
+    """The batch can not be started, e.g. the program does not exist or has errors."""
+
+
+class ProgramNotFoundError(BatchError):
+    """The program of the batch does not exist."""
+
+
+def _init_worker(tm_code):
+    global _PROGRAM  # pylint: disable=global-statement
+    _PROGRAM = tm_code
+
+
+def _simulate_input(index: int, band_input: str, max_steps: int, max_seconds: float) -> dict:
+    """Simulates a single input in a worker process."""
+    start = time.perf_counter()
+    result = simulate(_PROGRAM, band_input, max_steps, max_seconds)
+    result["seconds"] = time.perf_counter() - start
+    result["index"] = index
+    result["input"] = band_input
+    return result
+
+
+def pool_context():
+    """
+    Start method of the worker processes. They are not forked from the server, which runs
+    the robot, serial and logging threads, but started by a fork server or spawned.
+    """
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def load_program(program: str, language: assets.PROGRAM_LANGUAGES = assets.PROGRAM_LANGUAGES.COM,
+                 upload_folder: str = assets.UPLOAD_FOLDER):
+    """
+    Returns the parsed program from the upload folder.
+    Raises ProgramNotFoundError if it does not exist, BatchError if it has errors.
+    """
+    filepath = os.path.join(upload_folder, os.path.basename(program))
+    if not os.path.isfile(filepath):
+        raise ProgramNotFoundError(f"Programm {program} nicht gefunden.")
+    tm_code = PROGRAM_CACHE.get(filepath, language)
+    if tm_code["errors"]:
+        raise BatchError(f"Programm {program} enthält Fehler: {'; '.join(tm_code['errors'])}")
+    return tm_code
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def simulate_batch(tm_code, inputs: list[str], max_steps: int = assets.BATCH_MAX_STEPS,
+                   max_seconds: float = assets.BATCH_MAX_SECONDS,
+                   workers: int = assets.BATCH_WORKERS, window: int | None = None):
+    """
+    Simulates the parsed program on every input in a process pool and yields the result
+    dicts of simulator.simulate in the order the inputs finish, with
+        "index": position of the input in inputs, "input" and "seconds" (simulation time).
+    Inputs with invalid characters get the result "error" and a "message".
+    workers is the amount of processes, 0 uses all cores. At most window inputs (default:
+    4 per worker) are submitted at once. Closing the generator cancels the waiting inputs.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    pending_inputs = iter(enumerate(inputs))
+    running = set()
+    executor = ProcessPoolExecutor(workers, mp_context=pool_context(),
+                                   initializer=_init_worker, initargs=(tm_code,))
+    try:
+        while True:
+            for index, band_input in pending_inputs:
+                try:
+                    encode_band_input(band_input)
+                except ValueError as e:
+                    yield {"index": index, "input": band_input, "result": "error",
+                           "message": str(e)}
+                    continue
+                running.add(executor.submit(_simulate_input, index, band_input, max_steps,
+                                            max_seconds))
+                if len(running) >= window:
+                    break
+            if not running:
+                return
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def simulate_program(program: str, inputs: list[str],
+                     language: assets.PROGRAM_LANGUAGES = assets.PROGRAM_LANGUAGES.COM,
+                     max_steps: int = assets.BATCH_MAX_STEPS,
+                     max_seconds: float = assets.BATCH_MAX_SECONDS,
+                     workers: int = assets.BATCH_WORKERS,
+                     upload_folder: str = assets.UPLOAD_FOLDER):
+    """
+    Simulates the program of the upload folder on the inputs, see simulate_batch.
+    Raises ProgramNotFoundError if the program does not exist, BatchError if it has errors.
+    """
+    tm_code = load_program(program, language, upload_folder)
+    BATCH_LOGGER.info("Batch simulation of %s on %s inputs", program, len(inputs))
+    return simulate_batch(tm_code, inputs, max_steps, max_seconds, workers)
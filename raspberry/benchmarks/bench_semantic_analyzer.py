@@ -0,0 +1,70 @@
+"""
+Benchmark for the semantic analyzer with generated programs of 1k to 50k states.
+The time per state has to stay constant, otherwise a check is not linear.
+Usage (from the raspberry folder): python benchmarks/bench_semantic_analyzer.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position
+import assets
+from semantic_analyzer import semantic_analyzer
+from turingmachine_compiler import compile_turing_machine
+from turingmachine_interpreter import parse_turing_machine
+
+STATE_AMOUNTS = (1_000, 10_000, 50_000)
+
+
+def generate_com_program(state_amount: int, accept_amount: int) -> str:
+    """
+    Generates a program for turingmachinesimulator.com with a chain of states.
+    Every state moves right on 0 and 1 and jumps to one of the accept states on blank.
+    """
+    accept_states = [f"a{index}" for index in range(accept_amount)]
+    lines = [f"name: generated {state_amount}", "init: q0", f"accept: {', '.join(accept_states)}",
+             ""]
+    for state in range(state_amount):
+        next_state = f"q{(state + 1) % state_amount}"
+        for symbol in ("0", "1"):
+            lines += [f"q{state},{symbol}", f"{next_state},{symbol},>", ""]
+        lines += [f"q{state},_", f"{accept_states[state % accept_amount]},_,-", ""]
+    return "\n".join(lines)
+
+
+def measure(function, *args):
+    """Returns the result and the runtime of the function in seconds."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    """Prints the runtimes per program size."""
+    print(f"{'states':>8} {'accept':>8} {'parse [ms]':>11} {'compile [ms]':>13} "
+          f"{'analyze [ms]':>13} {'analyze/state [us]':>19}")
+    with tempfile.TemporaryDirectory() as folder:
+        for state_amount in STATE_AMOUNTS:
+            # many accept states are the worst case for per-accept-state scans
+            accept_amount = state_amount // 2
+            file_path = os.path.join(folder, f"generated_{state_amount}.txt")
+            with open(file_path, "w", encoding="utf-8") as file:
+                file.write(generate_com_program(state_amount, accept_amount))
+            turing_machine, parse_time = measure(parse_turing_machine, file_path,
+                                                 assets.PROGRAM_LANGUAGES.COM)
+            assert not turing_machine["errors"], turing_machine["errors"][:3]
+            # analyze a fresh copy, parse_turing_machine already added its messages
+            turing_machine["errors"], turing_machine["warnings"] = [], []
+            compiled, compile_time = measure(compile_turing_machine, turing_machine)
+            turing_machine["compiled"] = compiled
+            _, analyze_time = measure(semantic_analyzer, turing_machine)
+            print(f"{state_amount:>8} {accept_amount:>8} {parse_time * 1e3:>11.1f} "
+                  f"{compile_time * 1e3:>13.1f} {analyze_time * 1e3:>13.1f} "
+                  f"{analyze_time / state_amount * 1e6:>19.2f}")
+
+
+if __name__ == "__main__":
+    main()
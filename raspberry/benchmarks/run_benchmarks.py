@@ -0,0 +1,382 @@
+"""
+Benchmark suite for the parser, the semantic analyzer, the StateMachine step loop, the
+software simulators and the serial path of the StepperMotorController. No hardware is
+needed, the robot is simulated, complete runs are profiled against the timing-accurate
+Arduino emulator.
+Results are written as JSON, so the runs of two commits can be compared.
+
+Usage (from the raspberry folder):
+    python benchmarks/run_benchmarks.py [--quick] [--output FILE] [--compare BASELINE.json]
+"""
+import argparse
+import asyncio
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+# pylint: disable=wrong-import-position, wrong-import-order
+import assets
+import async_machine
+import dannweisstobiesnicht as sm
+import hardware_control as hc
+from arduino_emulator import ArduinoEmulator
+from bench_semantic_analyzer import generate_com_program
+from fake_serial import FakeArduino, FakeSerial
+from macro_simulator import simulate_macro
+from semantic_analyzer import semantic_analyzer
+from simulator import VirtualBand, simulate
+from turingmachine_compiler import compile_turing_machine
+from turingmachine_interpreter import parse_turing_machine
+
+# config values the StateMachine and the controller read, taken from assets
+CONFIG_DEFAULTS = ("LED_AMOUNT", "STEPS_BETWEEN_LEDS", "STEPS_BETWEEN_HOME_TO_FIRST_LED",
+                   "TOGGLE_IO_BAND_RETRYS", "MAX_COALESCED_LEDS", "PLAN_STEP_BUDGET",
+                   "BINARY_BAUDRATE")
+
+RESULTS_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+# palindrome check of the uploads, it sweeps over the whole input for every pair of characters
+PALINDROME_PROGRAM = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                                  assets.UPLOAD_FOLDER, "palindrome.txt")
+
+# binary counter: counts the input up to 1...1, the overflow into the blank is accepted
+COUNTER_PROGRAM = """name: binary counter
+init: right
+accept: done
+
+right,0
+right,0,>
+
+right,1
+right,1,>
+
+right,_
+inc,_,<
+
+inc,1
+inc,0,<
+
+inc,0
+right,1,>
+
+inc,_
+done,_,-
+"""
+
+
+class BenchmarkApp:
+    """Stand-in for the Flask app, the StateMachine only uses the config."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, **config):
+        self.config = {key: getattr(assets, key) for key in CONFIG_DEFAULTS}
+        self.config.update({
+            "HARDWARE_BACKEND": assets.HARDWARE_BACKENDS.SIMULATION.value,
+            "SIMULATION_INPUT": "",
+            "SERIAL_PROTOCOL": assets.SERIAL_PROTOCOLS.TEXT.value
+        })
+        self.config.update(config)
+
+
+def generate_io_program(state_amount: int) -> str:
+    """Generates a program for turingmachine.io with a chain of states."""
+    lines = ["start state: q0", "accept states: done", "table:"]
+    for state in range(state_amount - 1):
+        lines += [f"  q{state}:", f"    [0,1]: {{R: q{state + 1}}}", "    ' ': {L: done}"]
+    lines += [f"  q{state_amount - 1}:", "    [0,1,' ']: {L: done}", "  done:"]
+    return "\n".join(lines)
+
+
+def peak_memory(function) -> int:
+    """Runs the function once and returns the peak of the allocated memory in bytes."""
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def timings(function, repeat: int) -> list[float]:
+    """Runtimes of the function in seconds."""
+    result = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        result.append(time.perf_counter() - start)
+    return result
+
+
+def percentiles(samples: list[float]) -> dict:
+    """p50, p90, p99 and max of latencies in seconds, converted to microseconds."""
+    quantiles = statistics.quantiles(samples, n=100, method='inclusive')
+    return {"p50_us": quantiles[49] * 1e6, "p90_us": quantiles[89] * 1e6,
+            "p99_us": quantiles[98] * 1e6, "max_us": max(samples) * 1e6}
+
+
+def run_machine(turing_machine, app, machines: list):
+    """Runs the program on a new StateMachine, the machine is appended to machines."""
+    machine = sm.StateMachine(turing_machine, app)
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert machine.run(), machine.errors
+    machines.append(machine)
+
+
+def timed_send_command(controller, command: str, latencies: list):
+    """Sends the command, the latency in seconds is appended to latencies."""
+    start = time.perf_counter()
+    controller.send_command(command)
+    latencies.append(time.perf_counter() - start)
+
+
+def bench_parse(folder: str, state_amount: int, repeat: int) -> dict:
+    """parse_turing_machine for both languages."""
+    results = {}
+    programs = {
+        assets.PROGRAM_LANGUAGES.COM: generate_com_program(state_amount, 1),
+        assets.PROGRAM_LANGUAGES.IO: generate_io_program(state_amount)
+    }
+    for language, source in programs.items():
+        file_path = os.path.join(folder, f"parse_{language.name.lower()}.txt")
+        with open(file_path, "w", encoding="utf-8") as file:
+            file.write(source)
+        turing_machine = parse_turing_machine(file_path, language)
+        assert not turing_machine["errors"], turing_machine["errors"][:3]
+        runtime = statistics.median(timings(lambda p=file_path, l=language:
+                                            parse_turing_machine(p, l), repeat))
+        results[f"parse_{language.name.lower()}"] = {
+            "states": state_amount,
+            "median_s": runtime,
+            "states_per_s": state_amount / runtime,
+            "peak_memory_bytes": peak_memory(lambda p=file_path, l=language:
+                                             parse_turing_machine(p, l))
+        }
+    return results
+
+
+def bench_semantic_analyzer(folder: str, state_amount: int, repeat: int) -> dict:
+    """semantic_analyzer on a compiled program with many accept states."""
+    file_path = os.path.join(folder, "analyzer.txt")
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(generate_com_program(state_amount, state_amount // 2))
+    turing_machine = parse_turing_machine(file_path, assets.PROGRAM_LANGUAGES.COM)
+    turing_machine["compiled"] = compile_turing_machine(turing_machine)
+
+    def analyze():
+        turing_machine["errors"], turing_machine["warnings"] = [], []
+        semantic_analyzer(turing_machine)
+
+    runtime = statistics.median(timings(analyze, repeat))
+    return {"semantic_analyzer": {
+        "states": state_amount,
+        "median_s": runtime,
+        "states_per_s": state_amount / runtime,
+        "peak_memory_bytes": peak_memory(analyze)
+    }}
+
+
+def bench_step_loop(folder: str, bits: int, repeat: int) -> dict:
+    """StateMachine.run with the simulated controller, a binary counter counts to 2^bits."""
+    file_path = os.path.join(folder, "counter.txt")
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(COUNTER_PROGRAM)
+    turing_machine = parse_turing_machine(file_path, assets.PROGRAM_LANGUAGES.COM)
+    results = {}
+    for name, coalesced in (("step_loop", assets.MAX_COALESCED_LEDS), ("step_loop_single", 1)):
+        app = BenchmarkApp(SIMULATION_INPUT="0" * bits, MAX_COALESCED_LEDS=coalesced)
+        machines = []
+        run = functools.partial(run_machine, turing_machine, app, machines)
+        runtime = statistics.median(timings(run, repeat))
+        steps = machines[-1].steps
+        results[name] = {
+            "steps": steps,
+            "median_s": runtime,
+            "steps_per_s": steps / runtime,
+            "peak_memory_bytes": peak_memory(run)
+        }
+    return results
+
+
+def bench_simulators(length: int, repeat: int) -> dict:
+    """simulator.simulate and simulate_macro, palindrome.txt checks a palindrome of zeros."""
+    turing_machine = parse_turing_machine(PALINDROME_PROGRAM, assets.PROGRAM_LANGUAGES.COM)
+    turing_machine["compiled"] = compile_turing_machine(turing_machine)
+    band_input = "0" * length
+    results = {}
+    for name, function in (("simulate", simulate), ("simulate_macro", simulate_macro)):
+        run = functools.partial(function, turing_machine, band_input, length * length)
+        result = run()
+        assert result["result"] == "accept", result["result"]
+        runtime = statistics.median(timings(run, repeat))
+        results[name] = {
+            "steps": result["steps"],
+            "median_s": runtime,
+            "steps_per_s": result["steps"] / runtime
+        }
+    return results
+
+
+def bench_send_command(commands: int) -> dict:
+    """StepperMotorController.send_command against FakeSerial for both serial protocols."""
+    results = {}
+    for protocol in assets.SERIAL_PROTOCOLS:
+        app = BenchmarkApp(SERIAL_PROTOCOL=protocol.value,
+                           HARDWARE_BACKEND=assets.HARDWARE_BACKENDS.SERIAL.value)
+        band = VirtualBand(app.config["LED_AMOUNT"], app.config["STEPS_BETWEEN_LEDS"],
+                           app.config["STEPS_BETWEEN_HOME_TO_FIRST_LED"], "0110")
+        with contextlib.redirect_stdout(io.StringIO()):
+            controller = hc.StepperMotorController(
+                app, serial_connection=FakeSerial(FakeArduino(band)))
+        try:
+            for command in ("COLOR", "LIGHT", "MOVE RIGHT 1 0"):
+                latencies = []
+                send = functools.partial(timed_send_command, controller, command, latencies)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    for _ in range(commands):
+                        send()
+                    memory = peak_memory(send)
+                result = percentiles(latencies)
+                result["commands_per_s"] = len(latencies) / sum(latencies)
+                result["peak_memory_bytes"] = memory
+                results[f"send_command_{protocol.value}_{command.split()[0].lower()}"] = result
+        finally:
+            controller.close()
+    return results
+
+
+def bench_emulated_run(folder: str, bits: int, speed: float) -> dict:
+    """
+    Homing and a complete run of the binary counter against the timing-accurate Arduino
+    emulator. hardware_s is the measured time divided by the speed factor, an estimate for
+    the robot. The runs of the asyncio execution mode are suffixed with _asyncio.
+    """
+    file_path = os.path.join(folder, "counter.txt")
+    turing_machine = parse_turing_machine(file_path, assets.PROGRAM_LANGUAGES.COM)
+    results = {}
+    for mode in assets.EXECUTION_MODES:
+        emulator = ArduinoEmulator(VirtualBand(assets.LED_AMOUNT, assets.STEPS_BETWEEN_LEDS,
+                                               assets.STEPS_BETWEEN_HOME_TO_FIRST_LED,
+                                               "0" * bits), speed)
+        emulator.start()
+        try:
+            app = BenchmarkApp(HARDWARE_BACKEND=assets.HARDWARE_BACKENDS.SERIAL.value,
+                               SERIAL_PORT=emulator.port,
+                               SERIAL_PROTOCOL=assets.SERIAL_PROTOCOLS.BINARY.value)
+            if mode is assets.EXECUTION_MODES.ASYNCIO:
+                machine = async_machine.AsyncStateMachine(turing_machine, app)
+                home, run = asyncio.run(time_async_run(machine))
+            else:
+                machine = sm.StateMachine(turing_machine, app)
+                home, run = time_run(machine)
+            machine.stepper.close()
+        finally:
+            emulator.stop()
+        suffix = "" if mode is assets.EXECUTION_MODES.THREAD else "_" + mode.value
+        for name, runtime in (("emulated_home", home), ("emulated_run", run)):
+            results[name + suffix] = {"median_s": runtime, "speed": speed,
+                                      "hardware_s": runtime / speed if speed else 0.0}
+        results["emulated_run" + suffix]["steps"] = machine.steps
+    return results
+
+
+def time_run(machine) -> tuple[float, float]:
+    """Durations of home_robot and run of a StateMachine."""
+    return (statistics.median(timings(machine.home_robot, 1)),
+            statistics.median(timings(machine.run, 1)))
+
+
+async def time_async_run(machine) -> tuple[float, float]:
+    """Durations of home_robot and run of an AsyncStateMachine, the port is opened before."""
+    await machine.stepper.open()
+    try:
+        start = time.perf_counter()
+        await machine.home_robot()
+        home = time.perf_counter() - start
+        start = time.perf_counter()
+        await machine.run()
+        return home, time.perf_counter() - start
+    finally:
+        machine.stepper.detach()
+
+
+def git_commit() -> str:
+    """Short hash of the current commit or "unknown"."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results: dict, baseline: dict):
+    """Prints the relative change of every metric against the baseline."""
+    print(f"\nComparison with {baseline['meta']['commit']}:")
+    for name, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            old = baseline["results"].get(name, {}).get(metric)
+            if not old:
+                continue
+            print(f"  {name:<32} {metric:<18} {old:>12.4g} -> {value:>12.4g} "
+                  f"({(value - old) / old * 100:+.1f}%)")
+
+
+def main():
+    """Runs all benchmarks and writes the JSON results."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", 1)[0])
+    parser.add_argument("--quick", action="store_true", help="small sizes, e.g. for CI")
+    parser.add_argument("--output", help="JSON file, default benchmarks/results/<commit>.json")
+    parser.add_argument("--compare", help="JSON file of an earlier run")
+    args = parser.parse_args()
+
+    sizes = {"states": 2_000, "repeat": 3, "bits": 5, "commands": 200, "speed": 0.01,
+             "palindrome": 200} \
+        if args.quick else \
+        {"states": 20_000, "repeat": 5, "bits": 8, "commands": 2_000, "speed": 0.1,
+         "palindrome": 2_000}
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        results.update(bench_parse(folder, sizes["states"], sizes["repeat"]))
+        results.update(bench_semantic_analyzer(folder, sizes["states"], sizes["repeat"]))
+        results.update(bench_step_loop(folder, sizes["bits"], sizes["repeat"]))
+        results.update(bench_emulated_run(folder, sizes["bits"], sizes["speed"]))
+    results.update(bench_simulators(sizes["palindrome"], sizes["repeat"]))
+    results.update(bench_send_command(sizes["commands"]))
+
+    output = {
+        "meta": {
+            "commit": git_commit(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "quick": args.quick,
+            "sizes": sizes
+        },
+        "results": results
+    }
+    for name, metrics in results.items():
+        print(name, ", ".join(f"{metric}={value:.4g}" if isinstance(value, float)
+                              else f"{metric}={value}" for metric, value in metrics.items()))
+
+    output_path = args.output or os.path.join(RESULTS_FOLDER, f"{output['meta']['commit']}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as file:
+        json.dump(output, file, indent=2)
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            compare(output, json.load(file))
+
+
+if __name__ == "__main__":
+    main()
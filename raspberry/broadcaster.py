@@ -0,0 +1,179 @@
+"""
+This module contains the rate limited broadcast of the machine state to the websocket clients.
+Changes of the StateMachine are coalesced to at most MAX_BROADCAST_RATE updates per second,
+run, pause and stop transitions are sent immediately. Updates carry only the changed fields.
+Errors are no state field, they are events of the EventJournal and sent as machine_events.
+A machine in the asyncio execution mode attaches its event loop, the delayed updates are
+then timers on the loop instead of background tasks.
+"""
+import time
+from threading import Lock
+
+from journal import EventJournal
+from metrics import BROADCAST_SECONDS
+
+# fields which are flushed immediately when they change
+TRANSITION_FIELDS = ('run', 'pause', 'should_stop')
+
+
+def update_interval(max_rate: int) -> float:
+    """Seconds between two updates, a rate of 0 or less does not limit the updates."""
+    return 1 / max_rate if max_rate > 0 else 0.0
+
+
+class StateBroadcaster:
+    """
+    Coalesces the state updates of the machine.
+    :arg socketio: the SocketIO server
+    :arg snapshot: function returning the current machine state as dict or None
+    :arg errors: function returning the (append-only) error list of the current machine
+    :arg max_rate: maximum amount of state_update messages per second, 0 sends every update
+    :arg journal_size: amount of events kept for reconnecting clients
+    :arg room: websocket room of the clients, None broadcasts to all clients
+    The first update after reset() and the update for a new client are full snapshots,
+    "full" tells the client whether to replace or to merge the fields.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def __init__(self, socketio, snapshot, errors, max_rate: int, journal_size: int,
+                 room: str | None = None):
+        self.socketio = socketio
+        self.room = room
+        self.snapshot = snapshot
+        self.errors = errors
+        self.interval = update_interval(max_rate)
+        self.lock = Lock()
+        self.journal = EventJournal(journal_size)
+        self._start_seq = 0  # sequence number of the start event of the current machine
+        self._journaled_errors = 0  # errors of the current machine already in the journal
+        self._last_state = None  # state sent with the last update
+        self._next_emit = 0.0
+        self._flush_scheduled = False
+        self._loop = None  # event loop of an asyncio machine
+
+    def attach_loop(self, loop):
+        """Schedules the delayed updates on the event loop, call it on the loop."""
+        self._loop = loop
+
+    def detach_loop(self):
+        """The event loop ends, its pending update is sent immediately."""
+        with self.lock:
+            self._loop = None
+            self._flush_scheduled = False
+        self.flush()
+
+    def reset(self, max_rate: int, program_name: str):
+        """A new machine was started, the next update is a full snapshot."""
+        with self.lock:
+            self.interval = update_interval(max_rate)
+            self._last_state = None
+            self._next_emit = 0.0
+            self._journaled_errors = 0
+            event = self.journal.append('start', program_name)
+            self._start_seq = event['seq']
+            self.socketio.emit('machine_events', {'events': [event], 'reset': True},
+                               to=self.room)
+
+    def notify(self):
+        """Listener of the StateMachine, sends or schedules an update."""
+        with self.lock:
+            self._journal_errors()
+            state = self.snapshot()
+            if state is None:
+                return
+            if (self._last_state is None or time.monotonic() >= self._next_emit
+                    or any(state[field] != self._last_state[field]
+                           for field in TRANSITION_FIELDS)):
+                self._emit(state)
+            elif not self._flush_scheduled:
+                self._flush_scheduled = True
+                self._schedule_flush()
+
+    def _schedule_flush(self):
+        """Schedules the delayed flush, on the event loop if one is attached."""
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._schedule_timer, loop)
+                return
+            except RuntimeError:
+                pass  # the loop was closed meanwhile
+        self.socketio.start_background_task(self._delayed_flush)
+
+    def _schedule_timer(self, loop):
+        loop.call_later(max(0.0, self._next_emit - time.monotonic()), self._timer_flush)
+
+    def _timer_flush(self):
+        with self.lock:
+            if not self._flush_scheduled:
+                return  # already sent by detach_loop
+            self._flush_scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Sends the pending changes immediately."""
+        with self.lock:
+            state = self.snapshot()
+            if state is not None:
+                self._emit(state)
+
+    def _journal_errors(self):
+        """Adds the new errors of the machine to the journal and sends them immediately."""
+        errors = self.errors()
+        if len(errors) <= self._journaled_errors:
+            return
+        events = [self.journal.append('error', error)
+                  for error in errors[self._journaled_errors:]]
+        self._journaled_errors += len(events)
+        with BROADCAST_SECONDS.time('machine_events'):
+            self.socketio.emit('machine_events', {'events': events, 'reset': False},
+                               to=self.room)
+
+    def send_events(self, sid, last_seq: int):
+        """
+        Sends the events of the current machine after last_seq to a (reconnected) client.
+        If the client missed the start of the machine or the journal dropped events the
+        client has not seen, the client gets all kept events of the machine and resets.
+        """
+        with self.lock:
+            self._journal_errors()
+            start = max(last_seq, self._start_seq - 1)
+            events, complete = self.journal.since(start)
+            reset = last_seq < self._start_seq or not complete
+            self.socketio.emit('machine_events', {'events': events, 'reset': reset}, to=sid)
+
+    def send_snapshot(self, sid):
+        """
+        Sends the full state to a single (new) client.
+        The client gets the state of the last update, so the following partial updates apply
+        to it. Pending changes arrive with the next update.
+        """
+        with self.lock:
+            if self._last_state is None:
+                state = self.snapshot()
+                if state is not None:
+                    self._emit(state)  # first update, a full snapshot for every client
+                return
+            self.socketio.emit('state_update', dict(self._last_state, full=True), to=sid)
+
+    def _delayed_flush(self):
+        self.socketio.sleep(max(0.0, self._next_emit - time.monotonic()))
+        with self.lock:
+            self._flush_scheduled = False
+        self.flush()
+
+    def _emit(self, state):
+        """Sends the fields which changed since the last update, the lock has to be held."""
+        last = self._last_state
+        if last is None:
+            payload = dict(state, full=True)
+        else:
+            payload = {key: value for key, value in state.items() if value != last[key]}
+            if not payload:
+                return
+            payload['full'] = False
+        self._last_state = state
+        self._next_emit = time.monotonic() + self.interval
+        with BROADCAST_SECONDS.time('state_update'):
+            self.socketio.emit('state_update', payload, to=self.room)
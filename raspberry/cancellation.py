@@ -0,0 +1,120 @@
+"""
+This module contains the cooperative cancellation of a running turing machine.
+The machine thread waits on events instead of polling, pause, resume and stop wake it
+immediately. A cancel additionally interrupts the commands waiting for an ACK.
+A machine on an event loop awaits wait_while_paused_async instead of blocking the loop.
+"""
+import asyncio
+from threading import Event, Lock
+
+
+class CancellationToken:
+    """
+    Shared by the StateMachine and its StepperMotorController.
+      - pause/resume: the machine thread waits in wait_while_paused
+      - request_stop: the machine stops after the current step, a pause ends immediately
+      - cancel: like request_stop, but the waits for ACKs and sleeps are interrupted
+    """
+
+    def __init__(self):
+        self._cancelled = Event()
+        self._stop_requested = Event()
+        self._running = Event()  # cleared while paused
+        self._running.set()
+        self._callbacks = {}
+        self._wake_callbacks = {}  # called on resume, stop and cancel
+        self._next_handle = 0
+        self._lock = Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        """True after cancel."""
+        return self._cancelled.is_set()
+
+    @property
+    def stop_requested(self) -> bool:
+        """True after request_stop or cancel."""
+        return self._stop_requested.is_set()
+
+    @property
+    def paused(self) -> bool:
+        """True between pause and resume."""
+        return not self._running.is_set()
+
+    def pause(self):
+        """The machine thread waits in wait_while_paused until resume or a stop."""
+        self._running.clear()
+
+    def resume(self):
+        """Wakes the waiting machine thread."""
+        self._running.set()
+        self._wake()
+
+    def request_stop(self):
+        """Stops after the current step, a paused machine thread wakes up."""
+        self._stop_requested.set()
+        self._running.set()
+        self._wake()
+
+    def _wake(self):
+        with self._lock:
+            callbacks = list(self._wake_callbacks.values())
+        for callback in callbacks:
+            callback()
+
+    def cancel(self):
+        """Stops immediately, all registered callbacks (e.g. ACK waits) are called once."""
+        with self._lock:
+            self._cancelled.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+        self.request_stop()
+        for callback in callbacks:
+            callback()
+
+    def wait_while_paused(self) -> bool:
+        """Blocks while paused. Returns False if a stop was requested."""
+        self._running.wait()
+        return not self.stop_requested
+
+    async def wait_while_paused_async(self) -> bool:
+        """
+        Like wait_while_paused, but awaits on the running event loop. resume and stop are
+        called by other threads, they wake the loop thread safe.
+        """
+        loop = asyncio.get_running_loop()
+        while self.paused:
+            woken = asyncio.Event()
+            with self._lock:
+                self._next_handle += 1
+                handle = self._next_handle
+                self._wake_callbacks[handle] = lambda: loop.call_soon_threadsafe(woken.set)
+            try:
+                if self.paused:  # a resume before the registration would be lost
+                    await woken.wait()
+            finally:
+                with self._lock:
+                    self._wake_callbacks.pop(handle, None)
+        return not self.stop_requested
+
+    def sleep(self, seconds: float) -> bool:
+        """Sleeps like time.sleep but wakes up on cancel. Returns False if cancelled."""
+        return not self._cancelled.wait(seconds)
+
+    def add_callback(self, callback) -> int | None:
+        """
+        Registers a callback for cancel and returns its handle for remove_callback.
+        If the token is already cancelled the callback is called immediately.
+        """
+        with self._lock:
+            if not self._cancelled.is_set():
+                self._next_handle += 1
+                self._callbacks[self._next_handle] = callback
+                return self._next_handle
+        callback()
+        return None
+
+    def remove_callback(self, handle: int | None):
+        """Removes a callback, e.g. after the ACK arrived."""
+        with self._lock:
+            self._callbacks.pop(handle, None)
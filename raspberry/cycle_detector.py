@@ -0,0 +1,65 @@
+"""
+This module contains the non-termination detection for turing machine runs.
+A run which reaches the same configuration (state, head position, tape) twice can never halt.
+Configurations are compared with Brent's algorithm, so only one snapshot is kept, and the tape
+is hashed incrementally, so a step costs O(1) apart from the snapshots at powers of two.
+"""
+MASK = (1 << 64) - 1
+
+
+def cell_key(position: int, symbol: int) -> int:
+    """64 bit key of a symbol at a tape position (splitmix64 of both)."""
+    value = (position * 0x100 + symbol + 0x9E3779B97F4A7C15) & MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+class CycleDetector:
+    """
+    Detects repeated configurations of a run on a bounded tape.
+    The tape is given as symbol codes, every change has to be reported with write(),
+    after each step observe() is called with the current state and head position.
+    """
+
+    def __init__(self, cells):
+        self.cells = bytearray()
+        self.tape_hash = 0
+        self.power = 1
+        self.distance = 0
+        self.snapshot = None  # (state, position, tape_hash, cells) of the saved configuration
+        self.reset(cells)
+
+    def reset(self, cells):
+        """Starts the detection again with the given tape, e.g. after the tape was re-read."""
+        self.cells = bytearray(cells)
+        self.tape_hash = 0
+        for position, symbol in enumerate(self.cells):
+            self.tape_hash ^= cell_key(position, symbol)
+        self.power = 1
+        self.distance = 0
+        self.snapshot = None
+
+    def write(self, position: int, symbol: int):
+        """Updates the tape and its hash."""
+        old_symbol = self.cells[position]
+        if old_symbol != symbol:
+            self.tape_hash ^= cell_key(position, old_symbol) ^ cell_key(position, symbol)
+            self.cells[position] = symbol
+
+    def observe(self, state: int, position: int) -> bool:
+        """
+        Adds the current configuration.
+        :return: True if the configuration was already reached, the run can never halt.
+        """
+        snapshot = self.snapshot
+        if (snapshot is not None and snapshot[0] == state and snapshot[1] == position
+                and snapshot[2] == self.tape_hash and snapshot[3] == self.cells):
+            return True
+        self.distance += 1
+        if snapshot is None or self.distance >= self.power:
+            # Brent: move the saved configuration forward at every power of two
+            self.snapshot = (state, position, self.tape_hash, bytes(self.cells))
+            self.power *= 2
+            self.distance = 0
+        return False
@@ -2,12 +2,22 @@
 This module contains the state machine to control the robot.
 The filename is under monument protection, you are not allowed to change it.
 """
-import time
-# pylint: disable=too-many-instance-attributes
+import logging
+# pylint: disable=too-many-instance-attributes, too-many-public-methods
 from threading import Lock
 
 import assets
 import hardware_control as hc
+import planner
+from cancellation import CancellationToken
+from metrics import HOME_SECONDS, STEP_PHASE_SECONDS, STEPS
+from cycle_detector import CycleDetector
+from turingmachine_compiler import COLOR_AMOUNT, compile_turing_machine
+
+# symbol of LEDs with unknown color for the cycle detection
+UNKNOWN_SYMBOL = COLOR_AMOUNT
+
+MACHINE_LOGGER = logging.getLogger("machine")
 
 class StateMachine:
     """
@@ -17,16 +27,22 @@ class StateMachine:
         "init": "",
         "accept": set(),
         "state_transitions": defaultdict(dict),
+        "compiled": CompiledMachine,
         "errors": [],
         "warnings": []
     }
     """
 
     def __init__(self, tm_code, app):
-        self.stepper = hc.StepperMotorController(app)
+        # wakes pause and stop immediately, a cancel interrupts the running serial command
+        self.cancel_token = CancellationToken()
+        self.stepper = self.create_stepper(app)
         self.accept_states = tm_code['accept']
         self.current_state = tm_code['init']
         self.state_transitions = tm_code['state_transitions']
+        # integer transition table, current_state is kept as name for the UI
+        self.program = tm_code.get('compiled') or compile_turing_machine(tm_code)
+        self.state_id = self.program.init
         self.program_name = tm_code['name']
         self.errors = []
         self.speed = 5
@@ -39,6 +55,16 @@ class StateMachine:
         self.position = 0
         # Flask app for config. Config changes are just supported after StateMachine restart.
         self.app = app
+        # Shadow copy of the io band, index = LED position, None = color not read yet
+        self.shadow_band = [None] * (self.app.config['LED_AMOUNT'] + 1)
+        # RunPlan of the pre-execution simulation, None if planning is disabled or discarded
+        self.plan = None
+        # detects repeated configurations on the shadow band, the run would never halt
+        self.cycle_detector = CycleDetector([UNKNOWN_SYMBOL] * len(self.shadow_band))
+
+    def create_stepper(self, app):
+        """Creates the StepperMotorController for the HARDWARE_BACKEND."""
+        return hc.create_stepper_controller(app, self.cancel_token)
 
     def add_listener(self, callback):
         """Registriere eine Callback-Funktion, die bei Änderungen aufgerufen wird."""
@@ -51,21 +77,29 @@ class StateMachine:
 
     def home_robot(self) -> bool:
         """Homing the robot"""
-        if not self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 10, 30):
-            return False
-        if not self.single_home_step(True, assets.ROBOT_DIRECTIONS.RIGHT, 5, 20):
-            return False
-        if not self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 1, 10):
-            return False
+        with HOME_SECONDS.time("fast_approach"):
+            if not self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 10, 30):
+                return False
+        with HOME_SECONDS.time("back_off"):
+            if not self.single_home_step(True, assets.ROBOT_DIRECTIONS.RIGHT, 5, 20):
+                return False
+        with HOME_SECONDS.time("slow_approach"):
+            if not self.single_home_step(False, assets.ROBOT_DIRECTIONS.LEFT, 1, 10):
+                return False
         # Go to first LED
-        if not self.stepper.move_robot(assets.ROBOT_DIRECTIONS.RIGHT, 5,
-                                       self.app.config['STEPS_BETWEEN_HOME_TO_FIRST_LED']):
-            return False
-        self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', 1)))
-        print("Position set to " + str(self.position))
-        print("Robot homed")
+        with HOME_SECONDS.time("first_led"):
+            if not self.stepper.move_robot(assets.ROBOT_DIRECTIONS.RIGHT, 5,
+                                           self.app.config['STEPS_BETWEEN_HOME_TO_FIRST_LED']):
+                return False
+        self.homed()
         return True
 
+    def homed(self):
+        """The robot stands on the first LED after homing."""
+        self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', 1)))
+        MACHINE_LOGGER.debug("Position set to %s", self.position)
+        MACHINE_LOGGER.info("Robot homed")
+
     def single_home_step(self, lb_state: bool, direction: assets.ROBOT_DIRECTIONS, speed: int,
                          steps: int) -> bool:
         """Single step for homing the robot. Drive until the light barrier toggles."""
@@ -73,11 +107,16 @@ class StateMachine:
             if not self.stepper.move_robot(direction, speed, steps):
                 return False
             self.pause_machine()
-            if self.should_stop:
-                print("Robot homing stopped by user")
+            if self.user_stopped("homing"):
                 return False
         return True
 
+    def user_stopped(self, activity: str) -> bool:
+        """Checks the should_stop flag during homing or moving, True if the user stopped."""
+        if self.should_stop:
+            MACHINE_LOGGER.info("Robot %s stopped by user", activity)
+        return self.should_stop
+
     def go_to_first_color(self):
         """
         Moving the robot to the first color
@@ -85,18 +124,151 @@ class StateMachine:
             bool: True if the robot reached the first color,
                   False if the robot would move out of the LED strip.
         """
-        print("Robot moving to first color")
-        while self.stepper.get_color() == assets.IO_BAND_COLORS.BLANK:
+        MACHINE_LOGGER.info("Robot moving to first color")
+        while self.read_color() == assets.IO_BAND_COLORS.BLANK:
             self.pause_machine()
-            if self.should_stop:
-                print("Robot go_to_first_color stopped by user")
+            if self.user_stopped("go_to_first_color"):
                 return False
             new_position = self.stepper.move_robot_led_step(assets.ROBOT_DIRECTIONS.RIGHT,
                                                             self.speed)
-            self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', new_position)))
-            print(f"Position set to {self.position}  new Position was {new_position}")
-            if self.position <= 0:
+            if not self.moved_to(new_position):
+                return False
+        return True
+
+    def moved_to(self, new_position: int) -> bool:
+        """
+        Sets the position after a move.
+        Returns:
+            bool: False if the move failed or left the LED strip.
+        """
+        self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', new_position)))
+        MACHINE_LOGGER.debug("Position set to %s, new position was %s", self.position,
+                             new_position)
+        return self.position > 0
+
+    def _on_band(self) -> bool:
+        """Checks if the robot is on a known LED position."""
+        return 0 < self.position < len(self.shadow_band)
+
+    def read_color(self) -> assets.IO_BAND_COLORS:
+        """
+        Returns the color under the robot.
+        The sensor is only read if the color of the LED is not known from the shadow band.
+        """
+        if not self._on_band():
+            return self.stepper.get_color()
+        color = self.shadow_band[self.position]
+        if color is None:
+            color = self.stepper.get_color()
+            self.set_shadow_color(self.position, color)
+        return color
+
+    def set_shadow_color(self, position: int, color: assets.IO_BAND_COLORS):
+        """Stores the color of the LED in the shadow band and the cycle detection."""
+        self.shadow_band[position] = color
+        self.cycle_detector.write(position, color.value)
+
+    def invalidate_shadow_band(self):
+        """Forgets all known colors, they will be read again from the sensor."""
+        self.shadow_band = [None] * len(self.shadow_band)
+        self.cycle_detector.reset([UNKNOWN_SYMBOL] * len(self.shadow_band))
+
+    def scan_band(self) -> bool:
+        """
+        Reads every LED which is not known from the shadow band and returns to the current
+        position afterwards. The unknown LEDs are read in a single sweep from left to right.
+        Returns:
+            bool: True if the whole band is known, False if the robot could not be moved.
+        """
+        for led in self.unknown_leds():
+            self.pause_machine()
+            if self.user_stopped("scan_band"):
                 return False
+            if led != self.position:
+                new_position = self.stepper.move_robot_led_step(self.direction_to(led),
+                                                                self.speed,
+                                                                abs(led - self.position))
+                if not self.moved_to(new_position):
+                    return False
+            self.read_color()
+        return True
+
+    def direction_to(self, led: int) -> assets.ROBOT_DIRECTIONS:
+        """The direction from the current position to the LED."""
+        return assets.ROBOT_DIRECTIONS.RIGHT if led > self.position else \
+            assets.ROBOT_DIRECTIONS.LEFT
+
+    def unknown_leds(self) -> list[int]:
+        """The LEDs scan_band has to read, followed by the position to return to."""
+        return [led for led in range(1, len(self.shadow_band))
+                if self.shadow_band[led] is None] + [self.position]
+
+    def plan_run(self) -> bool:
+        """
+        Reads the whole band and simulates the program before the robot executes it.
+        Returns:
+            bool: True if the program reaches an accept state on the band,
+                  False if the run is doomed, the reason is saved in self.errors.
+        """
+        if not self.scan_band():
+            self.scan_failed()
+            return False
+        return self.evaluate_plan()
+
+    def scan_failed(self):
+        """Reports a failed scan_band, a stop by the user is no error."""
+        if not self.should_stop:
+            self.execute_with_lock_and_notify(
+                lambda: self.errors.append("Es gab ein Problem beim bewegen des Roboters."))
+
+    def evaluate_plan(self) -> bool:
+        """Simulates the program on the scanned band, see plan_run."""
+        budget = self.app.config['PLAN_STEP_BUDGET']
+        plan = planner.plan_run(self.program, self.shadow_band, self.position, budget)
+        self.execute_with_lock_and_notify(lambda: setattr(self, 'plan', plan))
+        MACHINE_LOGGER.info("Planned run: %s", plan)
+        if plan.outcome == planner.ACCEPT:
+            return True
+        messages = {
+            planner.REJECT: f"Dein Turing Programm erreicht nach {plan.steps} Schritten einen "
+                            f"Reject State.",
+            planner.OUT_OF_BAND: f"Dein Turing Programm ist zu groß für das Band, es verlässt "
+                                 f"das Band nach {plan.steps} Schritten.",
+            planner.STEP_BUDGET_EXHAUSTED: f"Dein Turing Programm hält nicht innerhalb von "
+                                           f"{budget} Schritten.",
+            planner.CYCLE: f"Dein Turing Programm hält nie, nach {plan.steps} Schritten "
+                           f"wiederholt sich eine Konfiguration."
+        }
+        self.execute_with_lock_and_notify(
+            lambda: (self.errors.append(messages[plan.outcome]), self.errors.append(
+                "Die Vorab-Simulation hat den Lauf abgelehnt, der Roboter startet nicht.")))
+        return False
+
+    def verify_plan(self):
+        """
+        Compares the executed steps with the plan. If the robot deviates, e.g. because the
+        band was changed during a pause, the plan is discarded.
+        """
+        if self.plan is None or self.plan.matches(self.steps, self.state_id, self.position):
+            return
+        MACHINE_LOGGER.warning("Run deviates from the plan at step %s", self.steps)
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'plan', None), self.errors.append(
+                "Der Roboter weicht von der Vorab-Simulation ab, der Plan wird verworfen.")))
+
+    def detect_cycle(self) -> bool:
+        """
+        Checks if the current configuration was already reached.
+        Returns:
+            bool: True if the run can never halt, the reason is saved in self.errors.
+        """
+        if not self.cycle_detector.observe(self.state_id, self.position):
+            return False
+        MACHINE_LOGGER.warning("Configuration repeated at step %s", self.steps)
+        self.execute_with_lock_and_notify(
+            lambda: self.errors.append(
+                f"Dein Turing Programm hält nie: Zustand {self.current_state} an Position "
+                f"{self.position} wiederholt sich mit demselben Band (Schritt {self.steps})."))
         return True
 
     def execute_with_lock_and_notify(self, task):
@@ -106,49 +278,191 @@ class StateMachine:
 
         :param task: Eine Callback-Funktion, die die eigentliche Arbeit ausführt.
         """
-        with self.lock:
+        with STEP_PHASE_SECONDS.time("lock_notify"), self.lock:
             task()  # Führe die Arbeit aus
             self._notify_listeners()
 
     def single_step(self):
         """
-        Executes a single step of the Turing machine.
+        Executes a single step of the Turing machine, the duration of its phases is recorded
+        in metrics.STEP_PHASE_SECONDS.
         :returns:
             bool: True if the step was executed successfully,
                   False if there was no transition for the current step.
         """
-        transition = self.state_transitions.get((self.current_state, self.stepper.get_color()))
+        with STEP_PHASE_SECONDS.time("step"):
+            return self._single_step()
+
+    def _single_step(self):
+        with STEP_PHASE_SECONDS.time("read_color"):
+            color = self.read_color()
+        transition = self.begin_step(color)
+        if transition is None:
+            return False
+        write_color = assets.IO_BAND_COLORS(transition.write_symbol)
+        new_color = None
+        if color == write_color:
+            # nothing to write, just move
+            with STEP_PHASE_SECONDS.time("move"):
+                new_position = self.stepper.move_robot_led_step(transition.move, self.speed)
+        else:
+            with STEP_PHASE_SECONDS.time("write_move"):
+                new_position, new_color = self.stepper.execute_step(
+                    write_color, transition.move, self.speed, current_color=color)
+            if not self.written(new_position, write_color):
+                return False
+        return self.finish_step(new_position, new_color)
+
+    def begin_step(self, color: assets.IO_BAND_COLORS):
+        """
+        Looks up the transition for the color under the robot and enters its new state.
+        :returns: the Transition, None if the step can not be executed.
+        """
+        if self.cancel_token.cancelled:
+            return None  # the color was not read
+        transition = self.program.transition(self.state_id, color.value)
         if transition is None:
-            print(f"No transition for {self.current_state}, color {self.stepper.get_color()}")
+            MACHINE_LOGGER.info("No transition for %s, color %s", self.current_state, color)
             self.execute_with_lock_and_notify(
                 lambda: self.errors.append("Dein Turing Programm hat einen Reject State erreicht."))
-            return False
+            return None
         self.execute_with_lock_and_notify(
-            lambda: setattr(self, 'current_state', transition['new_state']))
-        toggle_retry = 0
-        while self.stepper.get_color() != transition['write_symbol']:
-            if toggle_retry >= self.app.config['TOGGLE_IO_BAND_RETRYS']:
-                self.execute_with_lock_and_notify(
-                    lambda: self.errors.append("Das IO-Band kann nicht bearbeitet werden."))
-                return False
-            toggle_retry += 1
-            self.stepper.toggle_io_band()
-        new_position = self.stepper.move_robot_led_step(transition['move'], self.speed)
+            lambda: (setattr(self, 'state_id', transition.new_state),
+                     setattr(self, 'current_state',
+                             self.program.state_names[transition.new_state])))
+        return transition
+
+    def written(self, new_position: int, write_color: assets.IO_BAND_COLORS) -> bool:
+        """
+        Checks the result of execute_step before the position changes.
+        :returns: False if the color could not be written or the step was interrupted.
+        """
+        if self.cancel_token.cancelled:
+            self.invalidate_shadow_band()  # the step was interrupted
+            return False
+        if new_position == -3:
+            self.invalidate_shadow_band()
+            self.execute_with_lock_and_notify(
+                lambda: self.errors.append("Das IO-Band kann nicht bearbeitet werden."))
+            return False
+        if self._on_band():
+            self.set_shadow_color(self.position, write_color)
+        return True
+
+    def finish_step(self, new_position: int, new_color: assets.IO_BAND_COLORS | None) -> bool:
+        """
+        Moves to the new position after the color was written.
+        :returns: False if the robot left the LED strip or could not be moved.
+        """
         self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', new_position)))
-        print(f"Position set to {self.position}  new Position was {new_position}")
+        if new_color is not None and self._on_band():
+            self.set_shadow_color(self.position, new_color)
+        MACHINE_LOGGER.debug("Position set to %s, new position was %s", self.position,
+                             new_position)
         if self.position == -2:
             self.execute_with_lock_and_notify(
                 lambda: self.errors.append("Dein Turing Programm ist zu groß für das Band."))
-            print("Band ended")
+            MACHINE_LOGGER.warning("Band ended")
             return False
         if self.position < 0:
             self.execute_with_lock_and_notify(
                 lambda: self.errors.append("Es gab ein Problem beim bewegen des Roboters."))
-            print(f"Error while moving the robot, error code: {self.position}")
+            MACHINE_LOGGER.error("Error while moving the robot, error code: %s", self.position)
             return False
         self.execute_with_lock_and_notify(lambda: setattr(self, 'steps', self.steps + 1))
+        STEPS.inc()
         return True
 
+    def predict_scan(self):
+        """
+        Predicts the upcoming transitions from the shadow band. A scan is a run of transitions
+        which move in the same direction over known LEDs and write the color they read.
+        :returns:
+            tuple: (amount of steps, state ID after the scan, direction)
+        """
+        state = self.state_id
+        position = self.position
+        direction = None
+        steps = 0
+        while (steps < self.app.config['MAX_COALESCED_LEDS']
+               and 0 < position < len(self.shadow_band)):
+            color = self.shadow_band[position]
+            if color is None or self.program.accepting[state]:
+                break
+            transition = self.program.transition(state, color.value)
+            if (transition is None or transition.write_symbol != color.value
+                    or transition.move is assets.ROBOT_DIRECTIONS.HOLD
+                    or direction not in (None, transition.move)
+                    or not 0 < position + transition.delta < len(self.shadow_band)):
+                break
+            direction = transition.move
+            state = transition.new_state
+            position += transition.delta
+            steps += 1
+        return steps, state, direction
+
+    def coalesced_step(self) -> bool | None:
+        """
+        Executes a predicted scan with a single multi-LED move.
+        The color at the end of the scan is verified before the steps are applied, if the band
+        differs from the shadow band the run is ended. The LEDs crossed by the move are not
+        read, their colors are taken from the shadow band like in read_color, so a change of
+        one of them by hand during the run is not noticed.
+        :returns:
+            bool: True if a scan of at least two steps was executed,
+                  False if the scan failed, the reason is saved in self.errors,
+                  None if no scan was predicted and single_step has to be used.
+        """
+        steps, state, direction = self.predict_scan()
+        if steps < 2:
+            return None
+        start_position = self.stepper.current_position
+        new_position = self.stepper.move_robot_led_step(direction, self.speed, steps)
+        if new_position < 0:
+            return self.scan_move_failed(start_position, new_position)
+        predicted_color = self.shadow_band[new_position]
+        if predicted_color is not None and self.stepper.get_color() != predicted_color:
+            return self.prediction_failed(new_position)
+        self.scanned(steps, state, new_position)
+        return True
+
+    def scan_move_failed(self, start_position: int, new_position: int) -> bool:
+        """
+        The multi-LED move of a scan failed, the LED position counted by the controller is
+        reset to the position before the move.
+        :returns: False, the result of the scan.
+        """
+        self.stepper.current_position = start_position
+        self.execute_with_lock_and_notify(
+            lambda: self.errors.append("Es gab ein Problem beim bewegen des Roboters."))
+        MACHINE_LOGGER.error("Error while moving the robot over a scan, error code: %s",
+                             new_position)
+        return False
+
+    def scanned(self, steps: int, state: int, new_position: int):
+        """Applies a verified coalesced scan after the move."""
+        MACHINE_LOGGER.debug("Coalesced %s steps to position %s", steps, new_position)
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'state_id', state),
+                     setattr(self, 'current_state', self.program.state_names[state]),
+                     setattr(self, 'position', new_position),
+                     setattr(self, 'steps', self.steps + steps)))
+        STEPS.inc(steps)
+
+    def prediction_failed(self, new_position: int) -> bool:
+        """
+        The color at the end of a scan differs from the shadow band, the IO band was changed
+        during the run. The robot stays at the end of the scan, the steps are not applied.
+        :returns: False, the result of the scan.
+        """
+        MACHINE_LOGGER.error("IO band differs from the prediction at LED %s", new_position)
+        self.invalidate_shadow_band()
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'position', new_position),
+                     self.errors.append("Das IO-Band wurde während des Laufs verändert.")))
+        return False
+
+    # pylint: disable=too-many-return-statements
     def run(self):
         """
         Run the state machine
@@ -156,79 +470,134 @@ class StateMachine:
             bool: True if the tm reached an accept state,
                   False if there accept wasn't reached, reason is saved in self.errors.
         """
-        self.execute_with_lock_and_notify(
-            lambda: (setattr(self, 'running', True), setattr(self, 'should_stop', False)))
+        self.start_run()
         if not self.home_robot():
-            print("Robot homing failed")
-            self.execute_with_lock_and_notify(
-                lambda: (setattr(self, 'running', False),
-                         setattr(self, 'pause', False),
-                         setattr(self, 'should_stop', False),
-                         self.errors.append("Der Roboter konnte nicht homen.")))
-            return False
+            return self.homing_failed()
         self.pause_machine()
-        if self.should_stop:
-            self.stop_by_flag()
+        if self.stopped_by_flag():
             return False
         if not self.go_to_first_color():
-            print("Blank io_band, Robot would move out of the LED strip")
+            MACHINE_LOGGER.warning("Blank io_band, Robot would move out of the LED strip")
             new_position = self.stepper.move_robot_led_step(assets.ROBOT_DIRECTIONS.LEFT,
                                                             self.speed,
                                                             int(self.app.config['LED_AMOUNT'] / 2))
-            self.execute_with_lock_and_notify(lambda: (setattr(self, 'position', new_position)))
-            if self.position <= 0:
-                self.execute_with_lock_and_notify(
-                    lambda: self.errors.append("Es gab ein Problem beim bewegen des Roboters."))
-                print(f"Error while moving the robot, error code: {self.position}")
+            if not self.returned_from_blank_band(new_position):
                 return False
-        print("Robot reached the start of input")
-        while self.current_state not in self.accept_states:
+        MACHINE_LOGGER.info("Robot reached the start of input")
+        if self.app.config['PLAN_STEP_BUDGET'] > 0 and not self.plan_run():
+            return self.end_run()
+        while not self.program.accepting[self.state_id]:
             self.pause_machine()
-            if self.should_stop:
-                self.stop_by_flag()
-                return False
-            print(f"Current state: {self.current_state}")
-            if not self.single_step():
-                print(self.errors)
-                self.execute_with_lock_and_notify(
-                    lambda: (setattr(self, 'running', False),
-                             setattr(self, 'pause', False),
-                             setattr(self, 'should_stop', False),
-                             self.errors.append(
-                                 "Dein Turing Programm wurde aufgrund eines Fehlers gestoppt.")))
+            if self.stopped_by_flag():
                 return False
-        print("Robot reached an accept state")
+            MACHINE_LOGGER.debug("Current state: %s", self.current_state)
+            step = self.coalesced_step()  # None if no scan was predicted
+            if not (step if step is not None else self.single_step()):
+                return self.step_failed()
+            if self.run_doomed():
+                return self.end_run()
+        return self.accepted()
+
+    def start_run(self):
+        """Marks the machine as running."""
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'running', True), setattr(self, 'should_stop', False)))
+
+    def stopped_by_flag(self) -> bool:
+        """Stops the run if the should_stop flag is set, returns True if it was stopped."""
+        if not self.should_stop:
+            return False
+        self.stop_by_flag()
+        return True
+
+    def end_run(self, *errors) -> bool:
+        """
+        Ends the run without reaching an accept state, a stop by the user is reported as such.
+        :returns: False, the result of the run.
+        """
+        if self.stopped_by_flag():
+            return False
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'running', False),
+                     setattr(self, 'pause', False),
+                     setattr(self, 'should_stop', False),
+                     self.errors.extend(errors)))
+        return False
+
+    def homing_failed(self) -> bool:
+        """Ends the run after home_robot failed."""
+        if not self.should_stop:
+            MACHINE_LOGGER.error("Robot homing failed")
+        return self.end_run("Der Roboter konnte nicht homen.")
+
+    def returned_from_blank_band(self, new_position: int) -> bool:
+        """Sets the position after the move back from a blank band, False on an error."""
+        if self.moved_to(new_position):
+            return True
+        self.execute_with_lock_and_notify(
+            lambda: self.errors.append("Es gab ein Problem beim bewegen des Roboters."))
+        MACHINE_LOGGER.error("Error while moving the robot, error code: %s", self.position)
+        return False
+
+    def step_failed(self) -> bool:
+        """Ends the run after a step could not be executed."""
+        if not self.should_stop:
+            MACHINE_LOGGER.info("Run ended: %s", self.errors[-1] if self.errors else "")
+        return self.end_run("Dein Turing Programm wurde aufgrund eines Fehlers gestoppt.")
+
+    def run_doomed(self) -> bool:
+        """Checks the executed step against the plan and for a cycle."""
+        self.verify_plan()
+        return self.detect_cycle()
+
+    def accepted(self) -> bool:
+        """Ends the run in an accept state."""
+        MACHINE_LOGGER.info("Robot reached an accept state")
         self.execute_with_lock_and_notify(lambda: setattr(self, 'running', False))
         return True
 
     def pause_machine(self):
-        """Pause the state machine"""
-        while self.pause:
-            if self.should_stop:
-                return
-            time.sleep(0.1)
+        """Waits while the state machine is paused, a resume or stop wakes it immediately"""
+        self.cancel_token.wait_while_paused()
 
     def pause_program(self):
         """Setting the flag to Pause the state machine"""
         self.execute_with_lock_and_notify(lambda: setattr(self, 'pause', True))
-        print("Robot paused")
+        self.cancel_token.pause()
+        MACHINE_LOGGER.info("Robot paused")
 
     def resume_program(self):
         """Setting the flag to Resume the state machine"""
+        # the io band may have been changed by hand during the pause
+        self.invalidate_shadow_band()
         self.execute_with_lock_and_notify(lambda: setattr(self, 'pause', False))
-        print("Robot resumed")
+        self.cancel_token.resume()
+        MACHINE_LOGGER.info("Robot resumed")
 
     def stop_program(self):
         """Stop the state machine at the next opportunity, set the should_stop flag"""
         self.execute_with_lock_and_notify(
             lambda: (setattr(self, 'should_stop', True), self.errors.append(
                 "Dein Turing Programm wird bei nächster Gelegenheit gestoppt.")))
-        print("should_stop flag set, Robot will stop soon")
+        self.cancel_token.request_stop()
+        MACHINE_LOGGER.info("should_stop flag set, Robot will stop soon")
+
+    def emergency_stop(self):
+        """
+        Stops the state machine immediately: the running serial command is interrupted and
+        the firmware aborts the motor move. The machine thread ends without further commands.
+        """
+        self.execute_with_lock_and_notify(
+            lambda: (setattr(self, 'should_stop', True), self.errors.append(
+                "Nothalt: Der Roboter wurde sofort angehalten.")))
+        self.cancel_token.cancel()
+        self.stepper.abort()
+        MACHINE_LOGGER.warning("Emergency stop, Robot aborted")
 
     def change_speed(self, speed):
         """Change the speed of the robot"""
         self.execute_with_lock_and_notify(lambda: setattr(self, 'speed', speed))
-        print(f"Speed changed to {speed}")
+        MACHINE_LOGGER.info("Speed changed to %s", speed)
 
     def stop_by_flag(self):
         """Stop the state machine after the should_stop flag was set"""
@@ -236,4 +605,4 @@ class StateMachine:
             lambda: (setattr(self, 'running', False), setattr(self, 'pause', False),
                      setattr(self, 'should_stop', False),
                      self.errors.append("Das Turing Programm wurde vom Benutzer gestoppt.")))
-        print("Robot stopped by should_stop flag")
+        MACHINE_LOGGER.info("Robot stopped by should_stop flag")
@@ -0,0 +1,332 @@
+"""
+This module contains the dispatcher of the robots.
+Every robot has its own serial port, its StateMachine and a StateBroadcaster for its
+websocket room, its worker thread runs the submitted programs one after the other.
+Runs for a robot wait in the queue of the robot, runs for any robot are assigned to an idle
+robot or wait in a shared queue for the next robot which becomes idle. Runs with a higher
+priority start first, runs of the same priority in the order they were submitted.
+"""
+import heapq
+import logging
+import re
+from collections import ChainMap
+from itertools import count
+from threading import Condition, Event, Lock, Thread
+
+import assets
+import async_machine
+import dannweisstobiesnicht as sm
+from broadcaster import StateBroadcaster
+
+DISPATCHER_LOGGER = logging.getLogger("dispatcher")
+
+# name of the robot if the ROBOTS config is empty, it uses the SERIAL_PORT config
+DEFAULT_ROBOT = "roboter"
+# robot names are part of the URLs and websocket rooms
+ROBOT_NAME_PATTERN = re.compile(r"[A-Za-z0-9_-]+")
+
+
+def parse_robots(value: str) -> list[tuple[str, str | None]]:
+    """
+    Parses the ROBOTS config "name=port,name=port" into (name, serial port) pairs.
+    An empty config is a single robot without a port, it uses the SERIAL_PORT config.
+    Raises ValueError for an invalid or duplicate entry.
+    """
+    robots = []
+    for entry in value.split(","):
+        if not entry.strip():
+            continue
+        name, _, port = (part.strip() for part in entry.partition("="))
+        if (not ROBOT_NAME_PATTERN.fullmatch(name) or not port
+                or name in (other for other, _ in robots)):
+            raise ValueError(f"Ungültiger Roboter: {entry.strip()}")
+        robots.append((name, port))
+    return robots or [(DEFAULT_ROBOT, None)]
+
+
+def priority_rank(priority: assets.RUN_PRIORITIES) -> int:
+    """Sort key of the priority, the highest priority first."""
+    return list(assets.RUN_PRIORITIES).index(priority)
+
+
+class RunRequest:
+    """A submitted run, robot is the name of the robot which executes it."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, run_id: int, tm_code, program: str, priority: assets.RUN_PRIORITIES,
+                 robot: str | None):
+        self.run_id = run_id
+        self.tm_code = tm_code
+        self.program = program
+        self.priority = priority
+        self.robot = robot
+
+    def queue_entry(self) -> tuple:
+        """Heap entry, the run ID breaks ties of the priority in submission order."""
+        return priority_rank(self.priority), self.run_id, self
+
+
+class RobotApp:
+    """The Flask app as seen by the StateMachine of a robot, with the port of the robot."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, app, serial_port: str | None):
+        self.config = ChainMap({'SERIAL_PORT': serial_port} if serial_port else {}, app.config)
+
+
+class Robot:
+    """
+    A robot on its serial port. The worker thread takes the next run from the dispatcher,
+    the state of the current machine is broadcast to the websocket room of the robot.
+    After an emergency stop the robot is halted, queued runs wait until it is released.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, name: str, serial_port: str | None, dispatcher: "Dispatcher"):
+        self.name = name
+        self.room = f"robot/{name}"
+        self.dispatcher = dispatcher
+        self.app = RobotApp(dispatcher.app, serial_port)
+        self.machine: sm.StateMachine | None = None
+        self.request: RunRequest | None = None  # the current or last run
+        self.queue = []  # heap of RunRequest.queue_entry
+        self.halted = False
+        self.idle = Event()  # cleared while a run is executed
+        self.idle.set()
+        self._errors = []  # errors without a machine, e.g. the port could not be opened
+        self._stop_lock = Lock()  # the ABORT of an emergency stop is sent before the close
+        self.broadcaster = StateBroadcaster(dispatcher.socketio, self.state, self.errors,
+                                            dispatcher.app.config['MAX_BROADCAST_RATE'],
+                                            assets.EVENT_JOURNAL_SIZE, room=self.room)
+        self._thread = Thread(target=self._work, daemon=True, name=f"TMZA-robot-{name}")
+
+    def start(self):
+        """Starts the worker thread."""
+        self._thread.start()
+
+    @property
+    def serial_port(self) -> str:
+        """The serial port of the robot."""
+        return self.app.config['SERIAL_PORT']
+
+    def state(self) -> dict:
+        """Returns the state of the robot and its machine for the websocket clients."""
+        machine = self.machine
+        state = {
+            'robot': self.name,
+            'queue': [request.program for request in self.dispatcher.queued(self)],
+            'halted': self.halted,
+            'program_name': self.request.program if self.request else '',
+            'state': '', 'step': 0, 'position': 0, 'run': False,
+            'pause': False, 'speed': 5, 'should_stop': False, 'plan': ''
+        }
+        if machine is not None:
+            state.update({
+                'program_name': machine.program_name,
+                'state': machine.current_state,
+                'step': machine.steps,
+                'position': machine.position,
+                'run': machine.running,
+                'pause': machine.pause,
+                'speed': machine.speed,
+                'should_stop': machine.should_stop,
+                'plan': str(machine.plan) if machine.plan else ''
+            })
+        return state
+
+    def errors(self) -> list[str]:
+        """Returns the error list of the current machine, errors are sent as journal events."""
+        return self.machine.errors if self.machine is not None else self._errors
+
+    @property
+    def busy(self) -> bool:
+        """True while a run is executed."""
+        return not self.idle.is_set()
+
+    def _work(self):
+        while True:
+            self.execute(self.dispatcher.next_request(self))
+
+    def execute(self, request: RunRequest):
+        """Runs the program of the request on this robot, called by the worker thread."""
+        DISPATCHER_LOGGER.info("Robot %s starts run %s (%s)", self.name, request.run_id,
+                               request.program)
+        self.machine = None
+        self.request = request
+        self._errors = []
+        self.broadcaster.reset(self.app.config['MAX_BROADCAST_RATE'], request.program)
+        try:
+            machine = self.create_machine(request.tm_code)
+        except OSError as e:  # the serial port can not be opened
+            DISPATCHER_LOGGER.error("Robot %s is not reachable: %s", self.name, e)
+            self._errors = [f"Der Roboter {self.name} ist nicht erreichbar: {e}"]
+            self.finish()
+            return
+        with self.dispatcher.condition:
+            halted = self.halted
+            if not halted:
+                self.machine = machine
+        if halted:  # emergency stop while the serial port was opened
+            machine.stepper.close()
+            self._errors = ["Nothalt: Der Roboter wurde sofort angehalten."]
+            self.finish()
+            return
+        machine.add_listener(self.broadcaster.notify)
+        try:
+            if isinstance(machine, async_machine.AsyncStateMachine):
+                async_machine.run_in_event_loop(machine, self.broadcaster)
+            else:
+                machine.run()
+        except Exception:  # pylint: disable=broad-exception-caught
+            # a failing run must not stop the robot, the next run starts with a new machine
+            DISPATCHER_LOGGER.exception("Run %s on robot %s failed", request.run_id, self.name)
+        finally:
+            with self._stop_lock:
+                machine.stepper.close()  # release the serial port until the next run
+            self.finish()
+
+    def create_machine(self, tm_code) -> sm.StateMachine:
+        """Creates the machine of the EXECUTION_MODE, the serial port is opened."""
+        if (assets.EXECUTION_MODES(self.app.config['EXECUTION_MODE'])
+                is assets.EXECUTION_MODES.ASYNCIO):
+            return async_machine.AsyncStateMachine(tm_code, self.app)
+        return sm.StateMachine(tm_code, self.app)
+
+    def finish(self):
+        """The run ended, the robot is idle."""
+        self.idle.set()
+        self.broadcaster.notify()
+
+    def emergency_stop(self) -> bool:
+        """
+        Stops the running machine immediately and halts the robot, queued runs do not start
+        until release. Returns False if no run was executed.
+        """
+        if not self.busy:
+            return False
+        self.dispatcher.halt(self)
+        machine = self.machine  # None while the serial port is opened, the run does not start
+        if machine is not None:
+            with self._stop_lock:
+                machine.emergency_stop()
+        if not self.idle.wait(assets.EMERGENCY_STOP_TIMEOUT):
+            DISPATCHER_LOGGER.error(
+                "Robot %s did not end its run within %s s after the emergency stop", self.name,
+                assets.EMERGENCY_STOP_TIMEOUT)
+            if machine is not None:
+                machine.stepper.close()
+        return True
+
+    def release(self):
+        """Releases the robot after an emergency stop, the next queued run starts."""
+        self.dispatcher.release(self)
+
+
+class Dispatcher:
+    """
+    Manages the robots of the ROBOTS config and their run queues.
+    :arg socketio: the SocketIO server, every robot broadcasts to its own room
+    :arg app: the Flask app with the config
+    """
+
+    def __init__(self, socketio, app):
+        self.socketio = socketio
+        self.app = app
+        self.condition = Condition()  # guards the queues and the halted flags
+        self.shared_queue = []  # heap of runs for any robot
+        self._run_ids = count(1)
+        self.robots = {name: Robot(name, port, self) for name, port
+                       in parse_robots(app.config['ROBOTS'])}
+
+    def start(self):
+        """Starts the worker threads of the robots."""
+        for robot in self.robots.values():
+            robot.start()
+
+    def robot(self, name: str | None = None) -> Robot | None:
+        """Returns the robot with the name, the first robot if name is None."""
+        if name is None:
+            return next(iter(self.robots.values()))
+        return self.robots.get(name)
+
+    def submit(self, tm_code, program: str,
+               priority: assets.RUN_PRIORITIES = assets.RUN_PRIORITIES.NORMAL,
+               robot: Robot | None = None) -> RunRequest:
+        """
+        Queues a run for the robot. Without a robot the run is assigned to an idle robot
+        with an empty queue, if every robot is busy it waits for the next idle robot.
+        """
+        with self.condition:
+            if robot is None:
+                robot = next((candidate for candidate in self.robots.values()
+                              if not candidate.busy and not candidate.halted
+                              and not candidate.queue), None)
+            request = RunRequest(next(self._run_ids), tm_code, program, priority,
+                                 robot.name if robot is not None else None)
+            heapq.heappush(robot.queue if robot is not None else self.shared_queue,
+                           request.queue_entry())
+            self.condition.notify_all()
+        DISPATCHER_LOGGER.info("Run %s (%s) queued for robot %s", request.run_id, program,
+                               request.robot or "any")
+        self._notify(robot)
+        return request
+
+    def next_request(self, robot: Robot) -> RunRequest:
+        """
+        Blocks until a run for the robot is queued and the robot is not halted, returns the
+        run with the highest priority of the queue of the robot and the shared queue.
+        """
+        with self.condition:
+            while robot.halted or not (robot.queue or self.shared_queue):
+                self.condition.wait()
+            queue = min((queue for queue in (robot.queue, self.shared_queue) if queue),
+                        key=lambda queue: queue[0][:2])
+            request = heapq.heappop(queue)[2]
+            request.robot = robot.name
+            robot.idle.clear()
+        self._notify(robot)
+        return request
+
+    def cancel(self, run_id: int) -> RunRequest | None:
+        """Removes a queued run, returns None if it is not queued (anymore)."""
+        with self.condition:
+            for robot, queue in self._queues():
+                entry = next((entry for entry in queue if entry[1] == run_id), None)
+                if entry is not None:
+                    queue.remove(entry)
+                    heapq.heapify(queue)
+                    break
+            else:
+                return None
+        DISPATCHER_LOGGER.info("Run %s (%s) cancelled", run_id, entry[2].program)
+        self._notify(robot)
+        return entry[2]
+
+    def queued(self, robot: Robot | None = None) -> list[RunRequest]:
+        """The waiting runs of the robot (or the shared queue) in the order they start."""
+        with self.condition:
+            queue = robot.queue if robot is not None else self.shared_queue
+            return [entry[2] for entry in sorted(queue, key=lambda entry: entry[:2])]
+
+    def halt(self, robot: Robot):
+        """Queued runs of the robot do not start until release."""
+        with self.condition:
+            robot.halted = True
+        self._notify(robot)
+
+    def release(self, robot: Robot):
+        """The robot takes queued runs again."""
+        with self.condition:
+            robot.halted = False
+            self.condition.notify_all()
+        self._notify(robot)
+
+    def _queues(self):
+        """(robot, queue) of every robot and (None, shared queue)."""
+        return [(robot, robot.queue) for robot in self.robots.values()] + \
+            [(None, self.shared_queue)]
+
+    def _notify(self, robot: Robot | None):
+        """Sends the changed queue to the clients, the condition must not be held."""
+        if robot is not None:
+            robot.broadcaster.notify()
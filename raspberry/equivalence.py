@@ -0,0 +1,316 @@
+"""
+This module contains the bounded equivalence check of two turing machine programs, e.g. of a
+resubmitted program against the reference.
+Both programs are run on every input over {0, 1} up to a length bound, the results (accept,
+reject, max_steps = no halt within the step budget) and the final tapes are compared.
+
+The inputs are enumerated as a prefix trie: a run is only continued for the longer inputs
+when its head reads the first cell behind the prefix, the steps before are shared by all
+inputs with that prefix. The subtrees of the trie are checked in a process pool.
+
+Usage (from the raspberry folder):
+    python equivalence.py reference.txt candidate.txt --length 10
+"""
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import assets
+import turingmachine_interpreter as tm_interp
+from batch_simulation import pool_context
+from simulator import BLANK, COLOR_CHARACTERS, build_table, decode_band, encode_band_input
+from turingmachine_compiler import COLOR_AMOUNT, compile_turing_machine
+
+# input symbols of the enumerated tapes
+INPUT_SYMBOLS = (assets.IO_BAND_COLORS.RED.value, assets.IO_BAND_COLORS.BLUE.value)
+
+# checker of the worker processes, set by the initializer of the pool
+_CHECKER = None
+
+
+class _Run:
+    """
+    A run of a program on the inputs with the same prefix.
+    The tape ends with the last input cell of the prefix (known cells), unless the input
+    ended (free), then the tape grows with blanks. result is None while the run waits for
+    the next input cell.
+    """
+    # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    __slots__ = ('state', 'tape', 'head', 'offset', 'steps', 'known', 'free', 'result')
+
+    def __init__(self, state: int):
+        self.state = state
+        self.tape = bytearray()
+        self.head = 0
+        self.offset = 0  # index of input cell 0 in tape
+        self.steps = 0
+        self.known = 0
+        self.free = False
+        self.result = None
+
+    def copy(self) -> "_Run":
+        """Copy for another branch of the trie."""
+        run = _Run(self.state)
+        run.tape = self.tape[:]
+        run.head, run.offset, run.steps = self.head, self.offset, self.steps
+        run.known, run.free, run.result = self.known, self.free, self.result
+        return run
+
+    def final_tape(self, band_input: str) -> str:
+        """The tape at the end of the run on the input, the unread input cells included."""
+        return decode_band(self.tape + encode_band_input(band_input[self.known:]))
+
+
+class _Program:
+    """Transition table of a program for the runs."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, tm_code):
+        compiled = tm_code.get('compiled') or compile_turing_machine(tm_code)
+        self.table = build_table(compiled)
+        self.accepting = compiled.accepting
+        self.init = compiled.init
+
+    def advance(self, run: _Run, max_steps: int):
+        """
+        Executes the run until it halts, exceeds max_steps or reads the cell behind the known
+        input cells. The result is set when the run ended.
+        """
+        table = self.table
+        tape, head, state, steps = run.tape, run.head, run.state, run.steps
+        while steps < max_steps:
+            if head < 0:
+                size = max(len(tape), 1)
+                tape[0:0] = bytes([BLANK]) * size
+                head += size
+                run.offset += size
+            elif head >= len(tape):
+                if not run.free:
+                    break  # the next input cell decides how the run continues
+                tape.extend(bytes([BLANK]) * max(len(tape), 1))
+            transition = table[state * COLOR_AMOUNT + tape[head]]
+            if transition is None:
+                run.result = "reject"  # accept states have no transitions either
+                break
+            state, tape[head], move = transition
+            steps += 1
+            head += move
+        run.head, run.state, run.steps = head, state, steps
+        if self.accepting[state]:
+            run.result = "accept"
+        elif run.result is None and steps >= max_steps:
+            run.result = "max_steps"
+
+    def feed(self, run: _Run, symbol: int | None, max_steps: int) -> _Run:
+        """Continues the waiting run with the next input cell, None ends the input."""
+        if run.result is not None:
+            return run  # the run ended before it read the cell
+        run = run.copy()
+        if symbol is None:
+            run.free = True
+        else:
+            run.tape.append(symbol)
+            run.known += 1
+        self.advance(run, max_steps)
+        return run
+
+
+def _outcome(run: _Run, band_input: str) -> dict:
+    """The compared result of a run, the tape of a run without halt is not compared."""
+    return {"result": run.result, "steps": run.steps,
+            "tape": run.final_tape(band_input) if run.result != "max_steps" else None}
+
+
+def _same_for_all_inputs(run_a: _Run, run_b: _Run) -> bool:
+    """True if both runs ended and their outcomes are equal for every longer input."""
+    if run_a.result is None or run_b.result is None or run_a.result != run_b.result:
+        return False
+    if run_a.result == "max_steps":
+        return True
+    blank = bytes([BLANK])
+    return (run_a.known == run_b.known
+            and run_a.tape.lstrip(blank) == run_b.tape.lstrip(blank))
+
+
+def _first_counterexamples(counterexamples: list[dict], limit: int) -> list[dict]:
+    """The shortest counterexamples, inputs of the same length in lexicographic order."""
+    return sorted(counterexamples,
+                  key=lambda example: (len(example["input"]), example["input"]))[:limit]
+
+
+def _subtree_size(depth: int, max_length: int) -> int:
+    """Amount of inputs longer than depth, up to max_length, with a given prefix of depth."""
+    return 2 ** (max_length - depth + 1) - 2
+
+
+class _Checker:
+    """Compares two programs on the subtrees of the prefix trie."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, tm_a, tm_b, max_steps: int, limit: int):
+        self.programs = (_Program(tm_a), _Program(tm_b))
+        self.max_steps = max_steps
+        self.limit = limit
+        self.inputs = 0
+        self.counterexample_count = 0
+        self.counterexamples = []
+
+    def check(self, prefix: str, max_length: int) -> tuple[int, int, list[dict]]:
+        """
+        Compares the programs on the prefix and all longer inputs up to max_length.
+        :returns: amount of inputs, amount of counterexamples, the first counterexamples
+        """
+        self.inputs = 0
+        self.counterexample_count = 0
+        self.counterexamples = []
+        runs = []
+        for program in self.programs:
+            run = _Run(program.init)
+            program.advance(run, self.max_steps)
+            runs.append(run)
+        self._explore("", runs, prefix, max_length)
+        return (self.inputs, self.counterexample_count,
+                _first_counterexamples(self.counterexamples, self.limit))
+
+    def _explore(self, band_input: str, runs: list[_Run], prefix: str, max_length: int):
+        """
+        Depth first search of the trie, band_input is the path so far. Within the prefix only
+        the child of the prefix is explored.
+        """
+        depth = len(band_input)
+        if depth >= len(prefix):
+            self._compare(band_input, [program.feed(run, None, self.max_steps)
+                                       for program, run in zip(self.programs, runs)])
+            if depth < max_length and _same_for_all_inputs(*runs):
+                self.inputs += _subtree_size(depth, max_length)
+                return
+        if depth >= max_length:
+            return
+        for symbol in INPUT_SYMBOLS:
+            character = COLOR_CHARACTERS[symbol]
+            if depth < len(prefix) and prefix[depth] != character:
+                continue
+            self._explore(band_input + character,
+                          [program.feed(run, symbol, self.max_steps)
+                           for program, run in zip(self.programs, runs)],
+                          prefix, max_length)
+
+    def _compare(self, band_input: str, runs: list[_Run]):
+        self.inputs += 1
+        outcome_a, outcome_b = (_outcome(run, band_input) for run in runs)
+        if (outcome_a["result"], outcome_a["tape"]) == (outcome_b["result"], outcome_b["tape"]):
+            return
+        self.counterexample_count += 1
+        self.counterexamples.append({"input": band_input, "a": outcome_a, "b": outcome_b})
+        if len(self.counterexamples) > 2 * self.limit:
+            self.counterexamples = _first_counterexamples(self.counterexamples, self.limit)
+
+
+class EquivalenceReport:
+    """
+    Result of check_equivalence. counterexamples are the first ones (shortest inputs first),
+    with the outcome ("result", "steps", "tape") of the programs a and b.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, max_length: int, max_steps: int, inputs: int, counterexample_count: int,
+                 counterexamples: list[dict]):
+        # pylint: disable=too-many-arguments,too-many-positional-arguments
+        self.max_length = max_length
+        self.max_steps = max_steps
+        self.inputs = inputs
+        self.counterexample_count = counterexample_count
+        self.counterexamples = counterexamples
+
+    @property
+    def equivalent(self) -> bool:
+        """True if the programs behave the same on all checked inputs."""
+        return self.counterexample_count == 0
+
+    def __str__(self):
+        lines = [f"{self.inputs} Eingaben bis Länge {self.max_length} geprüft "
+                 f"(max. {self.max_steps} Schritte): "
+                 + ("gleiches Verhalten" if self.equivalent
+                    else f"{self.counterexample_count} Gegenbeispiele")]
+        for example in self.counterexamples:
+            lines.append(f"  '{example['input']}': "
+                         f"{example['a']['result']} {example['a']['tape']!r} / "
+                         f"{example['b']['result']} {example['b']['tape']!r}")
+        return "\n".join(lines)
+
+
+def _init_worker(tm_a, tm_b, max_steps: int, limit: int):
+    global _CHECKER  # pylint: disable=global-statement
+    _CHECKER = _Checker(tm_a, tm_b, max_steps, limit)
+
+
+def _check_subtree(prefix: str, max_length: int):
+    return _CHECKER.check(prefix, max_length)
+
+
+def _subtrees(max_length: int, workers: int) -> list[tuple[str, int]]:
+    """
+    Splits the trie into (prefix, max_length) tasks, about 4 per worker: the inputs shorter
+    than the split depth and the subtree of every prefix of the split depth.
+    """
+    depth = min(max_length, math.ceil(math.log2(4 * workers)))
+    if depth == 0:
+        return [("", max_length)]
+    prefixes = [format(number, f"0{depth}b") for number in range(2 ** depth)]
+    return [("", depth - 1)] + [(prefix, max_length) for prefix in prefixes]
+
+
+# pylint: disable=too-many-arguments,too-many-positional-arguments
+def check_equivalence(tm_a, tm_b, max_length: int,
+                      max_steps: int = assets.EQUIVALENCE_MAX_STEPS,
+                      counterexamples: int = assets.EQUIVALENCE_COUNTEREXAMPLES,
+                      workers: int = assets.BATCH_WORKERS) -> EquivalenceReport:
+    """
+    Compares the parsed programs (see parse_turing_machine) on all inputs over {0, 1} with
+    up to max_length characters, including the empty input. A run without halt within
+    max_steps has the result "max_steps", its tape is not compared.
+    workers is the amount of processes, 0 uses all cores, 1 checks in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    tasks = _subtrees(max_length, workers)
+    if workers == 1:
+        checker = _Checker(tm_a, tm_b, max_steps, counterexamples)
+        results = [checker.check(prefix, length) for prefix, length in tasks]
+    else:
+        with ProcessPoolExecutor(workers, mp_context=pool_context(), initializer=_init_worker,
+                                 initargs=(tm_a, tm_b, max_steps, counterexamples)) as executor:
+            results = list(executor.map(_check_subtree, *zip(*tasks)))
+    found = [example for _, _, examples in results for example in examples]
+    return EquivalenceReport(max_length, max_steps, sum(result[0] for result in results),
+                             sum(result[1] for result in results),
+                             _first_counterexamples(found, counterexamples))
+
+
+def main():
+    """Compares two program files and prints the report."""
+    parser = argparse.ArgumentParser(description="Bounded equivalence check of two programs.")
+    parser.add_argument("program_a", help="reference program")
+    parser.add_argument("program_b", help="compared program")
+    parser.add_argument("--length", type=int, default=8, help="maximum input length")
+    parser.add_argument("--language", default=assets.PROGRAM_LANGUAGES.COM.value,
+                        choices=[language.value for language in assets.PROGRAM_LANGUAGES])
+    parser.add_argument("--max-steps", type=int, default=assets.EQUIVALENCE_MAX_STEPS)
+    parser.add_argument("--counterexamples", type=int,
+                        default=assets.EQUIVALENCE_COUNTEREXAMPLES)
+    parser.add_argument("--workers", type=int, default=assets.BATCH_WORKERS,
+                        help="processes, 0 uses all cores")
+    args = parser.parse_args()
+
+    language = assets.PROGRAM_LANGUAGES(args.language)
+    programs = [tm_interp.load_turing_machine(path, language)
+                for path in (args.program_a, args.program_b)]
+    for path, tm_code in zip((args.program_a, args.program_b), programs):
+        if tm_code["errors"]:
+            parser.error(f"{path}: {'; '.join(tm_code['errors'])}")
+    print(check_equivalence(*programs, args.length, args.max_steps, args.counterexamples,
+                            args.workers))
+
+
+if __name__ == "__main__":
+    main()
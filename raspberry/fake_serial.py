@@ -0,0 +1,209 @@
+"""
+This module contains a local stand-in for the serial connection to the Arduino.
+FakeSerial speaks the protocol of arduino/steppermotor_example/sensorik_UART.ino on a
+VirtualBand, so the StepperMotorController can be tested without hardware.
+"""
+from threading import Condition
+
+import assets
+import serial_protocol
+from simulator import VirtualBand
+
+# Direction names used in the serial protocol
+PROTOCOL_DIRECTIONS = {direction.name: direction for direction in assets.ROBOT_DIRECTIONS}
+
+
+class FakeArduino:
+    """
+    Executes the firmware commands on a VirtualBand.
+    Each command returns the lines the firmware would print, the last one is the ACK.
+    """
+
+    def __init__(self, band: VirtualBand, supports_step: bool = True,
+                 supports_binary: bool = True,
+                 toggle_retries: int = assets.TOGGLE_IO_BAND_RETRYS):
+        self.band = band
+        self.toggle_retries = toggle_retries
+        self.binary_mode = False
+        self.handlers = {
+            "TOGGLE": self.handle_toggle,
+            "SETUP": self.handle_ok,
+            "CLEANUP": self.handle_ok,
+            "MOVE": self.handle_move,
+            "LIGHT": self.handle_light,
+            "COLOR": self.handle_color
+        }
+        # old firmware does not know the fused STEP command
+        if supports_step:
+            self.handlers["STEP"] = self.handle_step
+        # old firmware does not know the binary protocol
+        if supports_binary:
+            self.handlers["PROTO"] = self.handle_proto
+
+    def execute(self, line: str) -> list[str]:
+        """Executes a command line like "MOVE LEFT 30 13" and returns the printed lines."""
+        command, *args = line.split()
+        output = [f"Received command: {line}"]
+        handler = self.handlers.get(command)
+        if handler is None:
+            return output + ["Unknown command."]
+        return output + handler(args)
+
+    def handle_proto(self, args) -> list[str]:
+        """PROTO BIN <baudrate> switches to binary frames after the ACK."""
+        if len(args) != 2 or args[0] != "BIN":
+            return ["ACK:0"]
+        self.binary_mode = True
+        return ["ACK:1"]
+
+    def handle_ok(self, _args) -> list[str]:
+        """SETUP and CLEANUP have no effect on the virtual band."""
+        return ["ACK:1"]
+
+    def handle_toggle(self, _args) -> list[str]:
+        """TOGGLE presses the button under the robot."""
+        self.band.toggle()
+        return ["Tastendruck simuliert.", "ACK:1"]
+
+    def handle_move(self, args) -> list[str]:
+        """MOVE <direction> <delay_ms> <steps>"""
+        if len(args) != 3:
+            return ["MOVE: missing arguments"]
+        direction = PROTOCOL_DIRECTIONS.get(args[0])
+        if direction not in (assets.ROBOT_DIRECTIONS.LEFT, assets.ROBOT_DIRECTIONS.RIGHT):
+            return ["ACK:0"]
+        self.band.move(direction, abs(int(args[2])))
+        return ["ACK:1"]
+
+    def handle_light(self, _args) -> list[str]:
+        """LIGHT returns 1 if the light barrier is blocked."""
+        blocked = self.band.light_barrier_blocked()
+        return ["1023" if blocked else "0", f"ACK:{int(blocked)}"]
+
+    def handle_color(self, _args) -> list[str]:
+        """COLOR returns the color under the robot."""
+        return [f"ACK:{self.band.color().value}"]
+
+    def step_toggle_retries(self, args) -> int:
+        """The button presses of a STEP, older hosts do not send them."""
+        return int(args[4]) if len(args) > 4 else self.toggle_retries
+
+    def handle_step(self, args) -> list[str]:
+        """
+        STEP <write_color> <direction> <delay_ms> <steps> [<toggle_retries>],
+        ACK is the new color + 1.
+        """
+        if len(args) not in (4, 5):
+            return ["STEP: missing arguments"]
+        write_color = int(args[0])
+        retries = 0
+        while self.band.color().value != write_color:
+            if retries >= self.step_toggle_retries(args):
+                return ["STEP: Farbe konnte nicht geschrieben werden.", "ACK:0"]
+            self.band.toggle()
+            retries += 1
+        direction = PROTOCOL_DIRECTIONS.get(args[1])
+        if direction is None:
+            return ["ACK:0"]
+        self.band.move(direction, abs(int(args[3])))
+        return [f"ACK:{self.band.color().value + 1}"]
+
+
+class FakeSerial:
+    """
+    Minimal pyserial.Serial replacement, commands are executed as soon as they are written.
+    Like pyserial, read blocks until bytes arrive or the timeout expires.
+    After a successful PROTO command commands and ACKs are binary frames.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, arduino: FakeArduino, timeout=assets.TIMEOUT,
+                 baudrate=assets.BAUDRATE):
+        self.arduino = arduino
+        self.timeout = timeout
+        self.baudrate = baudrate  # ignored, there is no UART
+        self.is_open = True
+        self._output = bytearray()  # bytes waiting to be read
+        self._available = Condition()
+        self._buffer = b""
+        self._parser = serial_protocol.FrameParser()
+
+    @property
+    def in_waiting(self) -> int:
+        """Amount of bytes waiting to be read."""
+        with self._available:
+            return len(self._output)
+
+    def _answer(self, data: bytes):
+        with self._available:
+            self._output += data
+            self._available.notify_all()
+
+    def write(self, data: bytes) -> int:
+        """Receives bytes, every complete line or frame is executed by the FakeArduino."""
+        if data == serial_protocol.ABORT:
+            return len(data)  # commands are executed immediately, nothing to abort
+        if self.arduino.binary_mode:
+            frames, _ = self._parser.feed(data)
+            for opcode, seq, payload in frames:
+                self._answer(self._execute_frame(opcode, seq, payload))
+            return len(data)
+        self._buffer += data
+        while b"\n" in self._buffer and not self.arduino.binary_mode:
+            line, self._buffer = self._buffer.split(b"\n", 1)
+            line = line.decode('utf-8').strip()
+            if line:
+                self._answer(b"".join(f"{output}\r\n".encode('utf-8')
+                                      for output in self.arduino.execute(line)))
+        if self.arduino.binary_mode and self._buffer:
+            self.write(self._buffer)  # frames right behind the PROTO command
+            self._buffer = b""
+        return len(data)
+
+    def _execute_frame(self, opcode: int, seq: int, payload: bytes) -> bytes:
+        """Executes a binary command, the firmware prints no debug text in binary mode."""
+        if opcode == serial_protocol.OPCODES["PING"]:
+            return serial_protocol.encode_ack(seq, 1)
+        try:
+            command = serial_protocol.decode_command(opcode, payload)
+        except ValueError:
+            return serial_protocol.encode_ack(seq, -1)
+        acks = [line for line in self.arduino.execute(command) if line.startswith("ACK:")]
+        value = int(acks[-1].split("ACK:")[1]) if acks else -1
+        return serial_protocol.encode_ack(seq, value)
+
+    def read(self, size: int = 1) -> bytes:
+        """Returns up to size bytes, b"" if nothing arrived within the timeout."""
+        with self._available:
+            if not self._available.wait_for(lambda: self._output or not self.is_open,
+                                            self.timeout):
+                return b""
+            if not self.is_open:
+                raise OSError("FakeSerial is closed")
+            data = bytes(self._output[:size])
+            del self._output[:size]
+            return data
+
+    def readline(self) -> bytes:
+        """Returns the next line or the bytes received within the timeout."""
+        line = b""
+        while not line.endswith(b"\n"):
+            data = self.read()
+            if not data:
+                break
+            line += data
+        return line
+
+    def reset_input_buffer(self):
+        """Discards all bytes waiting to be read."""
+        with self._available:
+            self._output.clear()
+
+    def flush(self):
+        """Bytes are processed immediately, nothing to flush."""
+
+    def close(self):
+        """Closes the fake connection, a blocked read raises OSError immediately."""
+        with self._available:
+            self.is_open = False
+            self._available.notify_all()
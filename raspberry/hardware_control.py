@@ -1,11 +1,22 @@
 """
 This module contains Stepper Motor and Light Barrier Control via Serial (UART) with Arduino.
 """
+import asyncio
 import time
+import logging
 import platform
+from collections import deque
+from concurrent.futures import (CancelledError, Future, InvalidStateError,
+                                TimeoutError as FutureTimeoutError)
 from random import randrange
+from threading import Lock, Thread
 
 import assets
+import serial_protocol
+from cancellation import CancellationToken
+from metrics import ACK_TIMEOUTS, SERIAL_COMMAND_SECONDS, TOGGLE_RETRIES
+from simulator import VirtualBand
+from turingmachine_compiler import DIRECTION_DELTA
 
 if platform.system() == "Linux":
     import serial
@@ -23,6 +34,147 @@ SPEED_DELAY_MAP = {
     10: 7
 }
 
+# send_command result if the firmware does not know the command
+ACK_UNKNOWN_COMMAND = -1
+
+# debug output of the firmware
+ARDUINO_LOGGER = logging.getLogger("arduino")
+HARDWARE_LOGGER = logging.getLogger("hardware")
+
+
+class AckDispatcher:
+    """
+    Parses the bytes of the Arduino and hands the ACKs to the waiting commands,
+    in text mode in the order of their commands, in binary mode by sequence number.
+    All other lines (firmware debug prints) are routed to the "arduino" logger.
+    future_factory creates the Future of a command, e.g. loop.create_future for asyncio.
+    """
+
+    def __init__(self, future_factory=Future):
+        self.binary = False  # parse binary frames instead of text lines
+        self._future_factory = future_factory
+        self._pending = deque()  # (seq, Future) waiting for an ACK, oldest first
+        self._lock = Lock()
+        self._text = b""
+        self._parser = serial_protocol.FrameParser()
+
+    def expect_ack(self, seq: int | None = None):
+        """Registers a Future for the ACK of the next command, call it before writing."""
+        future = self._future_factory()
+        with self._lock:
+            self._pending.append((seq, future))
+        return future
+
+    def discard(self, future):
+        """Cancels and removes the Future of a command which was not sent, no ACK comes for it."""
+        future.cancel()
+        with self._lock:
+            self._pending = deque(entry for entry in self._pending if entry[1] is not future)
+
+    def _resolve(self, value, seq: int | None = None):
+        """Hands the ACK value to the oldest waiting command (with the sequence number)."""
+        future = None
+        with self._lock:
+            while self._pending:
+                pending_seq, pending = self._pending.popleft()
+                if seq is None or pending_seq == seq:
+                    future = pending
+                    break
+                if not pending.cancelled():  # ACK got lost, the caller times out
+                    self._pending.appendleft((pending_seq, pending))
+                    break
+        if future is None:
+            ARDUINO_LOGGER.warning("ACK without command: %s", value)
+            return
+        try:
+            future.set_result(value)
+        except (InvalidStateError, asyncio.InvalidStateError):
+            pass  # a timed out or cancelled command absorbs its late ACK
+
+    def _handle_line(self, line: str):
+        if line.startswith("ACK:"):
+            self._resolve(line.split("ACK:")[1])
+        elif line == "Unknown command.":
+            self._resolve(ACK_UNKNOWN_COMMAND)
+        elif line:
+            ARDUINO_LOGGER.debug("%s", line)
+
+    def feed(self, data: bytes):
+        """Handles the received bytes, incomplete lines and frames are kept."""
+        if self.binary:
+            frames, lines = self._parser.feed(data)
+            for opcode, seq, payload in frames:
+                if opcode == serial_protocol.OP_ACK:
+                    self._resolve(serial_protocol.decode_ack(payload), seq)
+            for line in lines:
+                ARDUINO_LOGGER.debug("%s", line)
+            return
+        self._text += data
+        while b"\n" in self._text:
+            line, self._text = self._text.split(b"\n", 1)
+            self._handle_line(line.decode('utf-8', errors='replace').strip())
+
+
+class SerialReader(AckDispatcher, Thread):
+    """Reads the bytes of the Arduino as they arrive and dispatches the ACKs."""
+
+    def __init__(self, ser):
+        AckDispatcher.__init__(self)
+        Thread.__init__(self, daemon=True, name="TMZA-serial-reader")
+        self.ser = ser
+        self._running = True
+
+    def run(self):
+        while self._running:
+            try:
+                data = self.ser.read(self.ser.in_waiting or 1)
+            except (OSError, TypeError, AttributeError) as e:  # port closed or unplugged
+                if self._running:
+                    ARDUINO_LOGGER.error("Serial reader stopped: %s", e)
+                break
+            if data:
+                self.feed(data)
+
+    def stop(self):
+        """Stops the reader, it exits after the current read."""
+        self._running = False
+
+
+def move_command(direction: assets.ROBOT_DIRECTIONS, delay_in_ms: int, steps: int) -> str:
+    """The MOVE command for the firmware."""
+    drict = "LEFT" if direction is assets.ROBOT_DIRECTIONS.LEFT else "RIGHT"
+    return f"MOVE {drict} {delay_in_ms} {steps}"
+
+
+def move_delay(direction: assets.ROBOT_DIRECTIONS, speed: int, steps: int) -> int:
+    """The delay between two motor steps in ms for the speed (1 is slow, 10 is fast)."""
+    delay_in_ms = SPEED_DELAY_MAP.get(speed, 10)
+    HARDWARE_LOGGER.debug("Move robot: direction: %s delay: %s sm-steps: %s", direction,
+                          delay_in_ms, steps)
+    return delay_in_ms
+
+
+def move_failed(direction: assets.ROBOT_DIRECTIONS, speed: int, steps: int) -> int:
+    """Logs a failed LED step, returns the error code -1 of move_robot_led_step."""
+    HARDWARE_LOGGER.error(
+        "Error: Robot failed to move while \"Move robot: direction: %s speed: %s "
+        "steps: %s\".", direction, speed, steps)
+    return -1
+
+
+def ack_timed_out() -> int:
+    """Counts and logs a missing ACK, returns the ACK value 0."""
+    ACK_TIMEOUTS.inc()
+    HARDWARE_LOGGER.warning("Timeout beim Warten auf ACK.")
+    return 0
+
+
+def create_virtual_band(config) -> VirtualBand:
+    """The VirtualBand of the simulation backend."""
+    return VirtualBand(config['LED_AMOUNT'], config['STEPS_BETWEEN_LEDS'],
+                       config['STEPS_BETWEEN_HOME_TO_FIRST_LED'], config['SIMULATION_INPUT'])
+
+
 class StepperMotorController:
     """
     Controls the stepper motors via a serial connection.
@@ -31,61 +183,168 @@ class StepperMotorController:
       - SETUP
       - CLEANUP
       - MOVE <direction> <speed> <steps>
+      - LIGHT
+      - COLOR
+      - STEP <write_color> <direction> <speed> <steps> <toggle_retries>
+    A serial_connection (e.g. fake_serial.FakeSerial) can be passed instead of a serial_port.
+    With SERIAL_PROTOCOL "binary" the commands are sent as binary frames at the
+    BINARY_BAUDRATE if the firmware supports it, else the text protocol is used.
+    After the cancel_token is cancelled, waiting commands return 0 immediately and no
+    further commands are sent.
     """
+    # pylint: disable=too-many-instance-attributes
 
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
     def __init__(self,
                  app,
                  serial_port=assets.SERIAL_PORT,
                  baudrate=assets.BAUDRATE,
-                 timeout=assets.TIMEOUT):
+                 timeout=assets.TIMEOUT,
+                 serial_connection=None,
+                 cancel_token: CancellationToken | None = None):
         # Flask app for config. Config changes are just supported after StateMachine restart.
         self.app = app
+        self.cancel_token = cancel_token or CancellationToken()
         self.current_position = 1
+        # Is set to False as soon as the firmware rejects the STEP command
+        self.fused_step_supported = True
+        self.binary_protocol = False
+        self._seq = 0
+        self.ser = serial_connection
+        self.reader = None
+        if self.ser is None:
+            self.connect(serial_port, baudrate, timeout)
+        if self.ser is not None:
+            self.reader = SerialReader(self.ser)
+            self.reader.start()
+            if (assets.SERIAL_PROTOCOLS(app.config['SERIAL_PROTOCOL'])
+                    is assets.SERIAL_PROTOCOLS.BINARY):
+                self.negotiate_binary_protocol(app.config['BINARY_BAUDRATE'])
+
+    def connect(self, serial_port, baudrate, timeout):
+        """Opens the serial connection to the Arduino."""
         if platform.system() == "Linux":
             try:
                 self.ser = serial.Serial(serial_port, baudrate, timeout=timeout)
                 time.sleep(2)
                 self.ser.reset_input_buffer()
             except Exception as e:
-                print(f"Error opening serial port: {e}")
+                HARDWARE_LOGGER.error("Error opening serial port: %s", e)
                 raise e
 
-    def wait_for_ack(self, timeout=assets.TIMEOUT):
+    def negotiate_binary_protocol(self, baudrate: int) -> bool:
+        """
+        Switches the firmware to binary frames at the given baudrate.
+        Old firmware does not know the PROTO command, then the text protocol is kept.
+        Raises OSError and closes the connection if the firmware switched but does not answer.
+        """
+        ack = self.send_command(serial_protocol.NEGOTIATE_COMMAND.format(baudrate=baudrate))
+        if ack != 1:
+            HARDWARE_LOGGER.warning(
+                "Firmware does not support the binary protocol, using the text protocol.")
+            return False
+        self.ser.flush()
+        time.sleep(0.05)  # the firmware switches its baudrate after the ACK
+        old_baudrate = self._use_binary_protocol(baudrate)
+        if self.send_command("PING") != 1:
+            error = self.binary_protocol_failed(baudrate, old_baudrate)
+            self.close()
+            raise error
+        HARDWARE_LOGGER.info("Binary protocol at %s baud.", baudrate)
+        return True
+
+    def _use_binary_protocol(self, baudrate: int) -> int:
+        """Switches the port and the reader to binary frames, returns the old baudrate."""
+        old_baudrate = self.ser.baudrate
+        self.ser.baudrate = baudrate
+        self.reader.binary = True
+        self.binary_protocol = True
+        return old_baudrate
+
+    def binary_protocol_failed(self, baudrate: int, old_baudrate: int) -> OSError:
         """
-        Waits for a serial response from the Arduino.
-        Accepts only messages that start with "ACK:".
+        The firmware switched to binary frames but does not answer the PING. The text protocol
+        and the old baudrate are restored, but the firmware has no command to switch back, so
+        the connection has to be closed.
+        :return: the OSError to raise
         """
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if self.ser.in_waiting:
-                line = self.ser.readline().decode('utf-8').strip()
-                if line.startswith("ACK:"):
-                    ack_val = line.split("ACK:")[1]
-                    return ack_val
-            time.sleep(0.01)
-        print("Timeout beim Warten auf ACK.")
-        return 0
+        HARDWARE_LOGGER.error("Binary protocol at %s baud does not answer.", baudrate)
+        self.ser.baudrate = old_baudrate
+        self.reader.binary = False
+        self.binary_protocol = False
+        return OSError(f"The binary protocol at {baudrate} baud does not answer")
 
+    def abort(self):
+        """
+        Sends the ABORT byte, the firmware stops the running move within one motor step and
+        answers the interrupted command with ACK 0. It is sent out of band, without ACK.
+        """
+        if self.ser is not None:
+            try:
+                self.ser.write(serial_protocol.ABORT)
+            except (OSError, serial.SerialException) as e:
+                HARDWARE_LOGGER.error("ABORT could not be sent: %s", e)
+
+    def close(self):
+        """Stops the serial reader and closes the serial connection."""
+        if self.reader is not None:
+            self.reader.stop()
+        if self.ser is not None:
+            self.ser.close()
+
+    def wait_for_ack(self, ack: Future, timeout=assets.TIMEOUT):
+        """
+        Waits for the ACK of a command, it is set by the SerialReader as soon as it arrives.
+        A cancel of the cancel_token ends the wait immediately with 0.
+        Returns ACK_UNKNOWN_COMMAND if the firmware does not know the command.
+        """
+        handle = self.cancel_token.add_callback(ack.cancel)
+        try:
+            return ack.result(timeout)
+        except CancelledError:
+            HARDWARE_LOGGER.info("Waiting for the ACK was cancelled.")
+            return 0
+        except FutureTimeoutError:
+            ack.cancel()
+            return ack_timed_out()
+        finally:
+            self.cancel_token.remove_callback(handle)
 
     def send_command(self, command: str) -> int:
         """
         Sends a command to the Arduino and waits for confirmation.
         Returns 1 if the confirmation ("1") is received, otherwise 0.
+        The duration is recorded per command in metrics.SERIAL_COMMAND_SECONDS.
         """
-        try:
-            full_command = (command + "\n").encode('utf-8')
-            self.ser.write(full_command)
-            return int(self.wait_for_ack())
-        except serial.SerialTimeoutException:
-            print("Timeout error: Command could not be sent in time.")
+        with SERIAL_COMMAND_SECONDS.time(command.split(" ", 1)[0]):
+            return self._send_command(command)
+
+    def _send_command(self, command: str) -> int:
+        if self.cancel_token.cancelled:
             return 0
-        except serial.SerialException as e:
-            print(f"Serial error: {e}")
+        ack, data = self.prepare_command(command)
+        try:
+            self.ser.write(data)
+        except OSError as e:  # serial.SerialException and its write timeout are OSErrors
+            self.reader.discard(ack)  # the ACK of the next command must not go to it
+            HARDWARE_LOGGER.error("Serial error: Command could not be sent: %s", e)
             return 0
+        return int(self.wait_for_ack(ack))
+
+    def prepare_command(self, command: str):
+        """
+        Encodes the command for the protocol in use and registers the wait for its ACK.
+        :return: (Future of the ACK, bytes to write)
+        """
+        if self.binary_protocol:
+            self._seq = (self._seq + 1) & 0xFF
+            return (self.reader.expect_ack(self._seq),
+                    serial_protocol.encode_command(command, self._seq))
+        return self.reader.expect_ack(), (command + "\n").encode('utf-8')
 
     def toggle_io_band(self):
         """Toggles the IO band state."""
-        if platform.system() == "Linux":
+        if self.ser is not None:
             return self.send_command("TOGGLE")
         return False
 
@@ -110,20 +369,19 @@ class StepperMotorController:
             speed (int): The speed of the robot.
             steps (int): The amount of LEDs the robot should move.
         """
-        # Count the new position
+        if not self.count_position(direction, steps):
+            return -2
+        if not self.move_robot(direction, speed, self.app.config['STEPS_BETWEEN_LEDS'] * steps):
+            return move_failed(direction, speed, steps)
+        return self.current_position
+
+    def count_position(self, direction: assets.ROBOT_DIRECTIONS, steps: int) -> bool:
+        """Counts the new LED position, returns False if it is outside the LED strip."""
         if direction is assets.ROBOT_DIRECTIONS.LEFT:
             self.current_position -= steps
         elif direction is assets.ROBOT_DIRECTIONS.RIGHT:
             self.current_position += steps
-        # Check if the new position is inside band
-        if self.current_position < 1 or self.current_position > self.app.config['LED_AMOUNT']:
-            return -2
-        if not self.move_robot(direction, speed, self.app.config['STEPS_BETWEEN_LEDS'] * steps):
-            print(
-                f"Error: Robot failed to move while \"Move robot: direction: {direction} "
-                f"delay_in_ms: {speed} steps: {steps}\".")
-            return -1
-        return self.current_position
+        return 1 <= self.current_position <= self.app.config['LED_AMOUNT']
 
     def move_robot(self, direction: assets.ROBOT_DIRECTIONS, speed: int = 5,
                    steps: int = 1) -> bool:
@@ -138,14 +396,10 @@ class StepperMotorController:
         """
         if direction is assets.ROBOT_DIRECTIONS.HOLD:
             return True
-        delay_in_ms = SPEED_DELAY_MAP.get(speed, 10)
-        print(f"Move robot: direction: {direction} delay: {delay_in_ms} sm-steps: {steps}")
-        if platform.system() == "Linux":
-            drict = "LEFT" if direction is assets.ROBOT_DIRECTIONS.LEFT else "RIGHT"
-            command = f"MOVE {drict} {delay_in_ms} {steps}"
-            return self.send_command(command) != 0
-        time.sleep(delay_in_ms / 10)
-        return True
+        delay_in_ms = move_delay(direction, speed, steps)
+        if self.ser is not None:
+            return self.send_command(move_command(direction, delay_in_ms, steps)) != 0
+        return self.cancel_token.sleep(delay_in_ms / 10)
 
     def get_lb_state(self) -> bool:
         """
@@ -154,12 +408,12 @@ class StepperMotorController:
         Returns:
             bool: state The of the light barrier (True if blocked, False if not blocked).
         """
-        if platform.system() == "Linux":
+        if self.ser is not None:
             state = self.send_command("LIGHT") == 1
-            print(f"Light barrier: get_lb_state will return {state}.")
+            HARDWARE_LOGGER.debug("Light barrier: get_lb_state will return %s.", state)
             return state
         state = randrange(2) == 1
-        print(f"Light barrier: (Simulated) Returned {state}.")
+        HARDWARE_LOGGER.debug("Light barrier: (Simulated) Returned %s.", state)
         return state  # simulated value for non-Raspberry-Pi-Systems
 
     def get_color(self):
@@ -170,9 +424,137 @@ class StepperMotorController:
             IO_BAND_COLORS: The detected color as an Enum ('RED', 'BLUE', or 'BLANK'),
                             or None in case of an error.
         """
-        if platform.system() != "Linux":
+        if self.ser is None:
             random_color = assets.IO_BAND_COLORS(randrange(3))
             return random_color
         color = assets.IO_BAND_COLORS(int(self.send_command("COLOR")))
-        print(f"get color: {color}")
+        HARDWARE_LOGGER.debug("get color: %s", color)
         return color
+
+    def step_command(self, write_color: assets.IO_BAND_COLORS,
+                     direction: assets.ROBOT_DIRECTIONS, speed=1, steps=1):
+        """
+        Builds the fused STEP command, the robot holds if it would move out of the LED strip.
+        The firmware presses the button at most TOGGLE_IO_BAND_RETRYS times like the fallback.
+        :return: (new LED position, out of band, command)
+        """
+        new_position = self.current_position + DIRECTION_DELTA[direction] * steps
+        out_of_band = new_position < 1 or new_position > self.app.config['LED_AMOUNT']
+        move = assets.ROBOT_DIRECTIONS.HOLD if out_of_band else direction
+        sm_steps = 0 if move is assets.ROBOT_DIRECTIONS.HOLD else \
+            self.app.config['STEPS_BETWEEN_LEDS'] * steps
+        # the binary frame has a single byte for the retries
+        toggle_retries = max(0, min(self.app.config['TOGGLE_IO_BAND_RETRYS'], 0xFF))
+        command = (f"STEP {write_color.value} {move.name} {SPEED_DELAY_MAP.get(speed, 10)} "
+                   f"{sm_steps} {toggle_retries}")
+        return new_position, out_of_band, command
+
+    def step_result(self, ack: int, new_position: int, out_of_band: bool):
+        """
+        Evaluates the ACK of the STEP command like execute_step.
+        :return: (position, color), None if the firmware does not support STEP.
+        """
+        if ack == ACK_UNKNOWN_COMMAND:
+            HARDWARE_LOGGER.warning(
+                "Firmware does not support STEP, falling back to TOGGLE, COLOR and MOVE.")
+            self.fused_step_supported = False
+            return None
+        if ack <= 0:
+            return -3, None
+        if out_of_band:
+            return -2, None
+        self.current_position = new_position
+        return new_position, assets.IO_BAND_COLORS(ack - 1)
+
+    def may_toggle(self, toggle_retry: int) -> bool:
+        """Counts a button press to write a color, False if the retries are used up."""
+        if toggle_retry > self.app.config['TOGGLE_IO_BAND_RETRYS']:
+            return False
+        TOGGLE_RETRIES.inc()
+        return True
+
+    # pylint: disable=too-many-arguments,too-many-positional-arguments
+    def execute_step(self, write_color: assets.IO_BAND_COLORS,
+                     direction: assets.ROBOT_DIRECTIONS, speed=1, steps=1,
+                     current_color: assets.IO_BAND_COLORS | None = None):
+        """
+        Executes a turing step: writes the color under the robot, verifies it and moves the
+        robot by LED steps. Uses the fused STEP command of the firmware with a single ACK,
+        falls back to TOGGLE, COLOR and MOVE for firmware without STEP.
+        :return: (position, color)
+            position:   -3 if the color could not be written,
+                        -2 if the robot would move out of the LED strip (after writing),
+                        -1 if there was an error while moving the robot
+                        else current LED position.
+            color:      The color under the robot after the move, None if it was not read.
+
+        Args:
+            write_color (IO_BAND_COLORS): The color to write.
+            direction (Enum): The direction in which the robot should move.
+            speed (int): The speed of the robot.
+            steps (int): The amount of LEDs the robot should move.
+            current_color (IO_BAND_COLORS): The color under the robot if already known.
+        """
+        new_position, out_of_band, command = self.step_command(write_color, direction, speed,
+                                                               steps)
+        if self.ser is not None and self.fused_step_supported:
+            result = self.step_result(int(self.send_command(command)), new_position,
+                                      out_of_band)
+            if result is not None:
+                return result
+        # Fallback: single commands
+        toggle_retry = 0
+        color = current_color if current_color is not None else self.get_color()
+        while color != write_color:
+            toggle_retry += 1
+            if not self.may_toggle(toggle_retry):
+                return -3, None
+            self.toggle_io_band()
+            color = self.get_color()
+        if out_of_band:
+            return -2, None
+        return self.move_robot_led_step(direction, speed, steps), None
+
+
+class SimulatedStepperMotorController(StepperMotorController):
+    """
+    Deterministic software backend for the StepperMotorController.
+    Instead of talking to the Arduino it drives a robot along a VirtualBand,
+    the band input is taken from the SIMULATION_INPUT config.
+    """
+
+    def connect(self, serial_port, baudrate, timeout):
+        """Creates the virtual band instead of opening a serial connection."""
+        self.band = create_virtual_band(self.app.config)
+
+    def send_command(self, command: str) -> int:
+        """There is no Arduino in the simulation, every command is acknowledged."""
+        return 1
+
+    def toggle_io_band(self):
+        """Toggles the LED under the simulated robot."""
+        return self.band.toggle()
+
+    def move_robot(self, direction: assets.ROBOT_DIRECTIONS, speed: int = 5,
+                   steps: int = 1) -> bool:
+        """Moves the simulated robot by the specified amount of stepper motor steps."""
+        self.band.move(direction, steps)
+        return True
+
+    def get_lb_state(self) -> bool:
+        """Get the state of the simulated light barrier (True if blocked)."""
+        return self.band.light_barrier_blocked()
+
+    def get_color(self):
+        """Returns the color of the LED under the simulated robot."""
+        return self.band.color()
+
+
+def create_stepper_controller(app, cancel_token: CancellationToken | None = None
+                              ) -> StepperMotorController:
+    """Creates the StepperMotorController for the HARDWARE_BACKEND selected in the config."""
+    backend = assets.HARDWARE_BACKENDS(app.config['HARDWARE_BACKEND'])
+    if backend is assets.HARDWARE_BACKENDS.SIMULATION:
+        return SimulatedStepperMotorController(app, cancel_token=cancel_token)
+    return StepperMotorController(app, serial_port=app.config['SERIAL_PORT'],
+                                  cancel_token=cancel_token)
@@ -0,0 +1,43 @@
+"""
+This module contains the event journal of the machines.
+Events get monotonically increasing sequence numbers and are kept in a ring buffer, so clients
+can resume after a reconnect with the events after the last sequence number they have seen.
+"""
+from collections import deque
+from itertools import islice
+from threading import Lock
+
+
+class EventJournal:
+    """
+    Append-only ring buffer of events {"seq": int, "type": str, "data": ...}.
+    The sequence numbers start with 1 and are never reused, also not across machines.
+    """
+
+    def __init__(self, capacity: int):
+        self.events = deque(maxlen=capacity)
+        self.last_seq = 0
+        self.lock = Lock()
+
+    def append(self, event_type: str, data=None) -> dict:
+        """Adds an event and returns it."""
+        with self.lock:
+            self.last_seq += 1
+            event = {"seq": self.last_seq, "type": event_type, "data": data}
+            self.events.append(event)
+            return event
+
+    def since(self, seq: int):
+        """
+        Returns the events after seq.
+        :return: list of events, complete flag.
+                 complete is False if events after seq were already dropped from the ring buffer.
+        """
+        with self.lock:
+            if not self.events or seq >= self.last_seq:
+                return [], True
+            first_seq = self.events[0]["seq"]
+            complete = seq >= first_seq - 1
+            # the sequence numbers in the buffer are consecutive, take the newest from the end
+            newer = self.last_seq - max(seq, first_seq - 1)
+            return list(islice(reversed(self.events), newer))[::-1], complete
@@ -0,0 +1,88 @@
+"""
+This module contains the logging of the turing machine.
+Log records are put into a queue by the calling thread and formatted and written by a
+background thread, so the machine thread never waits for stdout. Loggers use %-style
+arguments, below the configured LOG_LEVEL a call returns before anything is formatted.
+The latest records are kept in a ring buffer for the settings page.
+"""
+import atexit
+import logging
+import queue
+import sys
+from collections import deque
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+
+import assets
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler which leaves the formatting to the listener thread.
+    The default prepare formats the message in the calling thread, here only a traceback is
+    rendered immediately because it is gone later. The arguments of a record must not be
+    changed after logging.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the latest formatted records, the oldest record is dropped when full."""
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+        self._records_lock = Lock()
+
+    def emit(self, record):
+        entry = {
+            "time": self.formatter.formatTime(record) if self.formatter else record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        with self._records_lock:
+            self.records.append(entry)
+
+    def latest(self) -> list[dict]:
+        """Returns the kept records, newest first."""
+        with self._records_lock:
+            return list(reversed(self.records))
+
+
+LOG_BUFFER = RingBufferHandler(assets.LOG_BUFFER_SIZE)
+_LISTENER: QueueListener | None = None
+
+
+def setup_logging(level: str = assets.LOG_LEVEL) -> QueueListener:
+    """
+    Routes all loggers through the queue to stdout and the ring buffer.
+    Further calls only change the level.
+    """
+    global _LISTENER  # pylint: disable=global-statement
+    set_level(level)
+    if _LISTENER is not None:
+        return _LISTENER
+    formatter = logging.Formatter(LOG_FORMAT)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(formatter)
+    LOG_BUFFER.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [DeferredQueueHandler(log_queue)]
+    _LISTENER = QueueListener(log_queue, stream_handler, LOG_BUFFER)
+    _LISTENER.start()
+    atexit.register(_LISTENER.stop)  # write the queued records before the exit
+    return _LISTENER
+
+
+def set_level(level: str):
+    """Sets the level of all loggers, e.g. "DEBUG" or "WARNING"."""
+    logging.getLogger().setLevel(assets.LOG_LEVELS(level).value)
@@ -0,0 +1,137 @@
+"""
+This module contains the macro step simulation of a turing machine.
+The tape is stored as run-length encoded blocks of equal colors. A state which keeps its
+state and moves on while reading a color (e.g. qRight0 and qLeft0 of palindrome.txt) sweeps
+over the whole block of that color in a single macro step, also over the infinite blank
+band. A run which needs billions of steps is then simulated in a few macro steps per block.
+
+The results are the ones of simulator.simulate.
+"""
+from itertools import groupby
+
+from simulator import BLANK, COLOR_CHARACTERS, build_table, encode_band_input
+from turingmachine_compiler import COLOR_AMOUNT, compile_turing_machine
+
+# the final tape is only decoded up to this amount of cells, the blocks are always returned
+MAX_TAPE_CELLS = 1_000_000
+
+
+def _push(stack: list, symbol: int, count: int):
+    """
+    Puts count cells of the symbol on the stack, blocks of the same symbol are merged.
+    The infinite blank band is not stored, so an empty stack ends with blanks.
+    """
+    if stack and stack[-1][0] == symbol:
+        stack[-1][1] += count
+    elif stack or symbol != BLANK:
+        stack.append([symbol, count])
+
+
+def _pop(stack: list, count: int):
+    """Removes count cells of the top block, the blanks of the empty stack are infinite."""
+    if stack:
+        stack[-1][1] -= count
+        if stack[-1][1] <= 0:
+            stack.pop()
+
+
+def _top(stack: list) -> int:
+    return stack[-1][0] if stack else BLANK
+
+
+def _blocks(left: list, right: list) -> list[list]:
+    """The blocks of the tape from left to right without the blanks at both ends."""
+    blocks = []
+    for symbol, count in left + right[::-1]:
+        _push(blocks, symbol, count)  # merges the blocks left and right of the head
+    while blocks and blocks[-1][0] == BLANK:
+        blocks.pop()
+    return blocks
+
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+def simulate_macro(tm_code, band_input: str = "", max_steps: int = 1_000_000):
+    """
+    Runs the parsed turing machine like simulator.simulate, but sweeps over blocks of equal
+    colors in a single macro step.
+    :return: dict like simulator.simulate, with
+        "macro_steps": amount of executed macro steps,
+        "blocks": the tape as [character, count] blocks,
+        "tape": None if the tape has more than MAX_TAPE_CELLS cells.
+    """
+    compiled = tm_code.get('compiled') or compile_turing_machine(tm_code)
+    table = build_table(compiled)
+    left = []  # blocks left of the head, the last block is next to the head
+    # blocks from the head to the right, the head is on the first cell of the last block
+    right = [[symbol, len(list(cells))] for symbol, cells
+             in groupby(encode_band_input(band_input))][::-1]
+    if right and right[0][0] == BLANK:
+        right.pop(0)  # trailing blanks belong to the infinite blank band
+    head = 0
+    state = compiled.init
+    steps = 0
+    macro_steps = 0
+    while steps < max_steps:
+        symbol = _top(right)
+        transition = table[state * COLOR_AMOUNT + symbol]
+        if transition is None:
+            break
+        new_state, write_symbol, delta = transition
+        macro_steps += 1
+        if new_state != state or not delta:
+            if new_state == state and write_symbol == symbol:
+                steps = max_steps  # writes the same color and holds forever
+                break
+            # single step
+            _pop(right, 1)
+            if delta > 0:
+                _push(left, write_symbol, 1)
+            else:
+                _push(right, write_symbol, 1)
+                if delta < 0:
+                    cell = _top(left)
+                    _pop(left, 1)
+                    _push(right, cell, 1)
+            state = new_state
+            head += delta
+            steps += 1
+            continue
+        # sweep over the block of the color in the direction of the move
+        remaining = max_steps - steps
+        if delta > 0:
+            count = min(right[-1][1], remaining) if right else remaining
+            _pop(right, count)
+            _push(left, write_symbol, count)
+        else:
+            if left and left[-1][0] == symbol:
+                count = min(1 + left[-1][1], remaining)
+            elif not left and symbol == BLANK:
+                count = remaining
+            else:
+                count = 1
+            _pop(right, 1)
+            _pop(left, count - 1)
+            _push(right, write_symbol, count)
+            cell = _top(left)
+            _pop(left, 1)
+            _push(right, cell, 1)
+        head += delta * count
+        steps += count
+    if compiled.accepting[state]:
+        result = "accept"
+    elif steps >= max_steps:
+        result = "max_steps"
+    else:
+        result = "reject"
+    blocks = _blocks(left, right)
+    cells = sum(count for _, count in blocks)
+    return {
+        "result": result,
+        "steps": steps,
+        "state": compiled.state_names[state],
+        "head": head,
+        "tape": ("".join(COLOR_CHARACTERS[symbol] * count for symbol, count in blocks)
+                 if cells <= MAX_TAPE_CELLS else None),
+        "blocks": [[COLOR_CHARACTERS[symbol], count] for symbol, count in blocks],
+        "macro_steps": macro_steps
+    }
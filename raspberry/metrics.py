@@ -0,0 +1,122 @@
+"""
+This module contains the runtime metrics of the turing machine.
+Histograms collect the durations of the step phases, the homing and the serial commands,
+counters collect steps, toggle retries and ACK timeouts. The Flask app exposes them in the
+Prometheus text format on /metrics.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+
+# upper bounds in seconds, the serial commands take from a few ms (LIGHT) to seconds (MOVE)
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0, 30.0)
+
+PREFIX = "turingmaschine_"
+
+
+def _format_value(value: float) -> str:
+    return "+Inf" if value == float("inf") else repr(value)
+
+
+class Histogram:
+    """
+    Histogram with one label, e.g. the phase of a step.
+    observe is cheap (one bisect under a lock), the cumulative counts are built when rendering.
+    """
+
+    def __init__(self, name: str, documentation: str, label: str,
+                 buckets: tuple = DEFAULT_BUCKETS):
+        self.name = PREFIX + name
+        self.documentation = documentation
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [counts per bucket (+ overflow), sum]
+        self._lock = Lock()
+
+    def observe(self, label_value: str, seconds: float):
+        """Adds a duration in seconds."""
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, seconds)] += 1
+            series[1] += seconds
+
+    @contextmanager
+    def time(self, label_value: str):
+        """Observes the duration of the with block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(label_value, time.perf_counter() - start)
+
+    def render(self) -> list[str]:
+        """Lines in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total)
+                      in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            labels = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{_format_value(bound)}"}} '
+                             f'{cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {_format_value(total)}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter without labels."""
+
+    def __init__(self, name: str, documentation: str):
+        self.name = PREFIX + name + "_total"
+        self.documentation = documentation
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount: int = 1):
+        """Increases the counter."""
+        with self._lock:
+            self.value += amount
+
+    def render(self) -> list[str]:
+        """Lines in the Prometheus text format."""
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter",
+                f"{self.name} {self.value}"]
+
+
+STEP_PHASE_SECONDS = Histogram(
+    "step_phase_seconds",
+    "Duration of the phases of a turing step (step, read_color, move, write_move, lock_notify).",
+    "phase")
+HOME_SECONDS = Histogram(
+    "home_seconds",
+    "Duration of the homing phases (fast_approach, back_off, slow_approach, first_led).",
+    "phase")
+SERIAL_COMMAND_SECONDS = Histogram(
+    "serial_command_seconds", "Duration of a serial command until its ACK.", "command")
+BROADCAST_SECONDS = Histogram(
+    "broadcast_seconds", "Duration of the websocket emits to the clients.", "event")
+STEPS = Counter("steps", "Executed turing steps.")
+TOGGLE_RETRIES = Counter("toggle_retries", "Button presses to write a color.")
+ACK_TIMEOUTS = Counter("ack_timeouts", "Serial commands without ACK within the timeout.")
+
+REGISTRY = (STEP_PHASE_SECONDS, HOME_SECONDS, SERIAL_COMMAND_SECONDS, BROADCAST_SECONDS,
+            STEPS, TOGGLE_RETRIES, ACK_TIMEOUTS)
+
+# content type of the Prometheus text format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text format."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,108 @@
+"""
+This module contains the planner for a run of the robot.
+The program is simulated on the read IO band before the robot executes it, so runs which
+would reject, leave the LED strip or not halt are rejected before the robot starts working.
+"""
+from array import array
+
+from cycle_detector import CycleDetector
+from turingmachine_compiler import COLOR_AMOUNT, CompiledMachine
+
+# outcomes of a planned run
+ACCEPT = "accept"
+REJECT = "reject"
+OUT_OF_BAND = "out_of_band"
+STEP_BUDGET_EXHAUSTED = "step_budget_exhausted"
+CYCLE = "cycle"
+
+OUTCOME_TEXTS = {
+    ACCEPT: "Accept State",
+    REJECT: "Reject State",
+    OUT_OF_BAND: "verlässt das Band",
+    STEP_BUDGET_EXHAUSTED: "Schrittbudget erschöpft",
+    CYCLE: "Endlosschleife"
+}
+
+
+class RunPlan:
+    """
+    Motion plan of a run.
+    states[i] and positions[i] are the state ID and the LED position before step i,
+    the last entry is the configuration after the last step.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self.outcome = STEP_BUDGET_EXHAUSTED
+        self.states = array('I')
+        self.positions = array('i')
+        self.band = None  # colors after the run, index = LED position
+
+    @property
+    def steps(self) -> int:
+        """Amount of planned steps."""
+        return len(self.states) - 1
+
+    @property
+    def min_position(self) -> int:
+        """Leftmost LED position of the head."""
+        return min(self.positions)
+
+    @property
+    def max_position(self) -> int:
+        """Rightmost LED position of the head."""
+        return max(self.positions)
+
+    def matches(self, step: int, state: int, position: int) -> bool:
+        """Checks if the configuration after the given amount of steps is the planned one."""
+        return (step <= self.steps and self.states[step] == state
+                and self.positions[step] == position)
+
+    def __str__(self):
+        return (f"{OUTCOME_TEXTS[self.outcome]} nach {self.steps} Schritten, "
+                f"Kopf zwischen LED {self.min_position} und {self.max_position}")
+
+
+def plan_run(program: CompiledMachine, band, position: int, step_budget: int) -> RunPlan:
+    """
+    Simulates the program on the LED strip.
+    :param program: the compiled program, the run starts in program.init
+    :param band: known colors (IO_BAND_COLORS), index = LED position, index 0 is unused
+    :param position: LED position of the head
+    :param step_budget: maximum amount of simulated steps
+    :return: the RunPlan
+    """
+    cells = bytearray(color.value for color in band[1:])
+    cycle_detector = CycleDetector(cells)
+    table = program.table
+    accepting = program.accepting
+    plan = RunPlan()
+    state = program.init
+    plan.states.append(state)
+    plan.positions.append(position)
+    cycle_detector.observe(state, position)
+    while plan.steps < step_budget:
+        if accepting[state]:
+            plan.outcome = ACCEPT
+            break
+        transition = table[state * COLOR_AMOUNT + cells[position - 1]]
+        if transition is None:
+            plan.outcome = REJECT
+            break
+        cells[position - 1] = transition.write_symbol
+        cycle_detector.write(position - 1, transition.write_symbol)
+        if not 0 < position + transition.delta <= len(cells):
+            plan.outcome = OUT_OF_BAND
+            break
+        state = transition.new_state
+        position += transition.delta
+        plan.states.append(state)
+        plan.positions.append(position)
+        if cycle_detector.observe(state, position):
+            plan.outcome = CYCLE
+            break
+    else:
+        if accepting[state]:
+            plan.outcome = ACCEPT
+    plan.band = [None] + list(cells)
+    return plan
@@ -0,0 +1,192 @@
+"""
+This module contains the compiled program artifacts.
+A validated program is stored as compact binary file next to its source, so it can be loaded
+without parsing and semantic analysis. The artifact holds the SHA-256 of the source and is
+only used while the source is unchanged.
+
+Format (little endian), version 1:
+    header:   magic "TMZC", version u8, source sha256 (32 bytes), state amount u32, init u32
+    strings:  language, program name, state names, warning amount u16 + warnings,
+              each as length u16 + UTF-8
+    accept:   one byte per state, 1 = accept state
+    table:    state amount * COLOR_AMOUNT entries: new_state + 1 u32 (0 = no transition),
+              write color u8, ROBOT_DIRECTIONS value u8
+"""
+import hashlib
+import logging
+import os
+import struct
+from collections import defaultdict
+
+import assets
+from turingmachine_compiler import COLOR_AMOUNT, CompiledMachine, CompiledTransition
+
+MAGIC = b"TMZC"
+VERSION = 1
+HEADER = struct.Struct("<4sB32sII")
+LENGTH = struct.Struct("<H")
+ENTRY = struct.Struct("<IBB")
+
+# artifacts are stored in this subfolder of the upload folder
+COMPILED_FOLDER = ".compiled"
+
+ARTIFACT_LOGGER = logging.getLogger("artifact")
+
+# enum members by value, faster than the enum lookup while loading
+COLORS_BY_VALUE = {color.value: color for color in assets.IO_BAND_COLORS}
+DIRECTIONS_BY_VALUE = {direction.value: direction for direction in assets.ROBOT_DIRECTIONS}
+
+
+def source_hash(file_path) -> bytes:
+    """SHA-256 of the source file."""
+    with open(file_path, 'rb') as file:
+        return hashlib.sha256(file.read()).digest()
+
+
+def artifact_path(file_path, language: assets.PROGRAM_LANGUAGES) -> str:
+    """Path of the artifact of the source file for the language."""
+    folder, filename = os.path.split(file_path)
+    return os.path.join(folder, COMPILED_FOLDER, f"{filename}.{language.value}.tmc")
+
+
+def _pack_string(value: str) -> bytes:
+    data = value.encode('utf-8')
+    return LENGTH.pack(len(data)) + data
+
+
+def encode_artifact(turing_machine, language: assets.PROGRAM_LANGUAGES,
+                    digest: bytes) -> bytes:
+    """Packs a validated turing_machine (without errors) into an artifact."""
+    compiled = turing_machine["compiled"]
+    state_amount = len(compiled.state_names)
+    parts = [HEADER.pack(MAGIC, VERSION, digest, state_amount, compiled.init),
+             _pack_string(language.value), _pack_string(turing_machine["name"])]
+    parts.extend(_pack_string(name) for name in compiled.state_names)
+    parts.append(LENGTH.pack(len(turing_machine["warnings"])))
+    parts.extend(_pack_string(warning) for warning in turing_machine["warnings"])
+    parts.append(bytes(compiled.accepting))
+    for transition in compiled.table:
+        if transition is None:
+            parts.append(ENTRY.pack(0, 0, 0))
+        else:
+            parts.append(ENTRY.pack(transition.new_state + 1, transition.write_symbol,
+                                    transition.move.value))
+    return b"".join(parts)
+
+
+class _Reader:
+    """Reads the fields of an artifact, raises ValueError if the data ends early."""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.offset = 0
+
+    def take(self, size: int) -> memoryview:
+        """Returns the next size bytes."""
+        if self.offset + size > len(self.data):
+            raise ValueError("Artefakt ist unvollständig.")
+        chunk = self.data[self.offset:self.offset + size]
+        self.offset += size
+        return chunk
+
+    def unpack(self, fmt: struct.Struct):
+        """Returns the next struct."""
+        return fmt.unpack(self.take(fmt.size))
+
+    def string(self) -> str:
+        """Returns the next string."""
+        (length,) = self.unpack(LENGTH)
+        return str(self.take(length), 'utf-8')
+
+
+# pylint: disable=too-many-locals
+def decode_artifact(data: bytes, language: assets.PROGRAM_LANGUAGES, digest: bytes):
+    """
+    Unpacks an artifact into a turing_machine dict like parse_turing_machine returns it.
+    Raises ValueError if the artifact is invalid, has another version or belongs to another
+    source or language.
+    """
+    reader = _Reader(data)
+    magic, version, artifact_digest, state_amount, init = reader.unpack(HEADER)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("Unbekanntes Artefaktformat.")
+    if artifact_digest != digest or reader.string() != language.value:
+        raise ValueError("Artefakt gehört zu einer anderen Quelle.")
+    name = reader.string()
+    compiled = CompiledMachine()
+    for _ in range(state_amount):
+        compiled.state_id(reader.string())
+    if len(compiled.state_names) != state_amount or not 0 <= init < state_amount:
+        raise ValueError("Ungültige Zustände im Artefakt.")
+    compiled.init = init
+    (warning_amount,) = reader.unpack(LENGTH)
+    warnings = [reader.string() for _ in range(warning_amount)]
+    compiled.accepting[:] = reader.take(state_amount)
+    state_transitions = defaultdict(dict)
+    entries = ENTRY.iter_unpack(reader.take(state_amount * COLOR_AMOUNT * ENTRY.size))
+    for index, (new_state, write_symbol, move) in enumerate(entries):
+        if new_state == 0:
+            continue
+        new_state -= 1
+        if (new_state >= state_amount or write_symbol not in COLORS_BY_VALUE
+                or move not in DIRECTIONS_BY_VALUE):
+            raise ValueError("Ungültige Transition im Artefakt.")
+        state = index // COLOR_AMOUNT
+        transition = CompiledTransition(new_state, write_symbol, DIRECTIONS_BY_VALUE[move])
+        compiled.table[index] = transition
+        compiled.defined[state] = 1
+        compiled.targeted[new_state] = 1
+        state_transitions[(compiled.state_names[state], COLORS_BY_VALUE[index % COLOR_AMOUNT])] = {
+            "new_state": compiled.state_names[new_state],
+            "write_symbol": COLORS_BY_VALUE[write_symbol],
+            "move": transition.move
+        }
+    return {
+        "name": name,
+        "init": compiled.state_names[init],
+        "accept": {compiled.state_names[state] for state in range(state_amount)
+                   if compiled.accepting[state]},
+        "state_transitions": state_transitions,
+        "compiled": compiled,
+        "errors": [],
+        "warnings": warnings
+    }
+
+
+def write_artifact(file_path, turing_machine, language: assets.PROGRAM_LANGUAGES,
+                   digest: bytes | None = None):
+    """Stores the artifact of a validated program, programs with errors are not stored."""
+    if turing_machine["errors"]:
+        return
+    if digest is None:
+        digest = source_hash(file_path)
+    path = artifact_path(file_path, language)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'wb') as file:
+            file.write(encode_artifact(turing_machine, language, digest))
+        os.replace(path + ".tmp", path)  # never leave a half written artifact
+    except OSError as e:
+        ARTIFACT_LOGGER.warning("Artifact %s could not be written: %s", path, e)
+
+
+def load_artifact(file_path, language: assets.PROGRAM_LANGUAGES):
+    """Returns the turing_machine of a valid artifact for the unchanged source or None."""
+    path = artifact_path(file_path, language)
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as file:
+            return decode_artifact(file.read(), language, source_hash(file_path))
+    except (OSError, ValueError, UnicodeDecodeError, struct.error) as e:
+        ARTIFACT_LOGGER.info("Artifact %s ignored: %s", path, e)
+        return None
+
+
+def remove_artifacts(file_path):
+    """Removes the artifacts of the source file for all languages."""
+    for language in assets.PROGRAM_LANGUAGES:
+        path = artifact_path(file_path, language)
+        if os.path.exists(path):
+            os.remove(path)
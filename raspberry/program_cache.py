@@ -0,0 +1,62 @@
+"""
+This module contains the process wide cache of parsed and validated turing machine programs.
+Programs are identified by path, modification time, size and language, so a changed file is
+parsed again. The least recently used programs are evicted when the cache is full.
+"""
+import os
+from collections import OrderedDict
+from threading import Lock
+
+import assets
+from assets import PROGRAM_LANGUAGES
+import turingmachine_interpreter as tm_interp
+
+
+class ProgramCache:
+    """
+    LRU cache for the results of load_turing_machine.
+    The cached turing_machine dicts are shared, they must not be modified.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.programs = OrderedDict()
+        self.lock = Lock()
+
+    @staticmethod
+    def _key(file_path, language: PROGRAM_LANGUAGES):
+        stat = os.stat(file_path)
+        return os.path.realpath(file_path), stat.st_mtime_ns, stat.st_size, language
+
+    def get(self, file_path, language: PROGRAM_LANGUAGES = PROGRAM_LANGUAGES.COM):
+        """Returns the parsed program, the file is only parsed if it is not cached."""
+        key = self._key(file_path, language)
+        with self.lock:
+            turing_machine = self.programs.get(key)
+            if turing_machine is not None:
+                self.programs.move_to_end(key)
+                return turing_machine
+        turing_machine = tm_interp.load_turing_machine(file_path, language)
+        self._store(key, turing_machine)
+        return turing_machine
+
+    def put(self, file_path, language: PROGRAM_LANGUAGES, turing_machine):
+        """Adds a program which was parsed elsewhere, e.g. from the upload stream."""
+        self._store(self._key(file_path, language), turing_machine)
+
+    def _store(self, key, turing_machine):
+        with self.lock:
+            self.programs[key] = turing_machine
+            self.programs.move_to_end(key)
+            while len(self.programs) > self.capacity:
+                self.programs.popitem(last=False)
+
+    def invalidate(self, file_path):
+        """Removes all cached versions of the file, e.g. after an upload or delete."""
+        path = os.path.realpath(file_path)
+        with self.lock:
+            for key in [key for key in self.programs if key[0] == path]:
+                del self.programs[key]
+
+
+PROGRAM_CACHE = ProgramCache(assets.PROGRAM_CACHE_SIZE)
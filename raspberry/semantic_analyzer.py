@@ -3,9 +3,10 @@ The file contains Generally used things.
 """
 
 import assets
+from turingmachine_compiler import COLOR_AMOUNT, compile_turing_machine
 
 
-# pylint: disable=too-many-branches
+# pylint: disable=too-many-branches, too-many-locals
 def semantic_analyzer(turing_machine):
     """
     Analyzes the turing_machine Programm for semantic errors.
@@ -15,65 +16,76 @@ def semantic_analyzer(turing_machine):
                                 "init": "",
                                 "accept": set(),
                                 "state_transitions": defaultdict(dict),
+                                "compiled": CompiledMachine,
                                 "errors": [],
                                 "warnings": []
                             }
     :return: the turing_machine programm with errors and warnings
     """
-    transitions = turing_machine["state_transitions"]
-    states = {key[0] for key in transitions.keys()}  # all defined states (match[0])
-    new_states = {t["new_state"] for t in transitions.values()}  # all follow-states (match[2])
+    compiled = turing_machine.get("compiled") or compile_turing_machine(turing_machine)
+    names = compiled.state_names
+    table = compiled.table
+    colors = list(assets.IO_BAND_COLORS)
+    missing_transitions = []  # 1.
+    accept_not_targeted = []  # 2.
+    undefined_next_states = []  # 3.
+    unused_states = []  # 4.
+    accept_with_transitions = []  # 5.
+
+    # All checks in one pass over the states, the compiled flags are the per-state indexes
+    for state, name in enumerate(names):
+        if compiled.defined[state]:
+            row = table[state * COLOR_AMOUNT:(state + 1) * COLOR_AMOUNT]
+            for color, transition in zip(colors, row):
+                if transition is None:
+                    missing_transitions.append((name, color))
+                elif (not compiled.defined[transition.new_state]
+                      and not compiled.accepting[transition.new_state]):
+                    undefined_next_states.append(names[transition.new_state])
+            if not compiled.targeted[state] and state != compiled.init:
+                unused_states.append(name)
+        if compiled.accepting[state]:
+            if not compiled.targeted[state]:
+                accept_not_targeted.append(name)
+            if compiled.defined[state]:
+                accept_with_transitions.append(name)
 
     # 1. Check if every combination of state and symbol exists
-    for state in states:
-        for symbol in assets.IO_BAND_COLORS:
-            if (state, symbol) not in transitions:
-                turing_machine["errors"].append(
-                    f"Fehlende Transition für Zustand '{state}' mit Symbol '{symbol}'.")
+    for name, symbol in missing_transitions:
+        turing_machine["errors"].append(
+            f"Fehlende Transition für Zustand '{name}' mit Symbol '{symbol}'.")
 
     # 2. Initial and accepting states must be defined
-    if turing_machine["init"] not in states:
+    if not compiled.defined[compiled.init]:
         turing_machine["errors"].append(
             f"Initialzustand '{turing_machine['init']}' fehlt in den definierten Zuständen.")
 
-    for accept_state in turing_machine["accept"]:
-        if accept_state not in new_states:
-            turing_machine["errors"].append(
-                f"Akzeptier-Zustand '{accept_state}' ist nicht als Folgezustand definiert.")
+    for accept_state in accept_not_targeted:
+        turing_machine["errors"].append(
+            f"Akzeptier-Zustand '{accept_state}' ist nicht als Folgezustand definiert.")
 
     # 3. All next states must be defined (except if they are accepting states)
-    for transition in transitions.values():
-        next_state = transition["new_state"]
-        if next_state not in states and next_state not in turing_machine["accept"]:
-            turing_machine["warnings"].append(
-                f"Folgezustand '{next_state}' ist weder definiert noch ein akzeptierender Zustand "
-                f"und wird deshalb als nicht akzeptierender Zustand interpretiert.")
+    for next_state in undefined_next_states:
+        turing_machine["warnings"].append(
+            f"Folgezustand '{next_state}' ist weder definiert noch ein akzeptierender "
+            f"Zustand und wird deshalb als nicht akzeptierender Zustand interpretiert.")
 
     # 4. No isolated states
-    used_states = set(states)
-    unique_next_states = set(new_states)
-    for unique_next_state in unique_next_states:
-        used_states.discard(unique_next_state)
-    if turing_machine["init"] in used_states:
-        used_states.discard(turing_machine["init"])
-    if used_states:
+    if unused_states:
         turing_machine["warnings"].append(
-            f"Ungenutzte Zustände gefunden: {', '.join(used_states)}.")
+            f"Ungenutzte Zustände gefunden: {', '.join(unused_states)}.")
 
     # 5. Check if accepting states have no outgoing transitions
-    for accept_state in turing_machine["accept"]:
-        if any(key[0] == accept_state for key in transitions.keys()):
-            turing_machine["errors"].append(
-                f"Akzeptier-Zustand '{accept_state}' hat ausgehende Transitionen.")
+    for accept_state in accept_with_transitions:
+        turing_machine["errors"].append(
+            f"Akzeptier-Zustand '{accept_state}' hat ausgehende Transitionen.")
 
-    for transition in transitions.keys():
-        if transition[1] not in assets.IO_BAND_COLORS:
-            turing_machine["errors"].append(
-                f"Zeichen '{transition[1]}' ist nicht erlaubt")
-    for transition in transitions.values():
-        if transition["write_symbol"] not in assets.IO_BAND_COLORS:
-            turing_machine["errors"].append(
-                f"Zeichen '{transition['write_symbol']}' ist nicht erlaubt. "
-                f"Bitte verwende nur '0', '1', '_', ' '.")
+    for symbol in compiled.invalid_symbols:
+        turing_machine["errors"].append(
+            f"Zeichen '{symbol}' ist nicht erlaubt")
+    for symbol in compiled.invalid_write_symbols:
+        turing_machine["errors"].append(
+            f"Zeichen '{symbol}' ist nicht erlaubt. "
+            f"Bitte verwende nur '0', '1', '_', ' '.")
 
     return turing_machine
@@ -0,0 +1,151 @@
+"""
+This module contains the binary framing of the serial protocol to the Arduino.
+A frame is: SYNC, opcode, sequence number, payload length, payload, CRC-8.
+The CRC-8 (polynomial 0x07) covers opcode, sequence number, length and payload.
+Commands keep their text form in the StepperMotorController, they are packed here.
+"""
+import struct
+
+import assets
+
+FRAME_SYNC = 0xA5
+MAX_PAYLOAD = 16
+
+# opcodes of the commands, the firmware answers with OP_ACK and the same sequence number
+OPCODES = {
+    "PING": 0x00,
+    "TOGGLE": 0x01,
+    "SETUP": 0x02,
+    "CLEANUP": 0x03,
+    "MOVE": 0x04,
+    "LIGHT": 0x05,
+    "COLOR": 0x06,
+    "STEP": 0x07
+}
+OP_ACK = 0x80
+
+# text command to switch the firmware to binary frames: PROTO BIN <baudrate>
+NEGOTIATE_COMMAND = "PROTO BIN {baudrate}"
+
+# single out of band byte (ASCII CAN) which aborts the running command in both protocols,
+# the firmware checks for it between motor steps and ignores it while idle
+ABORT = b"\x18"
+
+
+def _crc8_table():
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data: bytes, crc: int = 0) -> int:
+    """CRC-8 with polynomial 0x07."""
+    for byte in data:
+        crc = CRC8_TABLE[crc ^ byte]
+    return crc
+
+
+def encode_frame(opcode: int, seq: int, payload: bytes = b"") -> bytes:
+    """Packs a frame, seq is reduced to one byte."""
+    body = bytes((opcode, seq & 0xFF, len(payload))) + payload
+    return bytes((FRAME_SYNC,)) + body + bytes((crc8(body),))
+
+
+def encode_command(command: str, seq: int) -> bytes:
+    """
+    Packs a text command like "MOVE LEFT 30 13" into a frame.
+    Directions are sent as ROBOT_DIRECTIONS values, delays as one byte, steps as two bytes.
+    Raises ValueError for unknown commands.
+    """
+    name, *args = command.split()
+    if name not in OPCODES:
+        raise ValueError(f"Unknown command {name}")
+    if name == "MOVE":
+        payload = struct.pack("<BBH", assets.ROBOT_DIRECTIONS[args[0]].value,
+                              int(args[1]), int(args[2]))
+    elif name == "STEP":
+        payload = struct.pack("<BBBHB", int(args[0]), assets.ROBOT_DIRECTIONS[args[1]].value,
+                              int(args[2]), int(args[3]), int(args[4]))
+    else:
+        payload = b""
+    return encode_frame(OPCODES[name], seq, payload)
+
+
+def decode_command(opcode: int, payload: bytes) -> str:
+    """Converts a command frame back into the text command, used by the fake Arduino."""
+    names = {value: name for name, value in OPCODES.items()}
+    name = names.get(opcode)
+    if name is None:
+        raise ValueError(f"Unknown opcode {opcode}")
+    if name == "MOVE":
+        direction, delay, steps = struct.unpack("<BBH", payload)
+        return f"MOVE {assets.ROBOT_DIRECTIONS(direction).name} {delay} {steps}"
+    if name == "STEP":
+        color, direction, delay, steps, toggle_retries = struct.unpack("<BBBHB", payload)
+        return (f"STEP {color} {assets.ROBOT_DIRECTIONS(direction).name} {delay} {steps} "
+                f"{toggle_retries}")
+    return name
+
+
+def encode_ack(seq: int, value: int) -> bytes:
+    """Packs an ACK frame with a signed 16 bit value."""
+    return encode_frame(OP_ACK, seq, struct.pack("<h", value))
+
+
+def decode_ack(payload: bytes) -> int:
+    """Returns the value of an ACK frame."""
+    return struct.unpack("<h", payload)[0]
+
+
+class FrameParser:
+    """
+    Incremental parser for a byte stream with frames.
+    Bytes outside of frames (e.g. text of the firmware) are collected as text lines.
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes):
+        """
+        Adds received bytes.
+        :return: list of (opcode, seq, payload) for every complete and valid frame,
+                 list of text lines found between frames.
+        """
+        self._buffer += data
+        frames = []
+        text = bytearray()
+        while self._buffer:
+            sync = self._buffer.find(FRAME_SYNC)
+            if sync == -1:
+                text += self._buffer
+                self._buffer.clear()
+                break
+            text += self._buffer[:sync]
+            del self._buffer[:sync]
+            if len(self._buffer) < 4:
+                break  # header incomplete
+            length = self._buffer[3]
+            if length > MAX_PAYLOAD:
+                del self._buffer[:1]  # no frame, search for the next sync byte
+                continue
+            end = 4 + length + 1
+            if len(self._buffer) < end:
+                break  # frame incomplete
+            body = bytes(self._buffer[1:end - 1])
+            if crc8(body) != self._buffer[end - 1]:
+                del self._buffer[:1]
+                continue
+            frames.append((body[0], body[1], body[3:]))
+            del self._buffer[:end]
+        lines = [line.decode('utf-8', errors='replace').strip()
+                 for line in bytes(text).splitlines()]
+        return frames, [line for line in lines if line]
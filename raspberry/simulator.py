@@ -0,0 +1,167 @@
+"""
+This module contains the software simulation of the turing machine.
+It provides a virtual IO band for the simulated robot and a fast interpreter to run
+parsed turing machine programs without the Raspberry Pi, the Arduino or the motors.
+"""
+import time
+
+import assets
+from turingmachine_compiler import COLOR_AMOUNT, DIRECTION_DELTA, compile_turing_machine
+
+BLANK = assets.IO_BAND_COLORS.BLANK.value
+
+# characters used for band inputs, e.g. "10_1"
+SYMBOL_CHARACTERS = {
+    '0': assets.IO_BAND_COLORS.RED.value,
+    '1': assets.IO_BAND_COLORS.BLUE.value,
+    '_': BLANK,
+    ' ': BLANK
+}
+COLOR_CHARACTERS = {value: char for char, value in SYMBOL_CHARACTERS.items() if char != ' '}
+# steps between two checks of the time limit of simulate
+TIME_CHECK_STEPS = 10_000
+
+
+def encode_band_input(band_input: str) -> bytearray:
+    """
+    Converts a band input like "10_1" into color values.
+    Raises ValueError for unknown characters.
+    """
+    try:
+        return bytearray(SYMBOL_CHARACTERS[char] for char in band_input)
+    except KeyError as e:
+        raise ValueError(f"Ungültiges Zeichen {e} in der Bandeingabe.") from e
+
+
+def decode_band(cells) -> str:
+    """Converts color values back into a band string, leading/trailing blanks are removed."""
+    return "".join(COLOR_CHARACTERS[cell] for cell in cells).strip('_')
+
+
+class VirtualBand:
+    """
+    Virtual IO band with a robot driving along it.
+    The robot position is tracked in stepper motor steps, 0 is the home position of the
+    light barrier. The LED under the robot is the nearest LED to the motor position.
+    """
+
+    def __init__(self, led_amount: int, steps_between_leds: int,
+                 steps_between_home_to_first_led: int, band_input: str = ""):
+        self.led_amount = led_amount
+        self.steps_between_leds = steps_between_leds
+        self.steps_between_home_to_first_led = steps_between_home_to_first_led
+        self.cells = bytearray([BLANK]) * led_amount
+        # place the input in the middle of the band
+        cells = encode_band_input(band_input)
+        start = max(0, (led_amount - len(cells)) // 2)
+        self.cells[start:start + len(cells)] = cells[:led_amount - start]
+        # the robot starts somewhere in the middle of the band
+        self.motor_position = (steps_between_home_to_first_led
+                               + (led_amount // 2) * steps_between_leds)
+
+    def led_under_head(self) -> int | None:
+        """Returns the index (starting with 1) of the LED under the robot or None."""
+        led = round((self.motor_position - self.steps_between_home_to_first_led)
+                    / self.steps_between_leds) + 1
+        if 1 <= led <= self.led_amount:
+            return led
+        return None
+
+    def move(self, direction: assets.ROBOT_DIRECTIONS, steps: int):
+        """Moves the robot by the given amount of stepper motor steps."""
+        self.motor_position += DIRECTION_DELTA[direction] * steps
+
+    def toggle(self) -> bool:
+        """Presses the button of the LED under the robot. The color cycles RED, BLUE, BLANK."""
+        led = self.led_under_head()
+        if led is None:
+            return False
+        self.cells[led - 1] = (self.cells[led - 1] + 1) % len(assets.IO_BAND_COLORS)
+        return True
+
+    def color(self) -> assets.IO_BAND_COLORS:
+        """Returns the color of the LED under the robot, BLANK if there is no LED."""
+        led = self.led_under_head()
+        if led is None:
+            return assets.IO_BAND_COLORS.BLANK
+        return assets.IO_BAND_COLORS(self.cells[led - 1])
+
+    def light_barrier_blocked(self) -> bool:
+        """The light barrier is blocked when the robot is at (or behind) the home position."""
+        return self.motor_position <= 0
+
+    def __str__(self):
+        return decode_band(self.cells)
+
+
+def build_table(compiled):
+    """
+    Converts the compiled table into tuples (new_state, write_symbol, delta) for the
+    interpreter loop. Accept states get no transitions, so the interpreter stops as soon as
+    one is reached.
+    """
+    return [None if transition is None or compiled.accepting[index // COLOR_AMOUNT]
+            else (transition.new_state, transition.write_symbol, transition.delta)
+            for index, transition in enumerate(compiled.table)]
+
+
+def _expired(deadline: float | None) -> bool:
+    return deadline is not None and time.monotonic() >= deadline
+
+
+# pylint: disable=too-many-locals
+def simulate(tm_code, band_input: str = "", max_steps: int = 1_000_000,
+             max_seconds: float | None = None):
+    """
+    Runs the parsed turing machine on an unbounded virtual tape.
+    The head starts on the first character of band_input.
+    max_seconds limits the run time, it is checked every TIME_CHECK_STEPS steps.
+    :return: dict with
+        "result": "accept", "reject" (no transition), "max_steps" (step budget exhausted)
+                  or "timeout" (max_seconds exceeded),
+        "steps", "state", "head" (relative to the first input character) and "tape".
+    """
+    compiled = tm_code.get('compiled') or compile_turing_machine(tm_code)
+    table = build_table(compiled)
+    tape = encode_band_input(band_input) or bytearray([BLANK])
+    deadline = time.monotonic() + max_seconds if max_seconds else None
+    size = len(tape)
+    offset = 0  # index of input character 0 in tape
+    head = 0
+    state = compiled.init
+    steps = 0
+    halted = False
+    while not halted and steps < max_steps and not _expired(deadline):
+        limit = min(max_steps, steps + TIME_CHECK_STEPS)
+        while steps < limit:
+            transition = table[state * COLOR_AMOUNT + tape[head]]
+            if transition is None:
+                halted = True
+                break
+            state, tape[head], move = transition
+            head += move
+            steps += 1
+            if not 0 <= head < size:
+                # grow the tape by its own size on the side the head left it
+                if head < 0:
+                    tape[0:0] = bytes([BLANK]) * size
+                    head += size
+                    offset += size
+                else:
+                    tape.extend(bytes([BLANK]) * size)
+                size += size
+    if compiled.accepting[state]:
+        result = "accept"
+    elif halted:
+        result = "reject"
+    elif steps >= max_steps:
+        result = "max_steps"
+    else:
+        result = "timeout"
+    return {
+        "result": result,
+        "steps": steps,
+        "state": compiled.state_names[state],
+        "head": head - offset,
+        "tape": decode_band(tape)
+    }
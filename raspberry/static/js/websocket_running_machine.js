@@ -2,9 +2,12 @@ $(document).ready(function () {
     //const ctx = document.getElementById("myChart").getContext("2d");
     console.log("Document is ready");
 
+    // the page shows a single robot, the server sends its updates to the room of the robot
+    const robot = document.querySelector('#robot').dataset.robot;
+
     //connect to the socket server.
     //   var socket = io.connect("http://" + document.domain + ":" + location.port);
-    var socket = io.connect();
+    var socket = io.connect({query: {robot: robot}});
     if (socket !== undefined) {
         console.log("Connected to Socket Server");
     } else {
@@ -17,30 +20,55 @@ $(document).ready(function () {
 
     });
 
-    socket.on('state_update', function (data) {
+    // last known machine state, partial updates (data.full === false) are merged into it
+    const machine = {};
+    // sequence number of the last received machine event
+    let lastSeq = 0;
 
-        document.querySelector('#program_name').innerText = data.program_name;
-        document.querySelector('#state').innerText = data.state;
-        document.querySelector('#steps').innerText = data.step;
-        document.querySelector('#position').innerText = (data.position === 0) ? '0 unbekannte Position, Homing' : (data.position === -2) ? 'Band-ende erreicht' : data.position;
-        document.querySelector('#speed').value = data.speed;
-        document.querySelector('#resume_button').className = data.run && !data.pause ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
-        document.querySelector('#pause_button').className = data.pause ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
-        document.querySelector('#stop_button').className = data.should_stop ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
-
-        for (const error of data.errors) {
-            const errorContainer = document.querySelector('#errors');
-            if ([...errorContainer.children].some(el => el.textContent === error)) {
-                continue; // Error already shown
+    // (re)connected: request the events after the last one we have seen
+    socket.on('connect', function () {
+        socket.emit('resume_events', {robot: robot, last_seq: lastSeq});
+    });
+
+    socket.on('machine_events', function (data) {
+        const errorContainer = document.querySelector('#errors');
+        if (data.reset) {
+            errorContainer.replaceChildren();
+        } else if (data.events.length && data.events[0].seq > lastSeq + 1) {
+            // events were missed (e.g. during the connect), fetch them with the gap
+            socket.emit('resume_events', {robot: robot, last_seq: lastSeq});
+            return;
+        }
+        for (const event of data.events) {
+            if (event.seq <= lastSeq && !data.reset) {
+                continue; // already received
+            }
+            lastSeq = event.seq;
+            if (event.type === 'error') {
+                const errorElement = document.createElement('p');
+                errorElement.className = 'text-red-500';
+                errorElement.textContent = event.data;
+                errorContainer.appendChild(errorElement);
             }
-            // add new error-element
-            const errorElement = document.createElement('p');
-            errorElement.className = 'text-red-500';
-            errorElement.textContent = error;
-            errorContainer.appendChild(errorElement);
         }
     });
 
+    socket.on('state_update', function (data) {
+        Object.assign(machine, data);
+
+        if ('program_name' in data) document.querySelector('#program_name').innerText = data.program_name || '-';
+        if ('state' in data) document.querySelector('#state').innerText = data.state;
+        if ('step' in data) document.querySelector('#steps').innerText = data.step;
+        if ('position' in data) document.querySelector('#position').innerText = (data.position === 0) ? '0 unbekannte Position, Homing' : (data.position === -2) ? 'Band-ende erreicht' : data.position;
+        if ('plan' in data) document.querySelector('#plan').innerText = data.plan || '-';
+        if ('speed' in data) document.querySelector('#speed').value = data.speed;
+        if ('queue' in data) document.querySelector('#queue').innerText = data.queue.join(', ') || '-';
+        if ('halted' in data) document.querySelector('#halted').hidden = !data.halted;
+        document.querySelector('#resume_button').className = machine.run && !machine.pause ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
+        document.querySelector('#pause_button').className = machine.pause ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
+        document.querySelector('#stop_button').className = machine.should_stop ? 'bg-blue-500 text-white px-4 py-2 rounded' : 'bg-gray-300 bg-blue-500 px-4 py-2 rounded';
+    });
+
     socket.on('error', function (data) {
         console.error('Error:', data.message);
         alert(data.message); // Fehler als Popup anzeigen
@@ -56,20 +84,20 @@ $(document).ready(function () {
 
     // Event-Handler für den Speed-Input registrieren
     document.querySelector('#speed').addEventListener('change', (event) => {
-        socket.emit('command', {command: 'speed', value: event.target.value});
+        socket.emit('command', {robot: robot, command: 'speed', value: event.target.value});
     });
 
     // Button-Event-Handler registrieren
     document.querySelector('#resume_button').addEventListener('click', () => {
-        socket.emit('command', {command: 'resume'});
+        socket.emit('command', {robot: robot, command: 'resume'});
     });
 
     document.querySelector('#pause_button').addEventListener('click', () => {
-        socket.emit('command', {command: 'pause'});
+        socket.emit('command', {robot: robot, command: 'pause'});
     });
 
     document.querySelector('#stop_button').addEventListener('click', () => {
-        socket.emit('command', {command: 'stop'});
+        socket.emit('command', {robot: robot, command: 'stop'});
     });
 });
 
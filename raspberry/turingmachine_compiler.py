@@ -0,0 +1,107 @@
+"""
+This module contains the compiler for parsed turing machine programs.
+It interns state names and colors as integer IDs and stores the transitions in a flat table,
+so the runtime and the semantic analyzer can use indexed lookups.
+"""
+import assets
+
+# amount of colors on the io band, colors are identified by IO_BAND_COLORS.value
+COLOR_AMOUNT = len(assets.IO_BAND_COLORS)
+
+# head movement per direction in cells
+DIRECTION_DELTA = {
+    assets.ROBOT_DIRECTIONS.LEFT: -1,
+    assets.ROBOT_DIRECTIONS.RIGHT: 1,
+    assets.ROBOT_DIRECTIONS.HOLD: 0
+}
+
+# all valid symbols, parsed programs may contain other symbols as strings
+COLORS = frozenset(assets.IO_BAND_COLORS)
+
+
+class CompiledTransition:
+    """A single transition with the follow-state and the written color as integer IDs."""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('new_state', 'write_symbol', 'move', 'delta')
+
+    def __init__(self, new_state: int, write_symbol: int, move: assets.ROBOT_DIRECTIONS):
+        self.new_state = new_state
+        self.write_symbol = write_symbol
+        self.move = move
+        self.delta = DIRECTION_DELTA[move]
+
+    def __repr__(self):
+        return f"CompiledTransition({self.new_state}, {self.write_symbol}, {self.move})"
+
+
+class CompiledMachine:
+    """
+    Turing machine with integer state IDs.
+    table[state * COLOR_AMOUNT + color] holds the CompiledTransition or None.
+    defined, targeted and accepting are flags per state ID:
+        defined: the state has outgoing transitions,
+        targeted: the state is the follow-state of a transition,
+        accepting: the state is an accept state.
+    """
+    # pylint: disable=too-many-instance-attributes
+    __slots__ = ('state_names', 'state_ids', 'table', 'init', 'defined', 'targeted', 'accepting',
+                 'invalid_symbols', 'invalid_write_symbols')
+
+    def __init__(self):
+        self.state_names = []
+        self.state_ids = {}
+        self.table = []
+        self.init = 0
+        self.defined = bytearray()
+        self.targeted = bytearray()
+        self.accepting = bytearray()
+        # symbols which are no IO_BAND_COLORS, they are not part of the table
+        self.invalid_symbols = []
+        self.invalid_write_symbols = []
+
+    def state_id(self, state: str) -> int:
+        """Returns the ID of the state, new states are appended."""
+        state_id = self.state_ids.get(state)
+        if state_id is None:
+            state_id = len(self.state_names)
+            self.state_ids[state] = state_id
+            self.state_names.append(state)
+            self.table.extend([None] * COLOR_AMOUNT)
+            self.defined.append(0)
+            self.targeted.append(0)
+            self.accepting.append(0)
+        return state_id
+
+    def transition(self, state: int, color: int) -> CompiledTransition | None:
+        """Returns the transition for the state and color IDs or None."""
+        return self.table[state * COLOR_AMOUNT + color]
+
+
+def compile_turing_machine(turing_machine) -> CompiledMachine:
+    """
+    Compiles the parsed turing_machine program into a CompiledMachine.
+    :param turing_machine: the turing_machine programm from parse_turing_machine
+    :return: the CompiledMachine, the init state has the ID 0
+    """
+    compiled = CompiledMachine()
+    compiled.init = compiled.state_id(turing_machine["init"])
+    for (state, symbol), transition in turing_machine["state_transitions"].items():
+        state_id = compiled.state_id(state)
+        new_state = compiled.state_id(transition["new_state"])
+        compiled.defined[state_id] = 1
+        compiled.targeted[new_state] = 1
+        # both symbols are checked, a transition can report both errors
+        valid = True
+        if symbol not in COLORS:
+            compiled.invalid_symbols.append(symbol)
+            valid = False
+        if transition["write_symbol"] not in COLORS:
+            compiled.invalid_write_symbols.append(transition["write_symbol"])
+            valid = False
+        if not valid:
+            continue
+        compiled.table[state_id * COLOR_AMOUNT + symbol.value] = CompiledTransition(
+            new_state, transition["write_symbol"].value, transition["move"])
+    for state in turing_machine["accept"]:
+        compiled.accepting[compiled.state_id(state)] = 1
+    return compiled
@@ -1,6 +1,7 @@
 """
 This module contains the interpreter for the turingmachine-program syntax.
 """
+import hashlib
 import re
 import os
 from collections import defaultdict
@@ -8,7 +9,30 @@ from collections import defaultdict
 import assets
 from assets import PROGRAM_LANGUAGES
 
+import program_artifact
 from semantic_analyzer import semantic_analyzer
+from turingmachine_compiler import compile_turing_machine
+
+# io syntax: state declaration like "carry:"
+IO_STATE_DECLARATION = re.compile(r"^\w+:$")
+
+
+def load_turing_machine(file_path, language: PROGRAM_LANGUAGES = PROGRAM_LANGUAGES.COM):
+    """
+    Loads a Turing machine file. The compiled artifact is used if it matches the source,
+    otherwise the file is parsed (and a new artifact is written).
+
+    Args:
+        file_path (str): Path to the Turing machine file.
+        language (str): Language to parse ("com" (default) or "io").
+
+    Returns:
+        dict: Turing machine configuration like parse_turing_machine.
+    """
+    turing_machine = program_artifact.load_artifact(file_path, language)
+    if turing_machine is None:
+        turing_machine = parse_turing_machine(file_path, language)
+    return turing_machine
 
 
 def parse_turing_machine(file_path, language: PROGRAM_LANGUAGES = PROGRAM_LANGUAGES.COM):
@@ -20,28 +44,57 @@ def parse_turing_machine(file_path, language: PROGRAM_LANGUAGES = PROGRAM_LANGUA
         language (str): Language to parse ("com" (default) or "io").
 
     Returns:
-        dict: Parsed Turing machine configuration and errors.
+        dict: Parsed Turing machine configuration and errors,
+              "compiled" holds the CompiledMachine with the integer transition table.
     """
-    with open(file_path, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        turing_machine = parse_turing_machine_stream(file, language,
+                                                     os.path.basename(file_path), digest)
+    # programs with errors (e.g. of an unknown language) get no artifact
+    program_artifact.write_artifact(file_path, turing_machine, language, digest.digest())
+    return turing_machine
+
 
+def parse_turing_machine_stream(stream, language: PROGRAM_LANGUAGES, filename: str,
+                                digest=None):
+    """
+    Parses a Turing machine program line by line from a binary stream, e.g. an upload.
+    Parsing stops after assets.MAX_PARSE_ERRORS syntax errors.
+
+    Args:
+        stream: binary file-like object with the program.
+        language (str): Language to parse ("com" or "io").
+        filename (str): Name of the program file, used as name of io programs.
+        digest: optional hashlib object, it is updated with every read byte
+                (complete only if the program has no errors).
+
+    Returns:
+        dict: Parsed Turing machine configuration and errors like parse_turing_machine.
+    """
     turing_machine = {
         "name": "",
         "init": "",
         "accept": set(),
         "state_transitions": defaultdict(dict),
+        "compiled": None,
         "errors": [],
         "warnings": []
     }
 
-    if language == PROGRAM_LANGUAGES.IO:
-        # set tm-program name
-        turing_machine["name"] = file_path.split(os.sep)[-1].split(".")[0]
-        _parse_io_syntax(lines, turing_machine)
-    elif language == PROGRAM_LANGUAGES.COM:
-        _parse_com_syntax(lines, turing_machine)
-    else:
-        turing_machine["errors"].append(f"Unbekannte Sprache '{language}'.")
+    lines = _read_lines(stream, turing_machine, digest)
+    try:
+        if language == PROGRAM_LANGUAGES.IO:
+            # set tm-program name
+            turing_machine["name"] = filename.split(".")[0]
+            _parse_io_syntax(lines, turing_machine)
+        elif language == PROGRAM_LANGUAGES.COM:
+            _parse_com_syntax(lines, turing_machine)
+        else:
+            turing_machine["errors"].append(f"Unbekannte Sprache '{language}'.")
+    except _TooManyErrors:
+        turing_machine["errors"].append(
+            f"Abbruch nach {assets.MAX_PARSE_ERRORS} Fehlern, der Rest wurde nicht geprüft.")
 
     # Validate the machine
     if turing_machine["init"] == "":
@@ -52,19 +105,47 @@ def parse_turing_machine(file_path, language: PROGRAM_LANGUAGES = PROGRAM_LANGUA
     if turing_machine["errors"]:
         turing_machine["errors"].append("Syntaxprüfung Fehlgeschlagen.")
 
+    turing_machine["compiled"] = compile_turing_machine(turing_machine)
     return semantic_analyzer(turing_machine)
 
 
+class _TooManyErrors(Exception):
+    """Raised when assets.MAX_PARSE_ERRORS syntax errors were found."""
+
+
+def _syntax_error(turing_machine, message: str):
+    """Adds a syntax error, parsing is stopped when there are too many errors."""
+    turing_machine["errors"].append(message)
+    if len(turing_machine["errors"]) >= assets.MAX_PARSE_ERRORS:
+        raise _TooManyErrors()
+
+
+def _read_lines(stream, turing_machine, digest=None):
+    """
+    Yields (line number, stripped line) of a binary stream, one line in memory at a time.
+    Lines which are no valid UTF-8 are reported as syntax errors.
+    """
+    for line_number, raw_line in enumerate(stream, start=1):
+        if digest is not None:
+            digest.update(raw_line)
+        try:
+            yield line_number, raw_line.decode('utf-8').strip()
+        except UnicodeDecodeError:
+            _syntax_error(turing_machine, f"Syntaxfehler (Zeile {line_number}): kein gültiges "
+                                          f"UTF-8.")
+
+
 # pylint: disable=too-many-branches
 def _parse_io_syntax(lines, turing_machine):
     """
     Parses the Turing machine in io syntax, allowing symbols in brackets and implicit state
     transitions.
+    :param lines: iterable of (line number, stripped line)
     """
     table_started = False
     current_state = None
 
-    for line in lines:
+    for line_number, line in lines:
         # Remove comments
         line = line.split("#", 1)[0].strip()
         if not line:
@@ -89,7 +170,7 @@ def _parse_io_syntax(lines, turing_machine):
         # Process table
         if table_started:
             # State declaration
-            if re.match(r"^\w+:$", line):
+            if IO_STATE_DECLARATION.match(line):
                 current_state = line[:-1].strip()
                 continue
 
@@ -112,7 +193,8 @@ def _parse_io_syntax(lines, turing_machine):
                         turing_machine["state_transitions"][
                             (current_state, _map_symbol(sym))] = transition
                     else:
-                        turing_machine["errors"].append(f"Ungültige Anweisung: {line}")
+                        _syntax_error(turing_machine,
+                                      f"Ungültige Anweisung (Zeile {line_number}): {line}")
             else:
                 # Handle implicit state transitions like `R` or `L`
                 if current_state and line in {"R", "L"}:
@@ -120,7 +202,8 @@ def _parse_io_syntax(lines, turing_machine):
                     turing_machine["state_transitions"][
                         (current_state, None)] = transition  # `None` represents any symbol
                 else:
-                    turing_machine["errors"].append(f"Ungültige Anweisung: {line}")
+                    _syntax_error(turing_machine,
+                                  f"Ungültige Anweisung (Zeile {line_number}): {line}")
 
 
 def _map_symbol(symbol: str):
@@ -171,7 +254,7 @@ def _parse_io_instruction(instruction, current_state, symbol):
         return {
             "new_state": current_state,  # Stay in the current state
             "write_symbol": _map_symbol(symbol),
-            "move": move_map[instruction]
+            "move": _map_direction(move_map[instruction])
         }
 
     # Full instruction (e.g., "{write: 0, L: carry}")
@@ -214,14 +297,12 @@ def _parse_io_instruction(instruction, current_state, symbol):
 def _parse_com_syntax(lines, turing_machine):
     """
     Parses the Turing machine in com syntax.
+    A transition consists of two lines: "state,symbol" and "new_state,write_symbol,move".
+    :param lines: iterable of (line number, stripped line)
     """
-    string = ""
-    line_number = 0
-
-    for line in lines:
-        line = line.strip()
-        line_number += 1
+    condition = None  # first line of the current transition
 
+    for line_number, line in lines:
         # Skip comments or empty lines
         if not line or line.startswith("//"):
             continue
@@ -236,19 +317,18 @@ def _parse_com_syntax(lines, turing_machine):
             turing_machine["accept"] = set(map(str.strip, accept_states.split(",")))
 
         # Transition section
+        elif condition is None:
+            condition = line
         else:
-            if string == "":
-                string = line
-                continue
-            string = string + "," + line
-            match = string.split(",")
+            match = condition.split(",") + line.split(",")
             if len(match) != 5:
-                turing_machine["errors"].append(f"Syntaxfehler (Zeile {line_number}): {string}")
-                string = ""
+                _syntax_error(turing_machine,
+                              f"Syntaxfehler (Zeile {line_number}): {condition},{line}")
+                condition = None
                 continue
             turing_machine["state_transitions"][(match[0], _map_symbol(match[1]))] = {
                 "new_state": match[2],
                 "write_symbol": _map_symbol(match[3]),
                 "move": _map_direction(match[4])
             }
-            string = ""
+            condition = None